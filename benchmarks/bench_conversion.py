@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""MSG转EML分阶段性能测试
+
+用 msg_corpus.py 生成可重现的合成语料，分别统计每个阶段的耗时：
+openMsg、safe_get_str解码、extract_original_headers、create_attachment_mime、
+构建邮件对象、序列化（write_eml，相当于原来的as_string）和写出文件，
+再测量端到端的吞吐量（文件/秒、MB/秒）、峰值内存，以及命令行的启动耗时
+（--help、转换单个文件和各个顶层模块的导入耗时），结果保存为JSON。
+指定 --compare 时与之前保存的结果逐项对比。
+
+--msg-reader mmap 使用内置的内存映射读取器代替extract_msg。
+
+运行: python benchmarks/bench_conversion.py [--count 200] [--msg-reader mmap] [--output result.json] [--compare old.json]
+"""
+
+import argparse
+import datetime
+import importlib.metadata
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import msg_corpus  # noqa: E402
+
+# 逐个解码的文本属性
+DECODED_ATTRIBUTES = ('subject', 'sender', 'to', 'cc', 'body', 'htmlBody', 'messageId')
+
+SCRIPT = os.path.join(ROOT, "msg-to-eml-converter.py")
+
+STAGES = ('open', 'decode', 'headers', 'attachments', 'build', 'serialize', 'write')
+
+
+def load_converter():
+    """加载转换器脚本（文件名包含连字符，不能直接import）"""
+    spec = importlib.util.spec_from_file_location("msg_to_eml_converter", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class NullWriter(io.RawIOBase):
+    """只计数不保存的二进制输出"""
+
+    def __init__(self):
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def time_stages(converter, engine, paths, output_dir):
+    """逐个文件、逐个阶段计时，返回 阶段 -> [秒]"""
+    timings = {stage: [] for stage in STAGES}
+    clock = time.perf_counter
+
+    for path in paths:
+        start = clock()
+        msg = engine.open_message(path)
+        timings['open'].append(clock() - start)
+        try:
+            snapshot = converter.MessageSnapshot(msg)
+
+            start = clock()
+            for attr in DECODED_ATTRIBUTES:
+                engine.safe_get_str(snapshot, attr)
+            timings['decode'].append(clock() - start)
+
+            start = clock()
+            engine.extract_original_headers(snapshot)
+            timings['headers'].append(clock() - start)
+
+            start = clock()
+            for index, attachment in enumerate(snapshot.attachments or ()):
+                filename = engine.get_attachment_filename(attachment, index)
+                engine.create_attachment_mime(attachment, filename)
+            timings['attachments'].append(clock() - start)
+
+            # 构建使用新的快照，计入完整的属性读取和解码
+            start = clock()
+            email_msg = engine.build_eml_message(converter.MessageSnapshot(msg))
+            timings['build'].append(clock() - start)
+
+            start = clock()
+            engine.write_eml(email_msg, NullWriter())
+            timings['serialize'].append(clock() - start)
+
+            start = clock()
+            engine.write_output(email_msg, path, output_dir)
+            timings['write'].append(clock() - start)
+        finally:
+            msg.close()
+
+    return timings
+
+
+def summarize(samples):
+    """单个阶段的统计（毫秒）"""
+    ordered = sorted(samples)
+    return {
+        'calls': len(samples),
+        'total_s': round(sum(samples), 6),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def measure_throughput(converter, engine, paths, output_dir):
+    """端到端转换（engine.convert），返回吞吐量统计"""
+    input_bytes = sum(os.path.getsize(path) for path in paths)
+    failed = 0
+    start = time.perf_counter()
+    for path in paths:
+        if engine.convert(path, output_dir)['status'] != 'success':
+            failed += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'files': len(paths),
+        'failed': failed,
+        'input_mb': round(input_bytes / 1024 / 1024, 3),
+        'elapsed_s': round(elapsed, 6),
+        'files_per_s': round(len(paths) / elapsed, 3),
+        'mb_per_s': round(input_bytes / 1024 / 1024 / elapsed, 3),
+    }
+
+
+def _run_seconds(command, repeat):
+    """运行命令repeat次，返回最短耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def import_breakdown(limit=10):
+    """用 -X importtime 统计加载转换器脚本时耗时最多的顶层模块（毫秒）"""
+    code = ("import importlib.util as u; s = u.spec_from_file_location('msg_to_eml_converter', %r); "
+            "s.loader.exec_module(u.module_from_spec(s))" % SCRIPT)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=False).stderr
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 只统计顶层导入（缩进的是被嵌套导入的模块）
+        if not name[1:2].isspace():
+            modules[name.strip()] = int(cumulative) / 1000
+    return dict(sorted(modules.items(), key=lambda item: -item[1])[:limit])
+
+
+def measure_startup(sample_path, work_dir, msg_reader, repeat=5):
+    """命令行各入口的启动耗时（秒，取多次运行的最短值）"""
+    python = sys.executable
+    return {
+        'python_bare_s': round(_run_seconds([python, '-c', 'pass'], repeat), 4),
+        'help_s': round(_run_seconds([python, SCRIPT, '--help'], repeat), 4),
+        'convert_one_s': round(_run_seconds(
+            [python, SCRIPT, sample_path, '-o', os.path.join(work_dir, 'startup'),
+             '--msg-reader', msg_reader], repeat), 4),
+        'imports_ms': import_breakdown(),
+    }
+
+
+def compare(current, previous):
+    """打印与之前结果的对比（耗时比例小于1表示变快）"""
+    print(f"\n与 {previous.get('timestamp', '?')} 的结果对比:")
+    print(f"{'阶段':<14}{'之前(ms)':>12}{'当前(ms)':>12}{'比例':>9}")
+    for stage, stats in current['stages'].items():
+        old = previous.get('stages', {}).get(stage)
+        if old:
+            ratio = stats['mean_ms'] / old['mean_ms'] if old['mean_ms'] else float('inf')
+            print(f"{stage:<14}{old['mean_ms']:>12.3f}{stats['mean_ms']:>12.3f}{ratio:>8.2f}x")
+    old = previous.get('throughput', {}).get('files_per_s')
+    if old:
+        new = current['throughput']['files_per_s']
+        print(f"{'files/s':<14}{old:>12.2f}{new:>12.2f}{new / old:>8.2f}x")
+    for key in ('help_s', 'convert_one_s'):
+        old = (previous.get('startup') or {}).get(key)
+        new = (current.get('startup') or {}).get(key)
+        if old and new:
+            print(f"{key:<14}{old * 1000:>12.1f}{new * 1000:>12.1f}{new / old:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    msg_corpus.add_corpus_arguments(parser)
+    parser.add_argument('--corpus-dir', help="语料目录（默认使用临时目录，运行后删除）")
+    parser.add_argument('--output', help="结果JSON文件")
+    parser.add_argument('--compare', help="与之前保存的结果JSON对比")
+    parser.add_argument('--msg-reader', default='extract_msg', choices=('extract_msg', 'mmap'),
+                        help="MSG读取方式（默认extract_msg）")
+    parser.add_argument('--no-startup', action='store_true', help="不测量命令行启动耗时")
+    args = parser.parse_args()
+
+    converter = load_converter()
+    if not converter.EXTRACT_MSG_AVAILABLE:
+        sys.exit("请先安装 extract-msg 库")
+
+    work_dir = tempfile.mkdtemp(prefix='msg_bench_')
+    try:
+        corpus_dir = args.corpus_dir or os.path.join(work_dir, 'corpus')
+        files = msg_corpus.generate_corpus(corpus_dir, args.count, args.seed,
+                                           **msg_corpus.corpus_options(args))
+        paths = [path for path, _ in files]
+        engine = converter.MSGConversionEngine(converter.ConversionOptions(msg_reader=args.msg_reader))
+
+        # 先完整跑一遍预热（导入、编码检测后端加载等），不计入结果
+        engine.convert(paths[0], os.path.join(work_dir, 'warmup'))
+
+        timings = time_stages(converter, engine, paths, os.path.join(work_dir, 'stages'))
+        throughput = measure_throughput(converter, engine, paths, os.path.join(work_dir, 'convert'))
+        startup = None if args.no_startup else measure_startup(paths[0], work_dir, args.msg_reader)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'extract_msg': importlib.metadata.version('extract-msg'),
+        'msg_reader': args.msg_reader,
+        'corpus': dict(msg_corpus.corpus_options(args), count=args.count, seed=args.seed),
+        'stages': {stage: summarize(samples) for stage, samples in timings.items() if samples},
+        'throughput': throughput,
+        'peak_rss_mb': peak_rss_mb(),
+        'startup': startup,
+    }
+
+    print(f"{'阶段':<14}{'平均(ms)':>12}{'P95(ms)':>12}{'合计(s)':>10}")
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<14}{stats['mean_ms']:>12.3f}{stats['p95_ms']:>12.3f}{stats['total_s']:>10.3f}")
+    print(f"\n吞吐量: {throughput['files_per_s']:.2f} 文件/秒, {throughput['mb_per_s']:.2f} MB/秒"
+          f"（{throughput['files']} 个文件, 失败 {throughput['failed']} 个）")
+    if result['peak_rss_mb'] is not None:
+        print(f"峰值内存: {result['peak_rss_mb']:.1f} MB")
+    if startup:
+        print(f"启动耗时: 空解释器 {startup['python_bare_s'] * 1000:.0f} ms, "
+              f"--help {startup['help_s'] * 1000:.0f} ms, 转换单个文件 {startup['convert_one_s'] * 1000:.0f} ms")
+        print("导入耗时最多的模块: " + ", ".join(f"{name} {ms:.0f}ms"
+                                          for name, ms in startup['imports_ms'].items()))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Base64 / Quoted-Printable 检测性能对比
+
+对比当前的 decode_base64_text / is_quoted_printable_encoded 与改写前的逐字符
+实现，先确认两者在一组边界输入上结果一致，再分别计时。
+
+运行: python benchmarks/bench_decode_detection.py [--size-mb 4] [--repeat 5]
+"""
+
+import argparse
+import base64
+import importlib.util
+import os
+import quopri
+import random
+import re
+import string
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_converter():
+    """加载转换器脚本（文件名包含连字符，不能直接import）"""
+    spec = importlib.util.spec_from_file_location(
+        "msg_to_eml_converter", os.path.join(ROOT, "msg-to-eml-converter.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_is_base64_encoded(text):
+    """改写前的实现"""
+    if not text or len(text) < 4:
+        return False
+    base64_chars = string.ascii_letters + string.digits + '+/='
+    cleaned = text.replace('\n', '').replace('\r', '').replace(' ', '')
+    if not all(c in base64_chars for c in cleaned):
+        return False
+    if len(cleaned) % 4 != 0:
+        return False
+    try:
+        base64.b64decode(cleaned, validate=True)
+        return len(cleaned) > 20
+    except Exception:
+        return False
+
+
+def legacy_decode_base64(text):
+    """改写前 auto_decode_content 中的检测加解码（解码两次）"""
+    if legacy_is_base64_encoded(text):
+        return base64.b64decode(text)
+    return None
+
+
+def legacy_is_quoted_printable_encoded(text):
+    """改写前的实现"""
+    if not text:
+        return False
+    qp_pattern = re.compile(r'=([0-9A-Fa-f]{2})')
+    return bool(qp_pattern.search(text))
+
+
+def edge_cases():
+    """用于校验结果一致的输入"""
+    rng = random.Random(7)
+    cases = [
+        "", "abc", "abcd", "YWJj", "YWJjZGVmZ2hpamtsbW5vcHFy",
+        "YWJjZGVmZ2hpamtsbW5vcHFyc3R1", "YWJjZGVmZ2hpamtsbW5vcHFyc3R1\n",
+        "YWJjZGVm\r\nZ2hpamts bW5vcHFyc3R1", "YWJjZGVmZ2hpamtsbW5vcHFyc3Q=",
+        "YWJjZGVmZ2hpamtsbW5vcHFyc3==", "YWJjZGVmZ2hp=amtsbW5vcHFyc3R1",
+        "YWJjZGVmZ2hpamtsbW5vcHFyc===", "YWJjZGVmZ2hpamtsbW5vcHFyc3Q=\n",
+        "YWJjZGVmZ2hpamtsbW5vcHFyc3Q= \n", "YWJjZGVmZ2hpamtsbW5vcHFyc3Q\t=",
+        "Hello world, this is plain text.", "=E4=B8=AD=E6=96=87", "a = b",
+        "中文内容" * 10,
+    ]
+    alphabet = string.ascii_letters + string.digits + "+/= \r\n"
+    for _ in range(2000):
+        length = rng.randint(0, 60)
+        cases.append(''.join(rng.choice(alphabet) for _ in range(length)))
+    for _ in range(200):
+        data = os.urandom(rng.randint(0, 80))
+        cases.append(base64.encodebytes(data).decode('ascii'))
+        cases.append(base64.b64encode(data).decode('ascii'))
+    return cases
+
+
+def make_inputs(size):
+    """生成大正文样本"""
+    raw = os.urandom(size * 3 // 4)
+    plain = ("The quick brown fox jumps over the lazy dog. " * (size // 45 + 1))[:size]
+    return {
+        'base64正文': base64.encodebytes(raw).decode('ascii'),
+        '普通正文': plain,
+        'QP正文': quopri.encodestring(("中文内容 " * (size // 13 + 1)).encode('utf-8')[:size]).decode('ascii'),
+        '无QP转义': plain.replace('=', ''),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    converter = load_converter()
+    engine = converter.MSGConversionEngine()
+
+    for text in edge_cases():
+        assert engine.decode_base64_text(text) == legacy_decode_base64(text), repr(text)
+        assert engine.is_quoted_printable_encoded(text) == legacy_is_quoted_printable_encoded(text), repr(text)
+    print("结果一致性检查通过")
+
+    inputs = make_inputs(int(args.size_mb * 1024 * 1024))
+    print(f"{'输入':<10}{'函数':<14}{'改写前(ms)':>12}{'当前(ms)':>12}{'加速':>11}")
+    for name, text in inputs.items():
+        pairs = [
+            ('base64', legacy_decode_base64, engine.decode_base64_text),
+            ('qp', legacy_is_quoted_printable_encoded, engine.is_quoted_printable_encoded),
+        ]
+        for label, legacy, current in pairs:
+            old = min(timeit.repeat(lambda: legacy(text), number=1, repeat=args.repeat)) * 1000
+            new = min(timeit.repeat(lambda: current(text), number=1, repeat=args.repeat)) * 1000
+            print(f"{name:<10}{label:<14}{old:>12.2f}{new:>12.2f}{old / max(new, 1e-6):>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
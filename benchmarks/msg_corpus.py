@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""合成MSG测试语料生成器
+
+不依赖Outlook，直接写出OLE复合文档格式（CFB v3）的MSG文件。同一个种子总是
+生成相同的语料，可以在不同的代码版本之间对比性能。可调整正文大小、纯文本/HTML、
+字符集、附件数量和大小，以及嵌入的MSG消息。
+
+运行: python benchmarks/msg_corpus.py OUTPUT_DIR [--count 100] [--seed 1]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import struct
+
+# ---------------------------------------------------------------- CFB写入
+
+SECTOR_SIZE = 512
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+
+FREESECT = 0xFFFFFFFF
+ENDOFCHAIN = 0xFFFFFFFE
+FATSECT = 0xFFFFFFFD
+DIFSECT = 0xFFFFFFFC
+NOSTREAM = 0xFFFFFFFF
+
+# 每个FAT扇区、DIFAT扇区可容纳的条目数
+FAT_ENTRIES = SECTOR_SIZE // 4
+DIFAT_ENTRIES = FAT_ENTRIES - 1
+HEADER_DIFAT_ENTRIES = 109
+
+
+class Storage:
+    """复合文档中的存储（目录），children为 名称 -> Storage 或 bytes"""
+
+    def __init__(self):
+        self.children = {}
+
+    def add_stream(self, name, data):
+        self.children[name] = bytes(data)
+
+    def add_storage(self, name):
+        storage = self.children[name] = Storage()
+        return storage
+
+
+def _sort_key(name):
+    # CFB规定的同级排序：先比较长度，再比较大写后的名称
+    return (len(name), name.upper())
+
+
+def _chain(fat, start, count):
+    """在分配表中写入从start开始、连续count个扇区的链"""
+    for index in range(start, start + count - 1):
+        fat[index] = index + 1
+    if count:
+        fat[start + count - 1] = ENDOFCHAIN
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def write_compound_file(root, fp):
+    """把Storage树写成CFB v3文件"""
+    entries = []        # [名称, 类型, 子节点, 左, 右, 起始扇区, 大小]
+    big_streams = []    # (目录项序号, data)
+    small_streams = []
+
+    def add_entry(name, node):
+        index = len(entries)
+        entries.append([name, 1 if isinstance(node, Storage) else 2, NOSTREAM, NOSTREAM, NOSTREAM, 0, 0])
+        if isinstance(node, Storage):
+            entries[index][2] = add_children(node)
+        elif len(node) >= MINI_STREAM_CUTOFF:
+            big_streams.append((index, node))
+        else:
+            small_streams.append((index, node))
+        return index
+
+    def add_children(storage):
+        # 按排序结果构造平衡二叉树，返回根节点
+        indexes = [add_entry(name, storage.children[name])
+                   for name in sorted(storage.children, key=_sort_key)]
+
+        def build(low, high):
+            if low >= high:
+                return NOSTREAM
+            middle = (low + high) // 2
+            entry = entries[indexes[middle]]
+            entry[3] = build(low, middle)
+            entry[4] = build(middle + 1, high)
+            return indexes[middle]
+
+        return build(0, len(indexes))
+
+    entries.append(['Root Entry', 5, NOSTREAM, NOSTREAM, NOSTREAM, ENDOFCHAIN, 0])
+    entries[0][2] = add_children(root)
+
+    # 小于4096字节的流放在迷你流中
+    mini_fat = []
+    mini_stream = bytearray()
+    for index, data in small_streams:
+        if not data:
+            entries[index][5] = ENDOFCHAIN
+            continue
+        count = _ceil_div(len(data), MINI_SECTOR_SIZE)
+        start = len(mini_fat)
+        mini_fat.extend([FREESECT] * count)
+        _chain(mini_fat, start, count)
+        entries[index][5:7] = [start, len(data)]
+        mini_stream += data
+        mini_stream += b'\0' * (count * MINI_SECTOR_SIZE - len(data))
+
+    # 依次分配：大流、迷你流、迷你FAT、目录、FAT、DIFAT
+    layout = []
+    next_sector = 0
+
+    def allocate(count):
+        nonlocal next_sector
+        start = next_sector
+        next_sector += count
+        return start
+
+    for index, data in big_streams:
+        count = _ceil_div(len(data), SECTOR_SIZE)
+        start = allocate(count)
+        entries[index][5:7] = [start, len(data)]
+        layout.append((start, count, data))
+
+    mini_stream_sectors = _ceil_div(len(mini_stream), SECTOR_SIZE)
+    if mini_stream:
+        entries[0][5:7] = [allocate(mini_stream_sectors), len(mini_stream)]
+        layout.append((entries[0][5], mini_stream_sectors, bytes(mini_stream)))
+
+    mini_fat_bytes = b''.join(struct.pack('<I', value) for value in mini_fat)
+    mini_fat_sectors = _ceil_div(len(mini_fat_bytes), SECTOR_SIZE)
+    mini_fat_start = allocate(mini_fat_sectors) if mini_fat_sectors else ENDOFCHAIN
+    if mini_fat_sectors:
+        layout.append((mini_fat_start, mini_fat_sectors, mini_fat_bytes))
+
+    directory = bytearray()
+    for name, kind, child, left, right, start, size in entries:
+        encoded = name.encode('utf-16-le')
+        directory += struct.pack('<64sHBBIII16sIQQIQ',
+                                 encoded, len(encoded) + 2, kind, 1, left, right, child,
+                                 b'\0' * 16, 0, 0, 0, start, size)
+    while len(directory) % SECTOR_SIZE:
+        directory += struct.pack('<64sHBBIII16sIQQIQ', b'', 0, 0, 0, NOSTREAM, NOSTREAM, NOSTREAM,
+                                 b'\0' * 16, 0, 0, 0, 0, 0)
+    directory_sectors = len(directory) // SECTOR_SIZE
+    directory_start = allocate(directory_sectors)
+    layout.append((directory_start, directory_sectors, bytes(directory)))
+
+    # FAT扇区本身也占用FAT条目，反复计算直到数量稳定
+    data_sectors = next_sector
+    fat_sectors = difat_sectors = 0
+    while True:
+        needed_fat = _ceil_div(data_sectors + fat_sectors + difat_sectors, FAT_ENTRIES)
+        needed_difat = _ceil_div(max(0, needed_fat - HEADER_DIFAT_ENTRIES), DIFAT_ENTRIES)
+        if (needed_fat, needed_difat) == (fat_sectors, difat_sectors):
+            break
+        fat_sectors, difat_sectors = needed_fat, needed_difat
+    fat_start = allocate(fat_sectors)
+    difat_start = allocate(difat_sectors) if difat_sectors else ENDOFCHAIN
+
+    fat = [FREESECT] * (fat_sectors * FAT_ENTRIES)
+    for start, count, _ in layout:
+        _chain(fat, start, count)
+    for index in range(fat_sectors):
+        fat[fat_start + index] = FATSECT
+    for index in range(difat_sectors):
+        fat[difat_start + index] = DIFSECT
+
+    fat_locations = list(range(fat_start, fat_start + fat_sectors))
+    header_difat = fat_locations[:HEADER_DIFAT_ENTRIES]
+    header_difat += [FREESECT] * (HEADER_DIFAT_ENTRIES - len(header_difat))
+
+    header = struct.pack('<8s16sHHHHH6sIIIIIIIII',
+                         b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1', b'\0' * 16,
+                         0x3E, 3, 0xFFFE, 9, 6, b'\0' * 6,
+                         0, fat_sectors, directory_start, 0, MINI_STREAM_CUTOFF,
+                         mini_fat_start, mini_fat_sectors, difat_start, difat_sectors)
+    fp.write(header + struct.pack('<109I', *header_difat))
+
+    for start, count, data in layout:
+        fp.write(data)
+        fp.write(b'\0' * (count * SECTOR_SIZE - len(data)))
+    fp.write(struct.pack(f'<{len(fat)}I', *fat))
+
+    remaining = fat_locations[HEADER_DIFAT_ENTRIES:]
+    for index in range(difat_sectors):
+        chunk = remaining[index * DIFAT_ENTRIES:(index + 1) * DIFAT_ENTRIES]
+        chunk += [FREESECT] * (DIFAT_ENTRIES - len(chunk))
+        next_difat = difat_start + index + 1 if index + 1 < difat_sectors else ENDOFCHAIN
+        fp.write(struct.pack(f'<{DIFAT_ENTRIES}II', *chunk, next_difat))
+
+
+# ---------------------------------------------------------------- MSG属性
+
+PT_LONG = 0x0003
+PT_SYSTIME = 0x0040
+PT_STRING8 = 0x001E
+PT_UNICODE = 0x001F
+PT_BINARY = 0x0102
+PT_OBJECT = 0x000D
+
+ATTACH_BY_VALUE = 1
+ATTACH_EMBEDDED_MSG = 5
+
+# 字符集名称 -> (Windows代码页, Python编码)，unicode表示使用UTF-16属性
+CHARSETS = {
+    'unicode': (None, 'utf-16-le'),
+    'cp1252': (1252, 'cp1252'),
+    'gbk': (936, 'gbk'),
+    'shift_jis': (932, 'shift_jis'),
+    'utf-8': (65001, 'utf-8'),
+}
+
+_WORDS = {
+    'unicode': "会议 通知 报告 季度 项目 进度 Meeting report quarterly status review budget".split(),
+    'cp1252': "café naïve résumé façade meeting report quarterly status review budget".split(),
+    'gbk': "会议 通知 报告 季度 项目 进度 预算 审核 客户 合同".split(),
+    'shift_jis': "会議 通知 報告 四半期 予算 進捗 レビュー 顧客 契約 資料".split(),
+    'utf-8': "会议 meeting 報告 café 進捗 report отчёт review".split(),
+}
+
+
+class PropertyWriter:
+    """收集一个消息、收件人或附件对象的属性，写入对应的存储"""
+
+    def __init__(self, storage, codepage_encoding):
+        self.storage = storage
+        self.encoding = codepage_encoding
+        self.fixed = []
+
+    def string(self, prop_id, text):
+        # 流中不含结尾的空字符，属性表中的大小包含空字符
+        if self.encoding == 'utf-16-le':
+            self.binary(prop_id, text.encode('utf-16-le'), PT_UNICODE, terminator=2)
+        else:
+            self.binary(prop_id, text.encode(self.encoding, errors='replace'), PT_STRING8, terminator=1)
+
+    def binary(self, prop_id, data, prop_type=PT_BINARY, terminator=0):
+        self.storage.add_stream(f'__substg1.0_{prop_id:04X}{prop_type:04X}', data)
+        self.fixed.append(struct.pack('<IIII', (prop_id << 16) | prop_type, 6, len(data) + terminator, 0))
+
+    def long(self, prop_id, value):
+        self.fixed.append(struct.pack('<IIiI', (prop_id << 16) | PT_LONG, 6, value, 0))
+
+    def time(self, prop_id, when):
+        # FILETIME：自1601年起的100纳秒数
+        delta = when - datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc)
+        value = (delta.days * 86400 + delta.seconds) * 10 ** 7 + delta.microseconds * 10
+        self.fixed.append(struct.pack('<IIQ', (prop_id << 16) | PT_SYSTIME, 6, value))
+
+    def object(self, prop_id):
+        self.fixed.append(struct.pack('<IIII', (prop_id << 16) | PT_OBJECT, 6, 0xFFFFFFFF, 0))
+
+    def finish(self, header):
+        self.storage.add_stream('__properties_version1.0', header + b''.join(self.fixed))
+
+
+def _text(rng, words, size):
+    """生成约size字节（UTF-8计）的文本"""
+    parts = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(words) for _ in range(12))
+        parts.append(line)
+        length += len(line.encode('utf-8')) + 2
+    return '\r\n'.join(parts)
+
+
+def _fill_message(storage, rng, spec, when, depth, top_level):
+    """把一封邮件的属性写入storage"""
+    codepage, encoding = CHARSETS[spec['charset']]
+    words = _WORDS[spec['charset']]
+    props = PropertyWriter(storage, encoding)
+
+    subject = ' '.join(rng.choice(words) for _ in range(6))
+    body = _text(rng, words, spec['body_size'])
+    sender = f"user{rng.randrange(1000)}@example.com"
+    recipient = f"dest{rng.randrange(1000)}@example.org"
+    message_id = f"<{rng.getrandbits(64):016x}.{depth}@bench.example>"
+
+    props.string(0x001A, 'IPM.Note')
+    props.string(0x0037, subject)
+    props.string(0x0C1A, f"Sender {rng.randrange(100)}")
+    props.string(0x0C1F, sender)
+    props.string(0x5D01, sender)
+    props.string(0x0E04, f"Dest <{recipient}>")
+    props.string(0x1035, message_id)
+    props.string(0x1000, body)
+    props.time(0x0039, when)
+    props.time(0x0E06, when)
+    if codepage:
+        props.long(0x3FFD, codepage)
+        props.long(0x3FDE, codepage)
+    if spec['html']:
+        html = f"<html><body><p>{body.replace(chr(13) + chr(10), '</p><p>')}</p></body></html>"
+        props.binary(0x1013, html.encode(encoding if codepage else 'utf-8', errors='replace'))
+
+    received = []
+    for hop in range(rng.randint(1, 4)):
+        received.append(f"Received: from mx{hop}.example.net (mx{hop}.example.net "
+                        f"[192.0.2.{rng.randrange(1, 255)}])\r\n\tby relay{hop}.example.com; "
+                        f"{when.strftime('%a, %d %b %Y %H:%M:%S +0000')}")
+    headers = '\r\n'.join(received + [
+        f"Message-ID: {message_id}",
+        f"From: {sender}",
+        f"To: {recipient}",
+        f"Subject: {subject}",
+        f"Date: {when.strftime('%a, %d %b %Y %H:%M:%S +0000')}",
+        "MIME-Version: 1.0",
+    ]) + '\r\n\r\n'
+    props.string(0x007D, headers)
+
+    # 收件人
+    recip = PropertyWriter(storage.add_storage('__recip_version1.0_#00000000'), encoding)
+    recip.string(0x3001, 'Dest')
+    recip.string(0x39FE, recipient)
+    recip.string(0x3003, recipient)
+    recip.long(0x0C15, 1)
+    recip.long(0x3000, 0)
+    recip.finish(b'\0' * 8)
+
+    # 附件
+    attachments = spec['attachments']
+    embedded = depth < spec['embedded_depth']
+    count = len(attachments) + (1 if embedded else 0)
+    for index, size in enumerate(attachments):
+        attach = PropertyWriter(storage.add_storage(f'__attach_version1.0_#{index:08X}'), encoding)
+        name = f"file{index}.{rng.choice(['bin', 'pdf', 'txt', 'png'])}"
+        attach.long(0x3705, ATTACH_BY_VALUE)
+        attach.long(0x0E21, index)
+        attach.string(0x3707, name)
+        attach.string(0x3704, name)
+        attach.string(0x370E, 'application/octet-stream')
+        attach.binary(0x3701, rng.randbytes(size))
+        attach.finish(b'\0' * 8)
+    if embedded:
+        index = len(attachments)
+        attach_storage = storage.add_storage(f'__attach_version1.0_#{index:08X}')
+        attach = PropertyWriter(attach_storage, encoding)
+        attach.long(0x3705, ATTACH_EMBEDDED_MSG)
+        attach.long(0x0E21, index)
+        attach.string(0x3001, 'Forwarded message')
+        attach.object(0x3701)
+        attach.finish(b'\0' * 8)
+        inner = dict(spec, attachments=spec['attachments'][:1])
+        _fill_message(attach_storage.add_storage('__substg1.0_3701000D'), rng, inner,
+                      when - datetime.timedelta(days=1), depth + 1, False)
+
+    # 顶层消息的属性头多8个保留字节
+    header = struct.pack('<8sIIII', b'', 1, count, 1, count)
+    props.finish(header + (b'\0' * 8 if top_level else b''))
+    if top_level:
+        nameid = storage.add_storage('__nameid_version1.0')
+        for stream in ('__substg1.0_00020102', '__substg1.0_00030102', '__substg1.0_00040102'):
+            nameid.add_stream(stream, b'')
+
+
+def write_msg(path, spec, seed):
+    """按spec写出一个MSG文件"""
+    rng = random.Random(seed)
+    when = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + \
+        datetime.timedelta(minutes=rng.randrange(525600))
+    root = Storage()
+    _fill_message(root, rng, spec, when, 0, True)
+    with open(path, 'wb') as f:
+        write_compound_file(root, f)
+
+
+def corpus_specs(count, seed, body_kb=(1, 64), html_ratio=0.5, charsets=tuple(CHARSETS),
+                 attachments=(0, 3), attachment_kb=(1, 512), embedded_ratio=0.1):
+    """生成count个邮件的参数，同一seed结果相同"""
+    rng = random.Random(seed)
+    for index in range(count):
+        yield {
+            'body_size': rng.randint(*body_kb) * 1024,
+            'html': rng.random() < html_ratio,
+            'charset': rng.choice(charsets),
+            'attachments': [rng.randint(*attachment_kb) * 1024 for _ in range(rng.randint(*attachments))],
+            'embedded_depth': 1 if rng.random() < embedded_ratio else 0,
+        }
+
+
+def generate_corpus(output_dir, count, seed=1, **kwargs):
+    """生成语料，返回 [(路径, spec)]"""
+    os.makedirs(output_dir, exist_ok=True)
+    files = []
+    for index, spec in enumerate(corpus_specs(count, seed, **kwargs)):
+        path = os.path.join(output_dir, f"bench_{index:05d}.msg")
+        write_msg(path, spec, seed * 1000003 + index)
+        files.append((path, spec))
+    return files
+
+
+def _range(text):
+    low, _, high = text.partition(',')
+    return int(low), int(high or low)
+
+
+def add_corpus_arguments(parser):
+    """语料参数（基准测试脚本共用）"""
+    parser.add_argument('--count', type=int, default=100, help="生成的文件数")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    parser.add_argument('--body-kb', type=_range, default=(1, 64), help="正文大小范围（KB），如 1,64")
+    parser.add_argument('--html-ratio', type=float, default=0.5, help="带HTML正文的比例")
+    parser.add_argument('--charsets', default=','.join(CHARSETS),
+                        help=f"使用的字符集，逗号分隔（可选: {', '.join(CHARSETS)}）")
+    parser.add_argument('--attachments', type=_range, default=(0, 3), help="每封邮件的附件数范围")
+    parser.add_argument('--attachment-kb', type=_range, default=(1, 512), help="附件大小范围（KB）")
+    parser.add_argument('--embedded-ratio', type=float, default=0.1, help="包含嵌入MSG的比例")
+
+
+def corpus_options(args):
+    return {
+        'body_kb': args.body_kb,
+        'html_ratio': args.html_ratio,
+        'charsets': tuple(args.charsets.split(',')),
+        'attachments': args.attachments,
+        'attachment_kb': args.attachment_kb,
+        'embedded_ratio': args.embedded_ratio,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output_dir')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    files = generate_corpus(args.output_dir, args.count, args.seed, **corpus_options(args))
+    total = sum(os.path.getsize(path) for path, _ in files)
+    print(f"已生成 {len(files)} 个文件，共 {total / 1024 / 1024:.1f} MB -> {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
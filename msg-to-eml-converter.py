@@ -1,122 +1,4509 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
 import os
+import sys
+import argparse
 import email
+import email.parser
+import email.policy
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
+from email.mime.message import MIMEMessage
 from email import encoders
 from email.header import Header, decode_header
 from email.utils import formatdate, parsedate_to_datetime, formataddr
+from email.generator import Generator
 import threading
+import time
+import contextlib
+import queue
+import io
 import mimetypes
 import datetime
 import re
 import base64
+import html
+import mmap
+import struct
+import array
+import functools
+import binascii
 import quopri
-import chardet
 import codecs
-import uuid
-import subprocess
+import importlib
+import importlib.util
+import json
+import itertools
+import hashlib
+import shutil
 import platform
+from collections import namedtuple, Counter, deque
+
+# 较重的依赖在第一次用到时才导入，命令行转换单个文件时不加载tkinter、
+# 进程池和编码检测库。图形界面模块由 import_gui() 导入。
+tk = ttk = filedialog = messagebox = None
 
 # 安装命令: pip install extract-msg chardet
-try:
+# （只检查是否已安装，导入extract_msg本身要一百多毫秒，见 open_msg）
+EXTRACT_MSG_AVAILABLE = importlib.util.find_spec('extract_msg') is not None
+
+
+def import_gui():
+    """导入tkinter，无界面环境（如Linux服务器）下没有tkinter时返回False"""
+    global tk, ttk, filedialog, messagebox
+    try:
+        import tkinter as tk
+        from tkinter import ttk, filedialog, messagebox
+    except ImportError:
+        return False
+    return True
+
+
+def open_msg(msg_path):
+    """用extract_msg打开MSG文件（第一次调用时导入extract_msg）"""
     import extract_msg
-    EXTRACT_MSG_AVAILABLE = True
-except ImportError:
-    EXTRACT_MSG_AVAILABLE = False
+    return extract_msg.openMsg(msg_path)
 
-class EnhancedMSGToEMLConverter:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("MSG转EML转换器")
-        # 设置窗口大小并居中
-        window_width = 1100
-        window_height = 800
-        screen_width = self.root.winfo_screenwidth()
-        screen_height = self.root.winfo_screenheight()
-        x = (screen_width // 2) - (window_width // 2)
-        y = (screen_height // 2) - (window_height // 2)
-        self.root.geometry(f"{window_width}x{window_height}+{x}+{y}")
-        self.root.update_idletasks()
-        self.root.resizable(True, True)
-        
-        # 设置应用图标（如果有）
+
+# 可选的MSG读取方式：extract_msg（默认）或内置的内存映射读取器（见 MappedMessage）
+MSG_READERS = ('extract_msg', 'mmap')
+
+
+class UnsupportedMessageError(Exception):
+    """内存映射读取器不支持的MSG文件（改用extract_msg读取）"""
+
+
+class CompoundFileError(UnsupportedMessageError):
+    """复合文件结构损坏或不符合规范"""
+
+
+# 复合文件（CFB）的特殊扇区编号
+CFB_MAX_SECTOR = 0xFFFFFFFA
+CFB_END_OF_CHAIN = 0xFFFFFFFE
+CFB_NO_STREAM = 0xFFFFFFFF
+CFB_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+_CFB_HEADER = struct.Struct('<8s16sHHHHH6sIIIIIIIII')
+_CFB_DIRECTORY_ENTRY = struct.Struct('<64sHBBIII16sIQQIQ')
+
+
+class CompoundFile:
+    """以内存映射方式读取的复合文件（MSG文件的容器格式）
+
+    打开时只读取文件头、FAT和目录一次，流的内容在用到时才从映射中取出：
+    扇区连续存放的流直接返回memoryview切片，不复制数据；不连续的流拼接为
+    bytes。路径不区分大小写，用'/'分隔。
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # 映射建立后即可关闭文件，映射本身保持有效
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
         try:
-            self.root.iconbitmap('converter.ico')
-        except:
+            self._parse()
+        except BaseException:
+            self.close()
+            raise
+
+    def _parse(self):
+        view = self._view
+        if len(view) < 512 or view[:8] != CFB_SIGNATURE:
+            raise CompoundFileError("不是复合文件")
+        (_, _, _, major, byte_order, sector_shift, mini_shift, _, _, fat_count,
+         first_dir, _, self._mini_cutoff, first_minifat, _, first_difat,
+         difat_count) = _CFB_HEADER.unpack_from(view)
+        if byte_order != 0xFFFE or (major, sector_shift) not in ((3, 9), (4, 12)):
+            raise CompoundFileError("不支持的复合文件版本")
+        self._major = major
+        self._sector_shift = sector_shift
+        self._sector_size = 1 << sector_shift
+        self._mini_size = 1 << mini_shift
+        self._sector_count = (len(view) >> sector_shift) - 1
+
+        # DIFAT：文件头中的109项，之后是DIFAT扇区链（每个扇区最后一项指向下一个）
+        difat = self._read_table(view[_CFB_HEADER.size:512])
+        per_sector = self._sector_size // 4 - 1
+        sector = first_difat
+        for _ in range(difat_count):
+            if sector > CFB_MAX_SECTOR:
+                break
+            entries = self._read_table(self._sector(sector))
+            difat.extend(entries[:per_sector])
+            sector = entries[per_sector]
+        fat_sectors = [s for s in difat[:fat_count] if s <= CFB_MAX_SECTOR]
+        self._fat = self._read_table(b''.join(self._sector(s) for s in fat_sectors))
+
+        # 目录：按红黑树结构展开为 路径 -> 目录项
+        directory = bytes(self._chain_data(first_dir))
+        self._entries = {}
+        entries = []
+        for offset in range(0, len(directory) - _CFB_DIRECTORY_ENTRY.size + 1, _CFB_DIRECTORY_ENTRY.size):
+            (raw_name, name_size, kind, _, left, right, child, _, _, _, _, start,
+             size) = _CFB_DIRECTORY_ENTRY.unpack_from(directory, offset)
+            if major == 3:
+                # 版本3只使用大小的低32位
+                size &= 0xFFFFFFFF
+            name = raw_name[:max(0, name_size - 2)].decode('utf-16-le', errors='replace')
+            entries.append((name, kind, left, right, child, start, size))
+        if not entries or entries[0][1] != 5:
+            raise CompoundFileError("缺少根目录项")
+        self._root = entries[0]
+        self._walk(entries)
+
+        # 迷你流（小于截止大小的流存放在根目录项的流中，以64字节为单位分配）
+        self._minifat = self._read_table(bytes(self._chain_data(first_minifat))) if first_minifat <= CFB_MAX_SECTOR else array.array('I')
+        self._ministream = None
+
+    @staticmethod
+    def _read_table(data):
+        table = array.array('I')
+        table.frombytes(bytes(data))
+        if sys.byteorder == 'big':
+            table.byteswap()
+        return table
+
+    def _walk(self, entries):
+        visited = set()
+        stack = [(entries[0][4], '')]
+        while stack:
+            sid, prefix = stack.pop()
+            if sid == CFB_NO_STREAM:
+                continue
+            if sid >= len(entries) or sid in visited:
+                raise CompoundFileError("目录结构损坏")
+            visited.add(sid)
+            name, kind, left, right, child, start, size = entries[sid]
+            path = prefix + name.lower()
+            self._entries[path] = entries[sid]
+            stack.append((left, prefix))
+            stack.append((right, prefix))
+            if kind == 1:
+                stack.append((child, path + '/'))
+
+    def _sector(self, sector):
+        if sector >= self._sector_count:
+            raise CompoundFileError("扇区编号超出文件范围")
+        offset = (sector + 1) << self._sector_shift
+        return self._view[offset:offset + self._sector_size]
+
+    def _chain(self, start, table):
+        """沿分配表返回扇区链"""
+        chain = []
+        sector = start
+        while sector != CFB_END_OF_CHAIN:
+            if sector >= len(table) or len(chain) > len(table):
+                raise CompoundFileError("扇区链损坏")
+            chain.append(sector)
+            sector = table[sector]
+        return chain
+
+    @staticmethod
+    def _join(source, chain, unit, size):
+        """按扇区链取出数据：扇区连续时返回切片，否则复制拼接"""
+        if len(chain) * unit < size:
+            raise CompoundFileError("流大小超出扇区链")
+        if all(b == a + 1 for a, b in zip(chain, chain[1:])):
+            start = chain[0] * unit if chain else 0
+            return source[start:start + size]
+        return b''.join(source[s * unit:(s + 1) * unit] for s in chain)[:size]
+
+    def _chain_data(self, start, size=None):
+        chain = self._chain(start, self._fat)
+        if size is None:
+            size = len(chain) * self._sector_size
+        if chain and chain[-1] >= self._sector_count:
+            raise CompoundFileError("扇区编号超出文件范围")
+        # 扇区编号加1即为以扇区大小为单位的文件偏移
+        return self._join(self._view, [s + 1 for s in chain], self._sector_size, size)
+
+    def list(self, prefix=''):
+        """prefix目录下的直接子项名称（小写，按名称排序）"""
+        prefix = prefix.lower()
+        names = {path[len(prefix):] for path in self._entries
+                 if path.startswith(prefix) and '/' not in path[len(prefix):]}
+        return sorted(names)
+
+    def is_storage(self, path):
+        entry = self._entries.get(path.lower())
+        return entry is not None and entry[1] == 1
+
+    def stream(self, path):
+        """返回流的内容（memoryview或bytes），不存在时返回None"""
+        entry = self._entries.get(path.lower())
+        if entry is None or entry[1] != 2:
+            return None
+        start, size = entry[5], entry[6]
+        if size == 0:
+            return b''
+        if size >= self._mini_cutoff:
+            return self._chain_data(start, size)
+        if self._ministream is None:
+            self._ministream = self._chain_data(self._root[5], self._root[6])
+        chain = self._chain(start, self._minifat)
+        if chain and (chain[-1] + 1) * self._mini_size > len(self._ministream):
+            raise CompoundFileError("迷你流扇区超出范围")
+        return self._join(self._ministream, chain, self._mini_size, size)
+
+    def close(self):
+        """释放映射；流的切片仍被引用（例如还未写出的附件）时由垃圾回收释放"""
+        self._ministream = None
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
             pass
+
+
+class _MappedObject:
+    """MSG中带属性流的对象（消息、收件人、附件）的公共读取方法"""
+
+    # 属性流中固定长度属性之前的头部字节数：顶层消息32，收件人和附件8
+    _PROPERTY_HEADER_SIZE = 8
+
+    def __init__(self, cf, prefix, message=None):
+        self._cf = cf
+        self._prefix = prefix
+        self._message = message or self
+        data = cf.stream(prefix + '__properties_version1.0')
+        if data is None:
+            raise UnsupportedMessageError("缺少属性流")
+        self._props = {}
+        for offset in range(self._PROPERTY_HEADER_SIZE, len(data) - 15, 16):
+            tag = int.from_bytes(data[offset:offset + 4], 'little')
+            self._props[f"{tag:08X}"] = bytes(data[offset + 8:offset + 16])
+
+    def getPropertyVal(self, name, default=None):
+        """读取固定长度属性（整数、布尔值和时间），不存在时返回default"""
+        raw = self._props.get(name.upper())
+        if raw is None:
+            return default
+        prop_type = name[-4:]
+        if prop_type == '0003':
+            return int.from_bytes(raw[:4], 'little', signed=True)
+        if prop_type == '000B':
+            return bool(raw[0])
+        if prop_type in ('0014', '0040'):
+            return int.from_bytes(raw, 'little')
+        return raw
+
+    def getStream(self, name):
+        return self._cf.stream(self._prefix + name)
+
+    def getStringStream(self, name):
+        """读取字符串属性（按消息的字符串编码解码），不存在时返回None"""
+        message = self._message
+        data = self._cf.stream(self._prefix + name + ('001F' if message.areStringsUnicode else '001E'))
+        return None if data is None else str(data, message.stringEncoding)
+
+    def close(self):
+        self._message.close()
+
+
+class MappedAttachment(_MappedObject):
+    """内存映射读取器中的附件（只支持以数据流保存的附件）"""
+
+    def __init__(self, cf, prefix, message):
+        super().__init__(cf, prefix, message)
+        if cf.stream(prefix + '__substg1.0_37010102') is None:
+            raise UnsupportedMessageError("不支持的附件类型")
+
+    @functools.cached_property
+    def data(self):
+        # 附件数据不复制，直接引用映射中的内容
+        return self.getStream('__substg1.0_37010102')
+
+    @functools.cached_property
+    def longFilename(self):
+        return self.getStringStream('__substg1.0_3707')
+
+    @functools.cached_property
+    def shortFilename(self):
+        return self.getStringStream('__substg1.0_3704')
+
+    @functools.cached_property
+    def displayName(self):
+        return self.getStringStream('__substg1.0_3001')
+
+
+def _decode_rfc2047(value):
+    """解码RFC 2047编码的邮件头（与extract_msg的处理相同）"""
+    value = value.replace('\r\n', '')
+    return ''.join(part.decode(charset or 'raw-unicode-escape') if isinstance(part, bytes) else part
+                   for part, charset in decode_header(value))
+
+
+class MappedMessage(_MappedObject):
+    """用内存映射读取的MSG邮件
+
+    提供与 extract_msg 的 Message 相同的属性（subject、sender、to、cc、bcc、
+    date、messageId、header、body、htmlBody、rtfBody、sensitivity、attachments），
+    取值规则也相同，因此转换结果一致；只解析用到的流，附件数据是映射中的
+    切片。不带原始邮件头的字段从属性生成；需要从RTF正文还原文本或HTML、
+    嵌入的邮件、签名/加密邮件等由extract_msg处理，打开时抛出
+    UnsupportedMessageError。
+    """
+
+    _PROPERTY_HEADER_SIZE = 32
+
+    def __init__(self, path):
+        cf = CompoundFile(path)
+        self._header_ready = False
+        try:
+            super().__init__(cf, '')
+            self._check_supported()
+            # 与extract_msg一样在打开时生成邮件头（此时生成的发件人、收件人等按属性取值）
+            self.header
+        except BaseException:
+            cf.close()
+            raise
+
+    def _check_supported(self):
+        names = self._cf.list()
+        if self.getPropertyVal('340D0003') is not None:
+            self.areStringsUnicode = bool(self.getPropertyVal('340D0003') & 0x40000)
+        else:
+            self.areStringsUnicode = any(name.endswith('001f') for name in names)
+        if self.areStringsUnicode:
+            self.stringEncoding = 'utf-16-le'
+        elif self.getPropertyVal('3FFD0003') is None:
+            self.stringEncoding = 'iso-8859-15'
+        else:
+            self.stringEncoding = codepage_to_encoding(self.getPropertyVal('3FFD0003'))
+            if self.stringEncoding is None:
+                raise UnsupportedMessageError("不支持的代码页")
+
+        message_class = (self.getStringStream('__substg1.0_001A') or '').lower()
+        if not message_class.startswith('ipm.note') or message_class.endswith(('smime', 'smime.multipartsigned')):
+            raise UnsupportedMessageError(f"不支持的消息类型: {message_class}")
+        # 正文或HTML正文需要从RTF还原时交给extract_msg
+        if self.getStream('__substg1.0_10090102'):
+            if self.getStringStream('__substg1.0_1000') is None or self.getStream('__substg1.0_10130102') is None:
+                raise UnsupportedMessageError("需要从RTF还原正文")
+        sensitivity = self.getPropertyVal('00360003')
+        if sensitivity is not None and sensitivity not in range(4):
+            raise UnsupportedMessageError("无效的敏感度")
+        filetime = self.getPropertyVal('00390040')
+        if filetime is not None and not 116444736000000000 <= filetime <= 915000000000000000:
+            raise UnsupportedMessageError("超出范围的日期")
+
+        self.recipients = []
+        self.attachments = []
+        for name in names:
+            if not self._cf.is_storage(name):
+                continue
+            if name.startswith('__recip'):
+                recipient = _MappedObject(self._cf, name + '/', self)
+                kind = 0xF & recipient.getPropertyVal('0C150003', 0)
+                if kind > 3:
+                    raise UnsupportedMessageError("无效的收件人类型")
+                email_address = recipient.getStringStream('__substg1.0_39FE')
+                if not email_address:
+                    email_address = recipient.getStringStream('__substg1.0_3003')
+                self.recipients.append((kind, f"{recipient.getStringStream('__substg1.0_3001')} <{email_address}>"))
+            elif name.startswith('__attach'):
+                self.attachments.append(MappedAttachment(self._cf, name + '/', self))
+
+    @functools.cached_property
+    def header(self):
+        header_text = self.getStringStream('__substg1.0_007D')
+        parser = email.parser.HeaderParser(policy=email.policy.compat32)
+        if header_text:
+            if header_text.startswith('Microsoft Mail Internet Headers Version 2.0'):
+                header_text = header_text[43:].lstrip()
+            header = parser.parsestr(header_text)
+        else:
+            header = parser.parsestr('')
+            if self.date:
+                header.add_header('Date', email.utils.format_datetime(self.date))
+            header.add_header('From', self.sender)
+            header.add_header('To', self.to)
+            header.add_header('Cc', self.cc)
+            header.add_header('Bcc', self.bcc)
+            header.add_header('Message-Id', self.messageId)
+            header.add_header('Authentication-Results', None)
+        self._header_ready = True
+        return header
+
+    @functools.cached_property
+    def subject(self):
+        return self.getStringStream('__substg1.0_0037')
+
+    @functools.cached_property
+    def sender(self):
+        if self._header_ready and self.header['from'] is not None:
+            return _decode_rfc2047(self.header['from'])
+        text = self.getStringStream('__substg1.0_0C1A')
+        address = self.getStringStream('__substg1.0_5D01')
+        if text is None:
+            return address
+        return text if address is None else f"{text} <{address}>"
+
+    def _recipient_field(self, name, kind):
+        value = None
+        if self._header_ready:
+            value = self.header[name]
+            if value:
+                value = _decode_rfc2047(value).replace(',', ';')
+        if not value:
+            found = [formatted for recipient_kind, formatted in self.recipients if recipient_kind == kind]
+            if found:
+                value = '; '.join(found)
+        if value:
+            # 合并为单行
+            value = value.replace(' \r\n\t', ' ').replace('\r\n\t ', ' ').replace('\r\n\t', ' ')
+            value = value.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
+            value = re.sub(' {2,}', ' ', value)
+        return value
+
+    @functools.cached_property
+    def to(self):
+        return self._recipient_field('to', 1)
+
+    @functools.cached_property
+    def cc(self):
+        return self._recipient_field('cc', 2)
+
+    @functools.cached_property
+    def bcc(self):
+        return self._recipient_field('bcc', 3)
+
+    @functools.cached_property
+    def messageId(self):
+        if self._header_ready and self.header['message-id'] is not None:
+            return self.header['message-id']
+        return self.getStringStream('__substg1.0_1035')
+
+    @functools.cached_property
+    def date(self):
+        # PR_MESSAGE_FLAGS 中未标记为未发送（MSGFLAG_UNSENT）时才有发送时间
+        if self.getPropertyVal('0E070003', 0) & 8:
+            return None
+        filetime = self.getPropertyVal('00390040')
+        if filetime is None:
+            return None
+        return datetime.datetime.fromtimestamp((filetime - 116444736000000000) / 10000000.0).astimezone()
+
+    @functools.cached_property
+    def sensitivity(self):
+        return self.getPropertyVal('00360003')
+
+    @functools.cached_property
+    def body(self):
+        return self.getStringStream('__substg1.0_1000')
+
+    @functools.cached_property
+    def htmlBody(self):
+        html_body = self.getStream('__substg1.0_10130102')
+        if html_body is not None:
+            html_body = bytes(html_body)
+        if not html_body and self.body:
+            # 没有HTML正文时由纯文本生成（与extract_msg相同）
+            text = html.escape(self.body).replace('\r', '').replace('\n', '<br />')
+            html_body = f'<html><body>{text}</body></html>'.encode('ascii', 'xmlcharrefreplace')
+        return html_body
+
+    @functools.cached_property
+    def rtfBody(self):
+        compressed = self.getStream('__substg1.0_10090102')
+        if not compressed:
+            return None
+        import compressed_rtf
+        return compressed_rtf.decompress(bytes(compressed))
+
+    def close(self):
+        self._cf.close()
+
+
+def open_mapped_msg(msg_path):
+    """用内存映射读取器打开MSG文件，不支持的文件用extract_msg打开"""
+    try:
+        return MappedMessage(msg_path)
+    except (UnsupportedMessageError, OSError, ValueError):
+        # 包括损坏的文件和解码失败，由extract_msg给出一致的处理和错误信息
+        return open_msg(msg_path)
+
+# 附件按块编码时每块的字节数（57字节正好编码为一行76个Base64字符）
+ATTACHMENT_BLOCK_SIZE = 57 * 16384
+
+
+class StreamingAttachmentPart(MIMEBase):
+    """按块进行Base64编码的附件部分，正文在写出时才生成"""
+
+    def __init__(self, maintype, subtype, data, block_size=ATTACHMENT_BLOCK_SIZE):
+        super().__init__(maintype, subtype)
+        self['Content-Transfer-Encoding'] = 'base64'
+        self._data = memoryview(data)
+        self._block_size = block_size
+
+    def iter_blocks(self):
+        """逐块返回原始附件数据（memoryview切片，不复制）"""
+        for start in range(0, len(self._data), self._block_size):
+            yield self._data[start:start + self._block_size]
+
+    def write_body(self, generator):
+        """逐块编码并写出正文，输出与 encoders.encode_base64 相同"""
+        for block in self.iter_blocks():
+            encoded = base64.encodebytes(block).decode('ascii')
+            generator.write(encoded.replace('\n', generator._NL))
+
+
+class StreamingGenerator(Generator):
+    """边生成边写出的邮件生成器
+    
+    标准的Generator会先把整个正文（包括所有子部分）缓冲为字符串，以便在写
+    邮件头之前选定multipart边界。这里预先设置随机边界，然后直接写出邮件头
+    和各个子部分，附件正文按块编码写出，内存占用不随邮件大小增长。
+    """
+
+    def _write(self, msg):
+        if isinstance(msg, StreamingAttachmentPart):
+            self._write_headers(msg)
+            msg.write_body(self)
+        elif msg.get_content_type() == 'message/rfc822' and isinstance(msg.get_payload(), list):
+            # 嵌入的邮件直接写出（标准处理会先把整个嵌入邮件生成为字符串）
+            self._write_headers(msg)
+            self.clone(self._fp).flatten(msg.get_payload(0), unixfrom=False, linesep=self._NL)
+        elif msg.is_multipart():
+            if msg.get_boundary() is None:
+                msg.set_boundary(self._make_boundary())
+            self._write_headers(msg)
+            self._handle_multipart(msg)
+        else:
+            # 单个文本部分较小，沿用标准处理
+            super()._write(msg)
+
+    def _handle_multipart(self, msg):
+        subparts = msg.get_payload()
+        if subparts is None:
+            subparts = []
+        elif not isinstance(subparts, list):
+            subparts = [subparts]
+        boundary = msg.get_boundary()
+        if msg.preamble is not None:
+            self._write_lines(msg.preamble)
+            self.write(self._NL)
+        self.write('--' + boundary + self._NL)
+        for index, part in enumerate(subparts):
+            if index:
+                self.write(self._NL + '--' + boundary + self._NL)
+            self.clone(self._fp).flatten(part, unixfrom=False, linesep=self._NL)
+        self.write(self._NL + '--' + boundary + '--' + self._NL)
+        if msg.epilogue is not None:
+            self.write(self._NL)
+            self._write_lines(msg.epilogue)
+
+
+# 转换选项（不可变，可安全地在线程/进程间传递）
+ConversionOptions = namedtuple('ConversionOptions', [
+    'include_attachments',
+    'preserve_headers',
+    'auto_decode',
+    'detect_encoding',
+    'preserve_transport_headers',
+    'show_ip_info',
+    'encoding_detector',
+    'msg_reader',
+    'embedded_depth',
+    'embedded_max_mb',
+    'collect_headers',
+], defaults=(True, True, True, True, True, True, 'auto', 'extract_msg', 10, 256, False))
+
+# 不影响转换结果的选项，不计入选项指纹（见 options_fingerprint）
+OUTPUT_NEUTRAL_OPTIONS = ('msg_reader', 'collect_headers')
+
+# 判断Base64时先检查的前缀长度，前缀中出现非Base64字符即可直接排除
+BASE64_SAMPLE_SIZE = 4096
+
+# Base64/Quoted-Printable检测使用的预编译模式
+_BASE64_CHARS_RE = re.compile(r'[A-Za-z0-9+/=\r\n ]*')
+_BASE64_TEXT_RE = re.compile(r'[A-Za-z0-9+/\r\n ]*(?:=[\r\n ]*){0,2}')
+_QP_ESCAPE_RE = re.compile(r'=[0-9A-Fa-f]{2}')
+
+# 统计编码检测时最多取样的字节数
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# 可选的统计编码检测后端（均提供与chardet兼容的 detect() 函数）
+ENCODING_DETECTORS = ('cchardet', 'charset_normalizer', 'chardet')
+
+# Windows代码页编号到Python编码名的对应（其余按 cpNNN 查找）
+_CODEPAGE_ENCODINGS = {
+    20127: 'ascii',
+    20866: 'koi8-r',
+    20936: 'gb2312',
+    21866: 'koi8-u',
+    50220: 'iso2022-jp',
+    50221: 'iso2022-jp',
+    50222: 'iso2022-jp',
+    51932: 'euc-jp',
+    51936: 'gb2312',
+    51949: 'euc-kr',
+    52936: 'hz',
+    54936: 'gb18030',
+    65000: 'utf-7',
+    65001: 'utf-8',
+}
+
+# PR_INTERNET_CPID 声明的是正文在传输时的字符集，只用于正文和主题
+INTERNET_CODEPAGE_ATTRIBUTES = frozenset(['body', 'htmlBody', 'subject'])
+
+
+def codepage_to_encoding(codepage):
+    """将Windows代码页编号转换为Python编码名，无法识别时返回None"""
+    if not isinstance(codepage, int) or codepage <= 0:
+        return None
+    name = _CODEPAGE_ENCODINGS.get(codepage)
+    if name is None:
+        if 28591 <= codepage <= 28605:
+            name = f"iso8859-{codepage - 28590}"
+        else:
+            name = f"cp{codepage}"
+    try:
+        encoding = codecs.lookup(name).name
+    except LookupError:
+        return None
+    # 8位字符串属性不会使用UTF-16/UTF-32；这类编码能"解码"任意偶数长度的
+    # 字节串，得到的是乱码而不是错误，因此不予采用，交由后续检测
+    if encoding.startswith(('utf-16', 'utf-32')):
+        return None
+    return encoding
+
+
+def load_encoding_detector(name='auto'):
+    """加载统计编码检测函数
+    
+    name为'auto'时按 ENCODING_DETECTORS 的顺序使用第一个已安装的后端，
+    都不可用时使用chardet。
+    """
+    candidates = ENCODING_DETECTORS if name == 'auto' else (name,)
+    for module_name in candidates:
+        try:
+            return importlib.import_module(module_name).detect
+        except (ImportError, AttributeError):
+            continue
+    import chardet
+    return chardet.detect
+
+
+# 原始邮件头的来源属性，按优先级排列
+ORIGINAL_HEADER_SOURCES = ('transportMessageHeaders', 'header', 'internetHeaders')
+
+# 可以重复出现、需要全部保留的邮件头
+REPEATABLE_HEADERS = frozenset(['received'])
+
+_HEADER_LINE_RE = re.compile(r'\r\n|\r|\n')
+
+
+def parse_header_block(header_string):
+    """一次扫描解析邮件头文本，返回 [(名称, 值)]
+    
+    折行（以空格或制表符开头的续行）原样保留在值中，行间统一用换行符连接；
+    空行结束当前的头。
+    """
+    headers = []
+    if not header_string:
+        return headers
+    
+    current_header = None
+    current_value = []
+    
+    for line in _HEADER_LINE_RE.split(header_string):
+        # 空行表示当前头结束
+        if not line.strip():
+            if current_header:
+                headers.append((current_header, '\n'.join(current_value)))
+                current_header = None
+            continue
         
-        # 存储选择的文件和转换结果
-        self.file_items = {}  # 存储文件信息和tree item id的映射
-        self.conversion_results = {}
-        self.output_dir = None
-        
-        # 转换选项
-        self.include_attachments = tk.BooleanVar(value=True)
-        self.preserve_headers = tk.BooleanVar(value=True)
-        self.auto_decode = tk.BooleanVar(value=True)
-        self.detect_encoding = tk.BooleanVar(value=True)
-        self.preserve_transport_headers = tk.BooleanVar(value=True)
-        self.show_ip_info = tk.BooleanVar(value=True)
-        
-        self.setup_ui()
-        
-        # 检查依赖
-        if not EXTRACT_MSG_AVAILABLE:
-            messagebox.showwarning(
-                "需要安装依赖库",
-                "请先安装 extract-msg 和 chardet 库：\n\n"
-                "打开命令行运行：\n"
-                "pip install extract-msg chardet\n\n"
-                "安装完成后重新运行程序。"
-            )
+        # 以空格或制表符开头的行是上一个头的延续，保留原有的折行
+        if line[0] in ' \t':
+            if current_header:
+                current_value.append(line.rstrip() if current_value else line.strip())
+        # 包含冒号的行是新的头
+        elif ':' in line:
+            if current_header:
+                headers.append((current_header, '\n'.join(current_value)))
+            
+            header_name, _, header_value = line.partition(':')
+            header_name = header_name.strip()
+            header_value = header_value.strip()
+            current_header = header_name or None
+            current_value = [header_value] if header_value else []
     
-    def create_tooltip(self, widget, text):
-        """为控件创建工具提示"""
-        def on_enter(event):
-            tooltip = tk.Toplevel()
-            tooltip.wm_overrideredirect(True)
-            tooltip.wm_geometry(f"+{event.x_root+10}+{event.y_root+10}")
+    # 保存最后一个头
+    if current_header:
+        headers.append((current_header, '\n'.join(current_value)))
+    
+    return headers
+
+
+class HeaderIndex:
+    """按名称索引合并多个来源的邮件头，保持首次出现的顺序"""
+
+    def __init__(self):
+        self.headers = []
+        # 小写名称 -> 首次出现该头的来源编号
+        self.sources = {}
+
+    def merge(self, headers, source):
+        """合并一个来源的邮件头；已由前面来源提供的头被忽略"""
+        for header_name, header_value in headers:
+            key = header_name.lower()
+            first_source = self.sources.get(key)
+            if first_source is None:
+                self.sources[key] = source
+            elif key not in REPEATABLE_HEADERS or first_source != source:
+                # 同名头只保留一个；Received头保留同一来源中的全部条目
+                continue
+            self.headers.append((header_name, header_value))
+
+
+# 邮件头查看窗口中的分类（小写名称）
+CONVERTER_HEADERS = frozenset(['x-converted-from', 'x-converter', 'x-conversion-date'])
+TRANSPORT_HEADERS = frozenset([
+    'received', 'x-mailer', 'x-originating-ip', 'x-sender-ip',
+    'authentication-results', 'received-spf', 'dkim-signature',
+    'x-sender-smtp-address', 'x-received-by-smtp-address',
+])
+EXTENDED_HEADERS = frozenset([
+    'x-message-class', 'x-sensitivity', 'x-flag-status', 'x-categories', 'x-companies',
+])
+
+_IP_ADDRESS_RE = re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}\b')
+
+# 查看邮件头时最多读取的字节数（邮件头之后的正文和附件不读取）
+HEADER_BLOCK_LIMIT = 1024 * 1024
+
+
+def classify_header(name, value):
+    """邮件头在查看窗口中的分类：converter/ip/transport/extended/basic"""
+    key = name.lower()
+    if key in CONVERTER_HEADERS:
+        return 'converter'
+    if _IP_ADDRESS_RE.search(value):
+        return 'ip'
+    if key in TRANSPORT_HEADERS:
+        return 'transport'
+    if key in EXTENDED_HEADERS or key.startswith('thread-'):
+        return 'extended'
+    return 'basic'
+
+
+def classify_headers(headers):
+    """为 [(名称, 值)] 中的每个头加上分类，返回 [(名称, 值, 分类)]"""
+    return [(name, value, classify_header(name, value)) for name, value in headers]
+
+
+def read_header_block(fp, limit=HEADER_BLOCK_LIMIT):
+    """从二进制文件的当前位置读取并解析邮件头，返回 [(名称, 值)]
+
+    读到第一个空行（或limit字节）为止，正文和附件不会被读入，读取时间与
+    邮件大小无关。
+    """
+    block = []
+    remaining = limit
+    while remaining > 0:
+        line = fp.readline(remaining)
+        if not line or not line.strip(b'\r\n'):
+            break
+        block.append(line)
+        remaining -= len(line)
+
+    text = b''.join(block).decode('utf-8', errors='replace')
+    return email.parser.HeaderParser().parsestr(text).items()
+
+
+def read_eml_headers(path, limit=HEADER_BLOCK_LIMIT):
+    """只读取EML文件开头的邮件头部分并解析，返回 [(名称, 值)]"""
+    with open(path, 'rb') as f:
+        return read_header_block(f, limit)
+
+
+def new_file_metrics():
+    """单个文件的指标：各阶段耗时（秒）和字节数、附件数"""
+    return {
+        'timings': {},
+        'bytes_in': 0,
+        'bytes_out': 0,
+        'attachments': 0,
+    }
+
+
+# 读取阶段预先读出的消息属性（构建EML时用到的全部属性）
+PRELOAD_ATTRIBUTES = (
+    'subject', 'sender', 'to', 'cc', 'bcc', 'replyTo', 'date', 'sentOn', 'messageId',
+    'body', 'htmlBody', 'rtfBody', 'transportMessageHeaders', 'attachments',
+)
+
+
+def is_embedded_message(value):
+    """附件数据是否为嵌入的MSG邮件（extract_msg以消息对象表示）"""
+    if isinstance(value, MessageSnapshot):
+        return True
+    return (value is not None and not isinstance(value, (bytes, bytearray, memoryview, str))
+            and hasattr(value, 'attachments'))
+
+
+class MessageSnapshot:
+    """MSG消息（或附件）的属性快照
+    
+    每个属性只从extract_msg对象读取一次，解码后的字符串按解码选项缓存，
+    同一消息在生成邮件头、正文、查看器和选项对比中重复使用时不再重复解码。
+    其余属性原样透传给被包装的对象。
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._decoded = {}
+        self._missing = set()
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in self._missing:
+            raise AttributeError(name)
+        try:
+            value = getattr(self._source, name)
+        except AttributeError:
+            # 不存在的属性同样只查找一次
+            self._missing.add(name)
+            raise
+        if name == 'attachments' and value:
+            value = [MessageSnapshot(attachment) for attachment in value]
+        elif name == 'data' and is_embedded_message(value):
+            # 嵌入的MSG邮件同样使用快照，解码结果和邮件头缓存随附件保留
+            value = MessageSnapshot(value)
+        # 缓存原始属性值，之后的访问不再经过extract_msg
+        self.__dict__[name] = value
+        return value
+
+    def close(self):
+        self._source.close()
+
+
+class MSGConversionEngine:
+    """MSG转EML转换引擎（不依赖GUI，可在无界面环境中使用）"""
+
+    def __init__(self, options=None):
+        self.options = options if options is not None else ConversionOptions()
+        self._detect = None
+        # 当前线程正在记录的单文件指标（见 stage_metrics）
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def stage_metrics(self, metrics):
+        """在当前线程中把各阶段耗时和计数记入metrics（由 new_file_metrics 创建）"""
+        previous = getattr(self._local, 'metrics', None)
+        self._local.metrics = metrics
+        try:
+            yield metrics
+        finally:
+            self._local.metrics = previous
+
+    def record_stage(self, stage, start):
+        """记录从start（time.perf_counter）到现在的阶段耗时"""
+        metrics = getattr(self._local, 'metrics', None)
+        if metrics is not None:
+            timings = metrics['timings']
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def count_metric(self, name, amount=1):
+        metrics = getattr(self._local, 'metrics', None)
+        if metrics is not None:
+            metrics[name] += amount
+
+    def convert(self, msg_path, output_dir=None, output_path=None, sink=None, reserved=False):
+        """转换单个MSG文件，返回结果字典
+        
+        output_path为预先分配的输出路径（见 OutputNameAllocator）；未指定或
+        该文件已被其他程序创建时，在输出目录中查找可用的文件名。reserved为True
+        时output_path是调用方已经创建好的空文件，直接覆盖写入。
+        指定sink（见 ArchiveSink）时追加到归档中，结果包含邮件在归档中的位置。
+        """
+        msg = None
+        metrics = new_file_metrics()
+        try:
+            with self.stage_metrics(metrics):
+                # 读取 → 构建 → 写出，与流水线的三个阶段相同
+                msg = self.read_message(msg_path)
+                email_msg = self.build_eml_message(msg)
+                if sink is None:
+                    output = {'output_file': self.write_output(email_msg, msg_path, output_dir, output_path,
+                                                               reserved)}
+                else:
+                    output = self.write_to_sink(email_msg, msg_path, sink)
             
-            label = ttk.Label(tooltip, text=text, 
-                            background="#FFFFDD", 
-                            relief=tk.SOLID, 
-                            borderwidth=1,
-                            font=("Arial", 9))
-            label.pack()
+            result = dict(output, status='success', options=self.options._asdict(), metrics=metrics)
+            if self.options.collect_headers:
+                # 写出后的邮件头（含生成的multipart边界）随结果返回，查看时无需重新读取文件
+                result['headers'] = classify_headers(email_msg.items())
+            return result
             
-            widget.tooltip = tooltip
-        
-        def on_leave(event):
-            if hasattr(widget, 'tooltip'):
-                widget.tooltip.destroy()
-                del widget.tooltip
+        except Exception as e:
+            return {
+                'status': 'failed',
+                'error': str(e),
+                'error_type': type(e).__name__,
+                'metrics': metrics
+            }
+        finally:
+            if msg is not None:
+                msg.close()
+
+    def open_message(self, msg_path):
+        """按选项中的读取方式打开MSG文件"""
+        if self.options.msg_reader == 'mmap':
+            return open_mapped_msg(msg_path)
+        return open_msg(msg_path)
+
+    def read_message(self, msg_path):
+        """读取阶段：打开MSG文件，预先读出构建邮件所需的属性
         
-        widget.bind('<Enter>', on_enter)
-        widget.bind('<Leave>', on_leave)
-    
-    def setup_ui(self):
-        # 主框架
-        main_frame = ttk.Frame(self.root, padding="10")
-        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        返回的快照在构建阶段不再访问磁盘，读取可以与其他文件的构建并行进行。
+        """
+        start = time.perf_counter()
+        msg = MessageSnapshot(self.open_message(msg_path))
+        self.record_stage('open', start)
+        try:
+            try:
+                self.count_metric('bytes_in', os.path.getsize(msg_path))
+            except OSError:
+                # 统计失败不影响转换
+                pass
+            start = time.perf_counter()
+            self.preload_message(msg)
+            self.record_stage('read', start)
+        except BaseException:
+            msg.close()
+            raise
+        return msg
+
+    def preload_message(self, msg, depth=0):
+        """读出构建邮件要用的属性和附件数据，嵌入的邮件在层数限制内递归读取"""
+        for name in PRELOAD_ATTRIBUTES:
+            try:
+                getattr(msg, name)
+            except Exception:
+                # 读取失败的属性留给构建阶段按原有逻辑处理
+                pass
+        if not self.options.include_attachments:
+            return
+        for attachment in getattr(msg, 'attachments', None) or ():
+            try:
+                data = attachment.data
+            except Exception:
+                continue
+            if isinstance(data, MessageSnapshot) and depth < self.options.embedded_depth:
+                self.preload_message(data, depth + 1)
+
+    def write_output(self, email_msg, msg_path, output_dir=None, output_path=None, reserved=False):
+        """写出阶段：把邮件对象保存为EML文件，返回实际的输出路径
         
-        # 配置网格权重
-        self.root.columnconfigure(0, weight=1)
-        self.root.rowconfigure(0, weight=1)
-        main_frame.columnconfigure(0, weight=1)
-        main_frame.rowconfigure(2, weight=1)
+        reserved为True时output_path已由调用方创建（见 _iter_unique_conversions），
+        只写这个文件，不再换用其他文件名。
+        """
+        # 确定输出目录
+        if not output_dir:
+            output_dir = os.path.dirname(msg_path)
         
-        # 标题
-        title_label = ttk.Label(main_frame, text="MSG转EML转换器", 
-                               font=("Arial", 16, "bold"))
-        title_label.grid(row=0, column=0, pady=(0, 20))
+        os.makedirs(output_dir, exist_ok=True)
         
-        # 顶部控制区域
+        # 保存EML文件（以独占方式创建，避免并行转换时覆盖同名文件）
+        start = time.perf_counter()
+        while True:
+            eml_path = output_path or self.get_output_path(msg_path, output_dir)
+            output_path = None
+            try:
+                f = open(eml_path, 'wb' if reserved else 'xb')
+            except FileExistsError:
+                continue
+            try:
+                with f:
+                    self.write_eml(email_msg, f)
+                    self.count_metric('bytes_out', f.tell())
+            except BaseException:
+                # 不保留写了一半的文件
+                os.remove(eml_path)
+                raise
+            self.record_stage('write', start)
+            return eml_path
+
+    def write_to_sink(self, email_msg, msg_path, sink):
+        """写出阶段（归档输出）：生成EML内容并追加到归档，返回位置信息"""
+        start = time.perf_counter()
+        with sink.spool() as spool:
+            self.write_eml(email_msg, spool)
+            self.count_metric('bytes_out', spool.tell())
+            location = sink.add(msg_path, spool)
+        self.record_stage('write', start)
+        return location
+
+    def get_output_path(self, msg_path, output_dir):
+        """生成不与已有文件冲突的输出文件路径"""
+        name_without_ext = output_stem(msg_path)
+        eml_path = os.path.join(output_dir, f"{name_without_ext}.eml")
+        
+        # 处理同名文件
+        counter = 1
+        while os.path.exists(eml_path):
+            eml_path = os.path.join(output_dir, f"{name_without_ext}_{counter}.eml")
+            counter += 1
+        
+        return eml_path
+
+    def create_eml_content(self, msg):
+        """创建EML格式内容字符串（用于预览；写文件请使用write_eml）"""
+        buffer = io.BytesIO()
+        self.write_eml(self.build_eml_message(msg), buffer)
+        return buffer.getvalue().decode('utf-8')
+
+    def write_eml(self, email_msg, fp):
+        """将邮件对象逐部分写入二进制文件（UTF-8，格式与 as_string() 相同）"""
+        text_fp = io.TextIOWrapper(fp, encoding='utf-8', newline='', write_through=True)
+        try:
+            generator = StreamingGenerator(text_fp, mangle_from_=False, maxheaderlen=0)
+            generator.flatten(email_msg)
+            text_fp.flush()
+        finally:
+            # 文件由调用方关闭
+            text_fp.detach()
+
+    def build_eml_message(self, msg):
+        """创建EML邮件对象（增强版，包含完整传输信息）"""
+        start = time.perf_counter()
+        try:
+            return self._build_eml_message(msg)
+        finally:
+            self.record_stage('build', start)
+
+    def _build_eml_message(self, msg):
+        if not isinstance(msg, MessageSnapshot):
+            msg = MessageSnapshot(msg)
+        try:
+            # 获取邮件正文内容
+            body_text = self.safe_get_str(msg, 'body')
+            html_text = self.safe_get_str(msg, 'htmlBody')
+            
+            # 如果HTML内容为空但有RTF内容，尝试获取RTF
+            if not html_text and hasattr(msg, 'rtfBody'):
+                rtf_text = self.safe_get_str(msg, 'rtfBody')
+                if rtf_text and not body_text:
+                    body_text = rtf_text
+            
+            # 检查是否有附件
+            has_attachments = hasattr(msg, 'attachments') and len(msg.attachments) > 0
+            
+            # 创建根邮件对象
+            if has_attachments and self.options.include_attachments:
+                email_msg = MIMEMultipart('mixed')
+                
+                if body_text and html_text:
+                    msg_body = MIMEMultipart('alternative')
+                    msg_body.attach(MIMEText(body_text, 'plain', 'utf-8'))
+                    msg_body.attach(MIMEText(html_text, 'html', 'utf-8'))
+                    email_msg.attach(msg_body)
+                elif html_text:
+                    email_msg.attach(MIMEText(html_text, 'html', 'utf-8'))
+                elif body_text:
+                    email_msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
+                else:
+                    email_msg.attach(MIMEText("", 'plain', 'utf-8'))
+                    
+            elif body_text and html_text:
+                email_msg = MIMEMultipart('alternative')
+                email_msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
+                email_msg.attach(MIMEText(html_text, 'html', 'utf-8'))
+            elif html_text:
+                email_msg = MIMEText(html_text, 'html', 'utf-8')
+            else:
+                email_msg = MIMEText(body_text or "", 'plain', 'utf-8')
+            
+            # 添加原始邮件头（如果启用了保留传输头选项）
+            if self.options.preserve_transport_headers:
+                original_headers = self.extract_original_headers(msg)
+                for header_name, header_value in original_headers:
+                    if header_value and header_name.lower() not in ['content-type', 'content-transfer-encoding', 'mime-version']:
+                        email_msg[header_name] = header_value
+            
+            # 设置基本邮件头（检查是否已存在）
+            existing_headers = {key.lower() for key in email_msg.keys()}
+            
+            if 'subject' not in existing_headers:
+                subject = self.safe_get_str(msg, 'subject')
+                if subject:
+                    email_msg['Subject'] = self.encode_header(subject)
+            
+            if 'from' not in existing_headers:
+                sender = self.safe_get_str(msg, 'sender')
+                if sender:
+                    email_msg['From'] = self.encode_header(sender)
+            
+            if 'to' not in existing_headers:
+                to_recipients = self.safe_get_str(msg, 'to')
+                if to_recipients:
+                    email_msg['To'] = self.encode_header(to_recipients)
+            
+            if 'cc' not in existing_headers:
+                cc_recipients = self.safe_get_str(msg, 'cc')
+                if cc_recipients:
+                    email_msg['Cc'] = self.encode_header(cc_recipients)
+            
+            if 'bcc' not in existing_headers:
+                bcc_recipients = self.safe_get_str(msg, 'bcc')
+                if bcc_recipients:
+                    email_msg['Bcc'] = self.encode_header(bcc_recipients)
+            
+            if 'date' not in existing_headers:
+                date_obj = None
+                if hasattr(msg, 'date'):
+                    date_obj = msg.date
+                elif hasattr(msg, 'sentOn'):
+                    date_obj = msg.sentOn
+                email_msg['Date'] = self.format_email_date(date_obj)
+            
+            if 'message-id' not in existing_headers:
+                message_id = self.safe_get_str(msg, 'messageId')
+                if message_id:
+                    email_msg['Message-ID'] = message_id
+                else:
+                    import uuid
+                    email_msg['Message-ID'] = f"<{uuid.uuid4()}@msg-to-eml-converter>"
+            
+            if 'reply-to' not in existing_headers:
+                reply_to = self.safe_get_str(msg, 'replyTo')
+                if reply_to:
+                    email_msg['Reply-To'] = self.encode_header(reply_to)
+            
+            # 设置MIME版本
+            if 'mime-version' not in existing_headers:
+                email_msg['MIME-Version'] = '1.0'
+            
+            # 添加MSG扩展属性（如果启用了保留MSG属性选项）
+            if self.options.preserve_headers:
+                self.add_extended_headers(email_msg, msg)
+            
+            # 添加额外的传输信息（如果启用了显示IP信息选项）
+            if self.options.show_ip_info:
+                self.add_ip_related_headers(email_msg, msg)
+            
+            # 添加转换器信息
+            email_msg['X-Converted-From'] = 'MSG'
+            email_msg['X-Converter'] = 'Enhanced-MSG-to-EML-Converter-v2'
+            email_msg['X-Conversion-Date'] = formatdate(localtime=True)
+            
+            # 处理附件
+            if has_attachments and self.options.include_attachments:
+                for i, attachment in enumerate(msg.attachments):
+                    try:
+                        filename = self.get_attachment_filename(attachment, i)
+                        mime_part = self.create_attachment_mime(attachment, filename)
+                        email_msg.attach(mime_part)
+                    except Exception as e:
+                        print(f"处理附件 {i+1} 时出错: {e}")
+            
+            return email_msg
+            
+        except Exception as e:
+            print(f"创建EML内容时出错: {e}")
+            error_msg = MIMEText(f"MSG文件转换错误:\n{str(e)}", 'plain', 'utf-8')
+            error_msg['Subject'] = "MSG转换错误"
+            error_msg['From'] = "enhanced-msg-to-eml-converter@localhost"
+            error_msg['Date'] = formatdate(localtime=True)
+            return error_msg
+    
+    def extract_original_headers(self, msg):
+        """提取MSG文件中的原始邮件头
+        
+        依次合并 transportMessageHeaders（通常最完整）、header 和 internetHeaders，
+        每个来源只解析一次。同名头以最先出现的来源为准，Received头保留该来源中的
+        全部条目。结果缓存在消息快照中，构建邮件、查看器和选项对比共用。
+        """
+        if not isinstance(msg, MessageSnapshot):
+            msg = MessageSnapshot(msg)
+        key = ('original_headers', self.options.detect_encoding, self.options.auto_decode)
+        if key in msg._decoded:
+            return msg._decoded[key]
+        
+        try:
+            index = HeaderIndex()
+            for source, attr in enumerate(ORIGINAL_HEADER_SOURCES):
+                if hasattr(msg, attr):
+                    header_data = self.get_header_source(msg, attr)
+                    if header_data:
+                        index.merge(parse_header_block(header_data), source)
+            headers = index.headers
+        except Exception as e:
+            print(f"提取原始邮件头时出错: {e}")
+            headers = []
+        
+        headers = msg._decoded[key] = tuple(headers)
+        return headers
+    
+    def get_header_source(self, msg, attr):
+        """读取一个原始邮件头来源的文本"""
+        if attr != 'transportMessageHeaders':
+            return self.safe_get_str(msg, attr)
+        try:
+            transport_headers = msg.transportMessageHeaders
+            if isinstance(transport_headers, bytes):
+                return transport_headers.decode('utf-8', errors='replace')
+            if transport_headers is not None:
+                return str(transport_headers)
+            return None
+        except Exception:
+            return self.safe_get_str(msg, attr)
+    
+    def parse_header_string(self, header_string):
+        """解析邮件头字符串"""
+        try:
+            return parse_header_block(header_string)
+        except Exception as e:
+            print(f"解析邮件头字符串时出错: {e}")
+            return []
+    
+    def add_extended_headers(self, email_msg, msg):
+        """添加MSG扩展属性"""
+        try:
+            # 会话相关
+            conv_topic = self.safe_get_str(msg, 'conversationTopic')
+            if conv_topic:
+                email_msg['Thread-Topic'] = self.encode_header(conv_topic)
+            
+            conv_index = self.safe_get_str(msg, 'conversationIndex')
+            if conv_index:
+                email_msg['Thread-Index'] = conv_index
+            
+            # MSG特有属性
+            if hasattr(msg, 'messageClass'):
+                msg_class = self.safe_get_str(msg, 'messageClass')
+                if msg_class:
+                    email_msg['X-Message-Class'] = msg_class
+            
+            # 其他扩展属性
+            extended_attrs = [
+                ('sensitivity', 'X-Sensitivity'),
+                ('flag', 'X-Flag-Status'),
+                ('categories', 'X-Categories'),
+                ('companies', 'X-Companies'),
+                ('readReceiptRequested', 'X-Read-Receipt-Requested'),
+                ('deliveryReceiptRequested', 'X-Delivery-Receipt-Requested'),
+            ]
+            
+            for attr, header_name in extended_attrs:
+                value = self.safe_get_str(msg, attr)
+                if value:
+                    email_msg[header_name] = self.encode_header(value)
+                    
+        except Exception as e:
+            print(f"添加扩展头时出错: {e}")
+    
+    def add_ip_related_headers(self, email_msg, msg):
+        """添加IP相关的额外信息"""
+        try:
+            # 添加发送和接收的SMTP地址
+            sender_smtp = self.safe_get_str(msg, 'senderSmtpAddress')
+            if sender_smtp:
+                email_msg['X-Sender-SMTP-Address'] = sender_smtp
+                
+            received_smtp = self.safe_get_str(msg, 'receivedBySmtpAddress')
+            if received_smtp:
+                email_msg['X-Received-By-SMTP-Address'] = received_smtp
+            
+            # 添加时间戳信息（有助于追踪传输路径）
+            if hasattr(msg, 'clientSubmitTime'):
+                submit_time = msg.clientSubmitTime
+                if submit_time:
+                    email_msg['X-Client-Submit-Time'] = self.format_email_date(submit_time)
+            
+            if hasattr(msg, 'messageDeliveryTime'):
+                delivery_time = msg.messageDeliveryTime
+                if delivery_time:
+                    email_msg['X-Message-Delivery-Time'] = self.format_email_date(delivery_time)
+            
+            # 添加提示信息
+            email_msg['X-IP-Info-Note'] = 'IP addresses preserved from original MSG headers'
+            
+        except Exception as e:
+            print(f"添加IP相关头时出错: {e}")
+    
+    def safe_get_str(self, obj, attr, default=""):
+        """安全获取字符串属性（快照中的属性在相同解码选项下只解码一次）"""
+        if isinstance(obj, MessageSnapshot):
+            key = (attr, self.options.detect_encoding, self.options.auto_decode)
+            if key not in obj._decoded:
+                obj._decoded[key] = self.decode_attribute(obj, attr)
+            value = obj._decoded[key]
+        else:
+            value = self.decode_attribute(obj, attr)
+        return value if value else default
+    
+    def decode_attribute(self, obj, attr):
+        """读取并解码属性，属性不存在或出错时返回空字符串"""
+        try:
+            if hasattr(obj, attr):
+                value = getattr(obj, attr)
+                if value is None:
+                    return ""
+                
+                # 处理字节串
+                if isinstance(value, bytes):
+                    if self.options.detect_encoding:
+                        internet_encoding, message_encoding = self.get_codepage_encodings(obj)
+                        if attr not in INTERNET_CODEPAGE_ATTRIBUTES:
+                            internet_encoding = None
+                        value, _ = self.detect_text_encoding(value, (internet_encoding, message_encoding))
+                    else:
+                        value = value.decode('utf-8', errors='replace')
+                # 处理字符串
+                elif isinstance(value, str):
+                    if self.options.auto_decode:
+                        value = self.auto_decode_content(value)
+                else:
+                    value = str(value)
+                
+                return value.strip() if value else ""
+            return ""
+        except Exception as e:
+            print(f"获取属性 {attr} 时出错: {e}")
+            return ""
+    
+    def get_codepage_encodings(self, obj):
+        """读取MSG自身声明的代码页，返回 (互联网代码页编码, 消息代码页编码)"""
+        if not hasattr(obj, 'getPropertyVal'):
+            return None, None
+        try:
+            # PR_INTERNET_CPID：正文（HTML）在传输时使用的字符集
+            internet_encoding = codepage_to_encoding(obj.getPropertyVal('3FDE0003'))
+            # PR_MESSAGE_CODEPAGE：非Unicode字符串属性使用的代码页
+            message_encoding = codepage_to_encoding(obj.getPropertyVal('3FFD0003'))
+        except Exception:
+            return None, None
+        return internet_encoding, message_encoding
+    
+    def detect_text_encoding(self, text_data, codepage_encodings=(None, None)):
+        """智能检测文本编码
+        
+        按代价从低到高依次尝试：纯ASCII、MSG声明的互联网代码页、严格UTF-8、
+        MSG声明的消息代码页，最后才对有限长度的样本做统计检测。
+        """
+        if not text_data:
+            return text_data, 'utf-8'
+        
+        if isinstance(text_data, str):
+            return text_data, 'utf-8'
+        
+        if isinstance(text_data, bytes):
+            if text_data.isascii():
+                return text_data.decode('ascii'), 'ascii'
+            
+            internet_encoding, message_encoding = codepage_encodings
+            for encoding in (internet_encoding, 'utf-8', message_encoding):
+                if encoding:
+                    try:
+                        return text_data.decode(encoding), encoding
+                    except UnicodeDecodeError:
+                        continue
+            
+            start = time.perf_counter()
+            try:
+                if self._detect is None:
+                    self._detect = load_encoding_detector(self.options.encoding_detector)
+                detected = self._detect(text_data[:ENCODING_SAMPLE_SIZE])
+                encoding = detected.get('encoding') or 'utf-8'
+                confidence = detected.get('confidence') or 0
+                
+                if confidence < 0.7:
+                    for enc in ['utf-8', 'gbk', 'gb2312', 'big5', 'utf-16']:
+                        try:
+                            decoded_text = text_data.decode(enc)
+                            return decoded_text, enc
+                        except UnicodeDecodeError:
+                            continue
+                
+                try:
+                    decoded_text = text_data.decode(encoding)
+                    return decoded_text, encoding
+                except (UnicodeDecodeError, LookupError):
+                    decoded_text = text_data.decode('utf-8', errors='replace')
+                    return decoded_text, 'utf-8'
+                    
+            except Exception:
+                decoded_text = text_data.decode('utf-8', errors='replace')
+                return decoded_text, 'utf-8'
+            finally:
+                self.record_stage('detect', start)
+        
+        return str(text_data), 'utf-8'
+    
+    def auto_decode_content(self, content):
+        """自动解码Base64或Quoted-Printable编码的内容"""
+        if not content or not isinstance(content, str):
+            return content
+        
+        # Base64解码（检测时得到的解码结果直接复用）
+        decoded_bytes = self.decode_base64_text(content)
+        if decoded_bytes is not None:
+            try:
+                decoded_text, _ = self.detect_text_encoding(decoded_bytes)
+                return decoded_text
+            except:
+                pass
+        
+        # Quoted-Printable解码
+        if self.is_quoted_printable_encoded(content):
+            try:
+                decoded_bytes = quopri.decodestring(content.encode('ascii'))
+                decoded_text, _ = self.detect_text_encoding(decoded_bytes)
+                return decoded_text
+            except:
+                pass
+        
+        # RFC 2047解码
+        if '=?' in content and '?=' in content:
+            try:
+                decoded_parts = decode_header(content)
+                decoded_text = ""
+                for part, encoding in decoded_parts:
+                    if isinstance(part, bytes):
+                        if encoding:
+                            decoded_text += part.decode(encoding)
+                        else:
+                            decoded_text += part.decode('utf-8', errors='replace')
+                    else:
+                        decoded_text += str(part)
+                return decoded_text
+            except:
+                pass
+        
+        return content
+    
+    def is_base64_encoded(self, text):
+        """检查文本是否是Base64编码"""
+        return self.decode_base64_text(text) is not None
+    
+    def decode_base64_text(self, text):
+        """文本是Base64编码时返回解码后的字节串，否则返回None
+        
+        只允许Base64字符、换行和空格，填充符只能出现在末尾；先检查前缀样本，
+        普通正文通常在前几个字符就被排除，不会扫描整段内容。
+        """
+        if not text or len(text) < 4:
+            return None
+        
+        if _BASE64_CHARS_RE.fullmatch(text[:BASE64_SAMPLE_SIZE]) is None:
+            return None
+        
+        if _BASE64_TEXT_RE.fullmatch(text) is None:
+            return None
+        
+        length = len(text) - text.count('\n') - text.count('\r') - text.count(' ')
+        if length % 4 != 0 or length <= 20:
+            return None
+        
+        try:
+            return base64.b64decode(text)
+        except (binascii.Error, ValueError):
+            return None
+    
+    def is_quoted_printable_encoded(self, text):
+        """检查文本是否是Quoted-Printable编码"""
+        if not text:
+            return False
+        
+        return _QP_ESCAPE_RE.search(text) is not None
+    
+    def encode_header(self, text):
+        """编码邮件头"""
+        if not text:
+            return ""
+        try:
+            text.encode('ascii')
+            return text
+        except UnicodeEncodeError:
+            return str(Header(text, 'utf-8'))
+    
+    def format_email_date(self, date_obj):
+        """格式化日期"""
+        if not date_obj:
+            return formatdate(localtime=True)
+        
+        try:
+            if isinstance(date_obj, str):
+                return date_obj
+            elif hasattr(date_obj, 'strftime'):
+                return formatdate(date_obj.timestamp(), localtime=True)
+            else:
+                return formatdate(localtime=True)
+        except:
+            return formatdate(localtime=True)
+    
+    def get_attachment_filename(self, attachment, index):
+        """获取附件文件名"""
+        filename = None
+        
+        filename_attrs = ['longFilename', 'shortFilename', 'FileName', 'displayName']
+        
+        for attr in filename_attrs:
+            if hasattr(attachment, attr):
+                filename = self.safe_get_str(attachment, attr)
+                if filename:
+                    break
+        
+        if not filename:
+            filename = f"attachment_{index + 1}"
+        
+        filename = re.sub(r'[<>:"|?*]', '_', filename)
+        
+        return filename
+    
+    def create_attachment_mime(self, attachment, filename):
+        """创建附件MIME部分"""
+        start = time.perf_counter()
+        try:
+            return self._create_attachment_mime(attachment, filename)
+        finally:
+            self.count_metric('attachments')
+            self.record_stage('attachments', start)
+
+    def _create_attachment_mime(self, attachment, filename):
+        try:
+            attachment_data = None
+            if hasattr(attachment, 'data'):
+                attachment_data = attachment.data
+            
+            if is_embedded_message(attachment_data):
+                return self.create_embedded_message_mime(attachment_data, filename)
+            
+            if attachment_data:
+                mime_type, _ = mimetypes.guess_type(filename)
+                
+                if mime_type:
+                    maintype, subtype = mime_type.split('/', 1)
+                else:
+                    maintype, subtype = 'application', 'octet-stream'
+                
+                if not isinstance(attachment_data, (bytes, bytearray, memoryview)):
+                    attachment_data = str(attachment_data).encode('utf-8')
+                
+                # 附件数据在写出时才按块编码，不生成完整的Base64字符串
+                part = StreamingAttachmentPart(maintype, subtype, attachment_data)
+                part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+                
+                return part
+            else:
+                return self.create_attachment_placeholder(filename)
+                
+        except Exception as e:
+            print(f"创建附件MIME时出错: {e}")
+            return self.create_attachment_placeholder(filename, f"错误: {str(e)}")
+    
+    def create_embedded_message_mime(self, msg, filename):
+        """把嵌入的MSG邮件递归转换为 message/rfc822 部分
+        
+        嵌入层数超过 embedded_depth 或估算大小超过 embedded_max_mb 时生成占位附件。
+        嵌入邮件的附件数据同样不复制，写出时由 StreamingGenerator 逐层直接写出。
+        """
+        if not isinstance(msg, MessageSnapshot):
+            msg = MessageSnapshot(msg)
+        name = os.path.splitext(filename)[0] if filename.lower().endswith('.msg') else filename
+        name = f"{name}.eml"
+        
+        depth = getattr(self._local, 'embedded_depth', 0)
+        if depth >= self.options.embedded_depth:
+            return self.create_attachment_placeholder(name, "嵌入邮件的层数超过限制")
+        size = self.estimate_message_size(msg, self.options.embedded_depth - depth)
+        if size > self.options.embedded_max_mb * 1024 * 1024:
+            return self.create_attachment_placeholder(name, f"嵌入邮件超过大小限制（约 {size / 1024 / 1024:.0f} MB）")
+        
+        self._local.embedded_depth = depth + 1
+        try:
+            part = MIMEMessage(self._build_eml_message(msg))
+        finally:
+            self._local.embedded_depth = depth
+        part.add_header('Content-Disposition', f'attachment; filename="{name}"')
+        return part
+    
+    def estimate_message_size(self, msg, depth):
+        """估算邮件的大小（正文和附件数据的字节数，包括depth层以内的嵌入邮件）"""
+        size = 0
+        for name in ('body', 'htmlBody'):
+            value = getattr(msg, name, None)
+            if isinstance(value, (str, bytes)):
+                size += len(value)
+        if not self.options.include_attachments:
+            return size
+        for attachment in getattr(msg, 'attachments', None) or ():
+            data = getattr(attachment, 'data', None)
+            if is_embedded_message(data):
+                if depth > 1:
+                    size += self.estimate_message_size(data, depth - 1)
+            elif isinstance(data, (bytes, bytearray, memoryview)):
+                size += len(data)
+        return size
+    
+    def create_attachment_placeholder(self, filename, error_msg=None):
+        """创建附件占位符"""
+        if error_msg:
+            placeholder_text = f"[附件内容不可用: {error_msg}]"
+        else:
+            placeholder_text = "[附件内容未包含]"
+        
+        part = MIMEBase('text', 'plain')
+        part.set_payload(placeholder_text.encode('utf-8'))
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+        
+        return part
+
+
+
+def iter_msg_files(root_dir):
+    """递归查找目录中的MSG文件，边遍历边返回
+    
+    使用显式栈和 os.scandir，不预先构建完整的文件列表，也不跟随目录符号
+    链接；无法访问的目录直接跳过。
+    """
+    stack = [root_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirs = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith('.msg') and entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"无法读取目录 {directory}: {e}")
+            continue
+        # 逆序入栈，使子目录按遍历到的顺序处理
+        stack.extend(reversed(subdirs))
+
+
+def expand_input_paths(paths):
+    """展开命令行输入：文件原样返回，目录递归查找其中的MSG文件"""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_msg_files(path)
+        else:
+            yield path
+
+
+# 监视目录时，文件大小和修改时间保持不变多久（秒）才认为已经写完
+WATCH_SETTLE_SECONDS = 2.0
+
+# 没有就绪文件时每次等待文件系统事件的最长时间（秒）
+WATCH_WAIT_SECONDS = 0.5
+
+# 轮询模式下两次扫描的间隔（秒）
+WATCH_POLL_SECONDS = 2.0
+
+# 使用inotify时也定期补扫一次，防止漏掉事件（例如网络共享上其他主机写入的文件）
+WATCH_RESCAN_SECONDS = 300.0
+
+# 监视模式下保存转换清单和指标文件的最短间隔（秒）
+WATCH_CHECKPOINT_SECONDS = 5.0
+
+
+class Inotify:
+    """Linux inotify 的最小封装，通过ctypes调用libc，不依赖第三方库
+    
+    只关心写完关闭（IN_CLOSE_WRITE）、移入（IN_MOVED_TO）和新建（IN_CREATE，
+    用于发现新的子目录）事件；子目录需要逐个添加监视。
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            self._raise_errno()
+        self.fd = fd
+        self.directories = {}
+
+    def _raise_errno(self, path=None):
+        errno = self._ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+
+    def add_watch(self, directory):
+        """监视一个目录（不含子目录）"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            self._raise_errno(directory)
+        self.directories[wd] = directory
+
+    def read_events(self, timeout):
+        """等待事件，返回 [(路径, 事件掩码), ...]；超时时返回空列表"""
+        import select
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        
+        events = []
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            directory = self.directories.get(wd)
+            if directory is not None and name:
+                events.append((os.path.join(directory, os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FolderWatcher:
+    """监视目录，持续返回新出现且已经写完的MSG文件
+    
+    Linux上使用inotify，其他系统或inotify不可用（如监视数量达到上限）时
+    改为定期用 os.scandir 扫描。启动时先扫描一遍已有文件，交给转换清单
+    判断是否已转换过。
+    
+    导出程序可能分多次写入同一个文件，所以文件出现后不立即返回：记录它的
+    大小和修改时间，经过settle秒后仍未变化（且不为空）才认为已写完。同一个
+    文件内容变化后会再次返回。
+    """
+
+    def __init__(self, roots, settle=WATCH_SETTLE_SECONDS, poll_interval=WATCH_POLL_SECONDS,
+                 use_inotify=True):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.settle = settle
+        self.poll_interval = poll_interval
+        # 已返回的文件及返回时的 (大小, 修改时间)
+        self._returned = {}
+        # 等待写完的文件：路径 -> ((大小, 修改时间), 最近一次变化的时间)
+        self._candidates = {}
+        self._inotify = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                print(f"inotify不可用，改为轮询: {e}")
+        self._next_scan = 0.0
+
+    @property
+    def mode(self):
+        return 'inotify' if self._inotify is not None else 'poll'
+
+    def paths(self, on_idle=None):
+        """无限生成器：返回已写完的MSG文件路径，暂时没有时返回None
+        
+        返回None之后最多等待 WATCH_WAIT_SECONDS 秒，调用方借此处理已完成的转换
+        （见 iter_conversions）；on_idle在每次没有就绪文件时调用。
+        """
+        while True:
+            now = time.monotonic()
+            if now >= self._next_scan:
+                for root in self.roots:
+                    self._scan(root, watch=True)
+                interval = WATCH_RESCAN_SECONDS if self._inotify is not None else self.poll_interval
+                self._next_scan = now + interval
+            
+            ready = self._collect_ready()
+            if ready:
+                yield from ready
+                continue
+            if on_idle is not None:
+                on_idle()
+            yield None
+            self._wait(WATCH_WAIT_SECONDS)
+
+    def _signature(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def _add_candidate(self, path):
+        try:
+            signature = self._signature(path)
+        except OSError:
+            return
+        if self._returned.get(path) == signature:
+            return
+        current = self._candidates.get(path)
+        if current is None or current[0] != signature:
+            self._candidates[path] = (signature, time.monotonic())
+
+    def _scan(self, root, watch=False):
+        """扫描目录树，把新的或变化过的MSG文件加入候选；watch为True时同时添加inotify监视"""
+        if self._inotify is not None and watch:
+            self._watch_tree(root)
+        for path in iter_msg_files(root):
+            self._add_candidate(path)
+
+    def _watch_tree(self, root):
+        watched = set(self._inotify.directories.values())
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            if directory not in watched:
+                try:
+                    self._inotify.add_watch(directory)
+                except OSError as e:
+                    # 通常是 fs.inotify.max_user_watches 不够，整体改为轮询
+                    print(f"无法监视目录 {directory}（{e}），改为轮询")
+                    self._inotify.close()
+                    self._inotify = None
+                    return
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(entry.path for entry in entries
+                                 if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def _wait(self, timeout):
+        """等待文件系统事件（轮询模式下只是休眠）"""
+        if self._inotify is None:
+            time.sleep(timeout)
+            return
+        for path, mask in self._inotify.read_events(timeout):
+            if path is None:
+                # 事件队列溢出，可能漏掉了文件，立即补扫
+                self._next_scan = 0.0
+            elif mask & Inotify.IN_ISDIR:
+                # 新建或移入的子目录：添加监视，并扫描在添加监视前已写入的文件
+                self._scan(path, watch=True)
+            elif path.lower().endswith('.msg'):
+                self._add_candidate(path)
+
+    def _collect_ready(self):
+        """返回已经稳定settle秒的候选文件
+        
+        每个候选只在稳定期结束时stat一次，大量文件同时落地时开销也不大。
+        """
+        now = time.monotonic()
+        ready = []
+        for path, (signature, changed_at) in list(self._candidates.items()):
+            if now - changed_at < self.settle:
+                continue
+            try:
+                current = self._signature(path)
+            except OSError:
+                # 已被删除或移走
+                del self._candidates[path]
+                continue
+            if current != signature or current[0] == 0:
+                # 仍在写入（空文件也视为尚未写入内容）
+                self._candidates[path] = (current, now)
+                continue
+            del self._candidates[path]
+            self._returned[path] = current
+            ready.append(path)
+        return ready
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def output_stem(msg_path):
+    """输出文件名主干：源文件名去掉扩展名并替换非法字符"""
+    name_without_ext = os.path.splitext(os.path.basename(msg_path))[0]
+    return re.sub(r'[<>:"|?*]', '_', name_without_ext)
+
+
+def _name_key(name):
+    """比较文件名用的键（除Linux外文件系统通常不区分大小写）"""
+    return name if platform.system() == 'Linux' else name.lower()
+
+
+class OutputNameAllocator:
+    """输出文件名分配器
+    
+    每个输出目录只扫描一次已有文件，之后在内存中为同名文件依次分配
+    name.eml、name_1.eml、name_2.eml……，每个文件名的分配是O(1)的，不再
+    逐个调用 os.path.exists。并行转换时由主进程统一分配，工作进程之间不会
+    选中同一个文件名。
+    """
+
+    _SUFFIX_RE = re.compile(r'(.*)_(\d+)\.eml\Z', re.DOTALL)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._taken = {}
+        self._counters = {}
+
+    def _directory_state(self, directory):
+        """返回目录的 (已占用文件名集合, 各文件名主干的下一个序号)"""
+        key = os.path.abspath(directory)
+        taken = self._taken.get(key)
+        if taken is None:
+            taken = set()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        taken.add(_name_key(entry.name))
+            except FileNotFoundError:
+                pass
+            self._taken[key] = taken
+            self._counters[key] = {}
+        return taken, self._counters[key]
+
+    def allocate(self, msg_path, output_dir=None):
+        """为源文件分配一个未被占用的输出路径"""
+        directory = output_dir or os.path.dirname(msg_path)
+        stem = output_stem(msg_path)
+        with self._lock:
+            taken, counters = self._directory_state(directory)
+            name = f"{stem}.eml"
+            if _name_key(name) in taken:
+                stem_key = _name_key(stem)
+                counter = counters.get(stem_key, 1)
+                while _name_key(f"{stem}_{counter}.eml") in taken:
+                    counter += 1
+                name = f"{stem}_{counter}.eml"
+                counters[stem_key] = counter + 1
+            taken.add(_name_key(name))
+        return os.path.join(directory, name)
+
+    def release(self, path):
+        """释放未被使用的输出路径（例如转换失败时）"""
+        directory, name = os.path.split(path)
+        with self._lock:
+            key = os.path.abspath(directory)
+            taken = self._taken.get(key)
+            if taken is None:
+                return
+            taken.discard(_name_key(name))
+            match = self._SUFFIX_RE.match(name)
+            if match:
+                counters = self._counters[key]
+                stem_key = _name_key(match.group(1))
+                counter = int(match.group(2))
+                if counters.get(stem_key, 1) > counter:
+                    counters[stem_key] = counter
+
+
+# 归档输出时单个邮件先在内存中生成，超过此大小后转存到临时文件
+ARCHIVE_SPOOL_SIZE = 8 * 1024 * 1024
+
+# 复制归档内容时每次读取的字节数
+ARCHIVE_COPY_SIZE = 1024 * 1024
+
+# 归档结果中记录邮件位置的键（见 OutputIndex）
+ARCHIVE_LOCATION_KEYS = ('member', 'offset', 'length')
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def _iter_data_chunks(data):
+    """按块返回要写入归档的内容：bytes原样返回，文件对象从头读到结尾"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        yield data
+        return
+    data.seek(0)
+    while True:
+        chunk = data.read(ARCHIVE_COPY_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _data_size(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    return data.seek(0, os.SEEK_END)
+
+
+class ArchiveSink:
+    """把转换结果依次追加到单个归档文件的输出目标
+    
+    大量小文件的创建在对象存储和NFS上很慢，归档输出只打开一个文件。
+    各个写出线程先把邮件生成到各自的缓冲中（见 spool），加锁后只做追加，
+    add() 返回邮件在归档中的位置（成员名或偏移），由 OutputIndex 记录。
+    已存在的归档在其后追加。子类实现 _open、_append 和 _close。
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._members = set()
+        self._counters = {}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._open()
+
+    def spool(self):
+        """返回用于生成单个邮件的临时缓冲（小邮件在内存中，大邮件转存到磁盘）"""
+        import tempfile
+        return tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE)
+
+    def member_name(self, msg_path):
+        """为源文件分配归档中唯一的成员名（与输出目录中的命名规则相同）"""
+        stem = output_stem(msg_path)
+        name = f"{stem}.eml"
+        if name in self._members:
+            counter = self._counters.get(stem, 1)
+            while f"{stem}_{counter}.eml" in self._members:
+                counter += 1
+            name = f"{stem}_{counter}.eml"
+            self._counters[stem] = counter + 1
+        self._members.add(name)
+        return name
+
+    def add(self, msg_path, data):
+        """追加一封邮件（bytes或文件对象），返回包含归档路径和位置的字典"""
+        size = _data_size(data)
+        with self._lock:
+            location = self._append(msg_path, data, size)
+        return dict(location, output_file=self.path)
+
+    def flush(self):
+        """把已追加的内容写入磁盘（断点续转日志记录之前调用）"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MboxSink(ArchiveSink):
+    """mbox输出（mboxrd格式：正文中以 >*From 开头的行前面再加一个 >）"""
+
+    _FROM_LINE_RE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+
+    def _append(self, msg_path, data, size):
+        f = self._file
+        offset = f.tell()
+        f.write(b'From MAILER-DAEMON ' + time.asctime(time.gmtime()).encode('ascii') + b'\n')
+        # 按行转义，跨块的半行留到下一块一起处理
+        pending = b''
+        for chunk in _iter_data_chunks(data):
+            chunk = pending + bytes(chunk)
+            cut = chunk.rfind(b'\n') + 1
+            pending = chunk[cut:]
+            f.write(self._FROM_LINE_RE.sub(rb'>\1', chunk[:cut]))
+        if pending:
+            f.write(self._FROM_LINE_RE.sub(rb'>\1', pending) + b'\n')
+        # 邮件之间以空行分隔
+        f.write(b'\n')
+        return {'offset': offset, 'length': f.tell() - offset}
+
+    def _flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close(self):
+        self._file.close()
+
+
+class ZipSink(ArchiveSink):
+    """ZIP输出（每封邮件一个压缩成员，边转换边写入）"""
+
+    def _open(self):
+        import zipfile
+        self._zipfile = zipfile
+        mode = 'a' if os.path.exists(self.path) else 'w'
+        self._zip = zipfile.ZipFile(self.path, mode, compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._members.update(self._zip.namelist())
+
+    def _append(self, msg_path, data, size):
+        name = self.member_name(msg_path)
+        info = self._zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = self._zipfile.ZIP_DEFLATED
+        info.file_size = size
+        with self._zip.open(info, 'w') as member:
+            for chunk in _iter_data_chunks(data):
+                member.write(chunk)
+        return {'member': name, 'offset': info.header_offset}
+
+    def _close(self):
+        self._zip.close()
+
+
+class TarSink(ArchiveSink):
+    """tar输出（.tar可在已有归档后追加；.tar.gz/.tgz压缩，只能新建）"""
+
+    def _open(self):
+        import tarfile
+        self._tarfile = tarfile
+        self.compressed = self.path.lower().endswith(('.gz', '.tgz'))
+        if self.compressed:
+            self._tar = tarfile.open(self.path, 'x:gz')
+        else:
+            self._tar = tarfile.open(self.path, 'a')
+            self._members.update(self._tar.getnames())
+
+    def _append(self, msg_path, data, size):
+        name = self.member_name(msg_path)
+        info = self._tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = io.BytesIO(data)
+        else:
+            data.seek(0)
+        self._tar.addfile(info, data)
+        location = {'member': name}
+        if not self.compressed:
+            # 成员数据之后补齐到整块，由此倒推数据在归档中的偏移
+            blocksize = self._tarfile.BLOCKSIZE
+            location['offset'] = self._tar.offset - _ceil_div(size, blocksize) * blocksize
+            location['length'] = size
+        return location
+
+    def _flush(self):
+        fileobj = self._tar.fileobj
+        fileobj.flush()
+        if not self.compressed:
+            os.fsync(fileobj.fileno())
+
+    def _close(self):
+        self._tar.close()
+
+
+# 归档输出的格式（按文件扩展名选择）
+ARCHIVE_SINKS = {
+    '.mbox': MboxSink,
+    '.zip': ZipSink,
+    '.tar': TarSink,
+    '.tar.gz': TarSink,
+    '.tgz': TarSink,
+}
+
+
+def open_archive_sink(path):
+    """按扩展名打开归档输出目标"""
+    lower = path.lower()
+    for suffix, sink_class in ARCHIVE_SINKS.items():
+        if lower.endswith(suffix):
+            return sink_class(path)
+    raise ValueError(f"不支持的归档格式: {path}（支持 {'、'.join(ARCHIVE_SINKS)}）")
+
+
+class BufferSink:
+    """工作进程中的输出目标：EML内容随结果返回，由主进程追加到归档"""
+
+    def spool(self):
+        return io.BytesIO()
+
+    def add(self, msg_path, data):
+        return {'data': data.getvalue()}
+
+
+class OutputIndex:
+    """输出索引（JSON Lines）：每行记录一个源MSG文件和它的输出位置
+    
+    输出到目录时为EML文件路径；输出到归档时为归档路径加成员名（ZIP、tar）
+    或字节偏移和长度（mbox），可以直接定位，不需要扫描归档。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def add(self, msg_path, result):
+        entry = {'source': os.path.abspath(msg_path), 'output': os.path.abspath(result['output_file'])}
+        for key in ARCHIVE_LOCATION_KEYS:
+            if key in result:
+                entry[key] = result[key]
+        if 'duplicate_of' in result:
+            entry['duplicate_of'] = os.path.abspath(result['duplicate_of'])
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def lookup(path, msg_path):
+        """在索引文件中查找源文件最近一次的输出位置（键名与转换结果相同），没有时返回None"""
+        source = os.path.abspath(msg_path)
+        found = None
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 中断时写了一半的行
+                    continue
+                if entry.get('source') == source:
+                    found = entry
+        if found is None:
+            return None
+        location = {key: found[key] for key in ARCHIVE_LOCATION_KEYS if key in found}
+        return dict(location, output_file=found['output'])
+
+
+def read_output_headers(location):
+    """读取转换输出的邮件头，返回 [(名称, 值)]；位置未知时返回None
+    
+    location为转换结果（或 OutputIndex.lookup 的返回值）。输出为归档时按其中
+    记录的位置只读取那一封邮件：mbox和tar按字节偏移，ZIP和tar.gz按成员名。
+    """
+    path = location['output_file']
+    lower = path.lower()
+    if not lower.endswith(tuple(ARCHIVE_SINKS)):
+        return read_eml_headers(path)
+    
+    if 'offset' in location and lower.endswith(('.mbox', '.tar')):
+        with open(path, 'rb') as f:
+            f.seek(location['offset'])
+            if lower.endswith('.mbox'):
+                # 跳过 From_ 分隔行
+                f.readline()
+            return read_header_block(f, min(HEADER_BLOCK_LIMIT, location.get('length') or HEADER_BLOCK_LIMIT))
+    if 'member' in location:
+        if lower.endswith('.zip'):
+            import zipfile
+            with zipfile.ZipFile(path) as archive, archive.open(location['member']) as f:
+                return read_header_block(f)
+        import tarfile
+        with tarfile.open(path) as archive, archive.extractfile(location['member']) as f:
+            return read_header_block(f)
+    return None
+
+
+# 工作进程内缓存的转换引擎（按选项复用，进程常驻时跨批次保持）
+_worker_engines = {}
+
+
+def _convert_in_worker(msg_path, output_dir, options, output_path=None, to_archive=False, reserved=False):
+    """在工作进程中转换单个文件（to_archive为True时EML内容随结果返回）"""
+    engine = _worker_engines.get(options)
+    if engine is None:
+        engine = _worker_engines[options] = MSGConversionEngine(options)
+    return engine.convert(msg_path, output_dir, output_path, BufferSink() if to_archive else None, reserved)
+
+
+def create_worker_pool(workers, ignore_interrupts=False, limits=None):
+    """创建转换进程池，进程常驻，可在多个批次之间复用
+    
+    ignore_interrupts为True时工作进程忽略Ctrl+C和SIGTERM，由主进程收到后
+    关闭进程池，正在转换的文件可以写完。limits（见 WorkerLimits）中有任何
+    一项限制时使用 SupervisedWorkerPool。
+    """
+    initializer = _ignore_interrupts if ignore_interrupts else None
+    if limits is not None and any(limits):
+        return SupervisedWorkerPool(workers, limits, initializer)
+    return ProcessWorkerPool(workers, initializer)
+
+
+class ProcessWorkerPool:
+    """不限制资源时的转换进程池（ProcessPoolExecutor），接口相同（submit、shutdown）
+    
+    ProcessPoolExecutor 中有工作进程意外退出（被OOM killer杀掉、C扩展崩溃）
+    后整个进程池永久不可用：在途任务以 BrokenProcessPool 结束，之后的submit也
+    会失败。这里在submit遇到这种情况时关闭旧进程池，按相同参数换一个新的再
+    提交，跨批次复用的进程池（界面、监视模式、转换服务）不会因一次崩溃而无法继续。
+    """
+
+    def __init__(self, workers, initializer=None):
+        self.workers = workers
+        self._initializer = initializer
+        self._lock = threading.Lock()
+        self._executor = self._create()
+
+    def _create(self):
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=self._initializer)
+
+    def submit(self, fn, *args):
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                # 同时发现损坏的多个线程只换一次
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._create()
+                executor = self._executor
+            return executor.submit(fn, *args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def _ignore_interrupts():
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _warm_worker(options):
+    """在工作进程中预先创建转换引擎并导入extract_msg"""
+    if options not in _worker_engines:
+        _worker_engines[options] = MSGConversionEngine(options)
+    import extract_msg
+    return os.getpid()
+
+
+def warm_worker_pool(executor, workers, options):
+    """启动全部工作进程并完成导入，第一个文件不再承担进程启动的开销"""
+    from concurrent.futures import wait
+    wait([executor.submit(_warm_worker, options) for _ in range(workers)])
+
+
+# 工作进程的资源限制：单个文件的转换时长（秒）、常驻内存上限（MB）、
+# 每个工作进程转换多少个文件后换新进程；None表示不限制
+WorkerLimits = namedtuple('WorkerLimits', [
+    'timeout',
+    'max_rss_mb',
+    'max_tasks',
+], defaults=(None, None, None))
+
+# 监督线程检查超时和内存占用的间隔（秒）
+WORKER_CHECK_INTERVAL = 0.1
+
+# 工作进程启动失败后重新启动的等待时间（秒，连续失败时加倍），以及连续失败
+# 多少次后放弃：排队和之后提交的任务都以 WorkerTerminated 结束
+WORKER_RESTART_DELAY = 0.5
+WORKER_START_ATTEMPTS = 5
+
+# 换新的工作进程正常退出的等待时间（秒），超过后直接杀掉
+WORKER_STOP_TIMEOUT = 5
+
+
+class WorkerTerminated(Exception):
+    """工作进程被终止或意外退出，文件没有转换完成"""
+
+    status = 'failed'
+
+
+class ConversionTimeout(WorkerTerminated):
+    """转换时间超过限制"""
+
+    status = 'timeout'
+
+
+class MemoryLimitExceeded(WorkerTerminated):
+    """工作进程内存占用超过限制"""
+
+    status = 'over_limit'
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_rss(pid):
+    """进程当前的常驻内存（字节）；Linux读取/proc，其他系统需要psutil，都不可用时返回None"""
+    try:
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def _supervised_worker(conn, initializer):
+    """SupervisedWorkerPool 的工作进程：准备好后通知主进程，逐个执行任务，读到None时退出"""
+    if initializer is not None:
+        initializer()
+    # 先导入extract_msg，导入时间不计入第一个文件的转换时长
+    if EXTRACT_MSG_AVAILABLE:
+        import extract_msg
+    conn.send(None)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args = task
+        try:
+            reply = (True, fn(*args))
+        except BaseException as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # 结果或异常无法序列化
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _SupervisedWorker:
+    """一个工作进程及其正在执行的任务"""
+
+    def __init__(self, initializer):
+        import multiprocessing
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_supervised_worker, args=(child_conn, initializer),
+                                               daemon=True)
+        self.process.start()
+        child_conn.close()
+        # 工作进程完成导入、发来通知之后才分派任务
+        self.ready = False
+        self.future = None
+        self.deadline = None
+        self.tasks_done = 0
+
+    def start_task(self, future, fn, args, timeout):
+        self.conn.send((fn, args))
+        self.future = future
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def retire(self):
+        """空闲时通知进程退出，不等待（见 reap）"""
+        with contextlib.suppress(OSError):
+            self.conn.send(None)
+        self.deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+
+    def reap(self, wait=False):
+        """进程已退出（或超过等待时间被杀掉）时回收并返回True"""
+        if wait:
+            self.process.join(max(0, self.deadline - time.monotonic()))
+        if self.process.is_alive():
+            if time.monotonic() < self.deadline:
+                return False
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+        return True
+
+
+class SupervisedWorkerPool:
+    """带资源限制的转换进程池，接口与 ProcessPoolExecutor 相同（submit、shutdown）
+    
+    每个工作进程同一时间只执行一个任务，由主进程中的监督线程分派。转换时间
+    超过limits.timeout、或常驻内存超过limits.max_rss_mb的工作进程被直接杀掉
+    并换成新进程，对应任务以 ConversionTimeout / MemoryLimitExceeded 结束，
+    后面的文件不会被卡住。工作进程意外退出（如被系统的OOM killer杀掉）时
+    任务以 WorkerTerminated 结束。每个进程转换limits.max_tasks个文件后换新，
+    避免内存碎片和第三方库的泄漏累积。内存每 WORKER_CHECK_INTERVAL 秒检查一次，
+    短时间内的突增可能超出上限。
+    """
+
+    def __init__(self, workers, limits, initializer=None):
+        self.limits = limits
+        self._initializer = initializer
+        self._tasks = deque()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        # 连续启动失败的次数；达到 WORKER_START_ATTEMPTS 后为失败原因
+        self._start_failures = 0
+        self._broken = None
+        # 等待重新启动的时间（启动失败后）和正在退出的旧进程，都只由监督线程访问
+        self._restarts = []
+        self._retiring = []
+        self._rss_limit = limits.max_rss_mb * 1024 * 1024 if limits.max_rss_mb else None
+        if self._rss_limit and process_rss(os.getpid()) is None:
+            print("无法读取进程内存占用（需要Linux或安装psutil），内存上限不生效")
+            self._rss_limit = None
+        import multiprocessing
+        self._wakeup_reader, self._wakeup_writer = multiprocessing.Pipe(duplex=False)
+        self._workers = [_SupervisedWorker(initializer) for _ in range(max(1, workers))]
+        self._thread = threading.Thread(target=self._supervise, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("进程池已关闭")
+            if self._broken is not None:
+                future.set_exception(WorkerTerminated(self._broken))
+                return future
+            self._tasks.append((future, fn, args))
+            self._wakeup_writer.send(None)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._lock:
+            if cancel_futures:
+                for future, _fn, _args in self._tasks:
+                    if not future.cancel():
+                        # 发送失败后放回队列的任务已是运行状态，无法取消
+                        future.set_exception(WorkerTerminated("进程池已关闭"))
+                self._tasks.clear()
+            if not self._shutdown:
+                self._shutdown = True
+                self._wakeup_writer.send(None)
+        if wait:
+            self._thread.join()
+
+    def _supervise(self):
+        from multiprocessing.connection import wait as wait_connections
+        while True:
+            with self._lock:
+                self._dispatch()
+                busy = [worker for worker in self._workers if worker.future is not None]
+                if self._shutdown and not self._tasks and not busy:
+                    break
+            starting = [worker for worker in self._workers if not worker.ready]
+            
+            now = time.monotonic()
+            while self._restarts and self._restarts[0] <= now:
+                self._restarts.pop(0)
+                self._workers.append(_SupervisedWorker(self._initializer))
+            self._retiring = [worker for worker in self._retiring if not worker.reap()]
+            
+            ready = wait_connections([self._wakeup_reader] + [worker.conn for worker in busy + starting],
+                                     WORKER_CHECK_INTERVAL)
+            for conn in ready:
+                if conn is self._wakeup_reader:
+                    while self._wakeup_reader.poll():
+                        self._wakeup_reader.recv()
+                    continue
+                worker = next(worker for worker in busy + starting if worker.conn is conn)
+                if worker not in self._workers:
+                    # 本轮中已因其他进程启动失败而被放弃
+                    continue
+                if worker.ready:
+                    self._collect(worker)
+                    continue
+                try:
+                    worker.conn.recv()
+                    worker.ready = True
+                    self._start_failures = 0
+                except (EOFError, OSError):
+                    self._start_failed(worker)
+            
+            now = time.monotonic()
+            for worker in busy:
+                if worker.future is None:
+                    continue
+                if worker.deadline is not None and now > worker.deadline:
+                    self._terminate(worker, ConversionTimeout(
+                        f"转换超过 {self.limits.timeout:g} 秒，已终止"))
+                elif self._rss_limit:
+                    rss = process_rss(worker.process.pid)
+                    if rss is not None and rss > self._rss_limit:
+                        self._terminate(worker, MemoryLimitExceeded(
+                            f"内存占用 {rss / 1024 / 1024:.0f} MB 超过上限 {self.limits.max_rss_mb} MB，已终止"))
+        
+        for worker in self._workers:
+            worker.retire()
+        for worker in self._workers + self._retiring:
+            worker.reap(wait=True)
+
+    def _dispatch(self):
+        """把排队的任务分给空闲的工作进程（持有锁时调用）"""
+        for worker in self._workers:
+            if not self._tasks:
+                return
+            if worker.future is not None or not worker.ready:
+                continue
+            task = self._tasks.popleft()
+            future = task[0]
+            # 发送失败后放回队列的任务已经是运行状态
+            if not future.running() and not future.set_running_or_notify_cancel():
+                continue
+            try:
+                worker.start_task(future, *task[1:], self.limits.timeout)
+            except OSError:
+                # 工作进程已退出，任务还没有开始执行：放回队首，交给其他（或新的）工作进程
+                worker.future = worker.deadline = None
+                self._tasks.appendleft(task)
+                self._replace(worker, None)
+
+    def _collect(self, worker):
+        """读取工作进程返回的结果"""
+        future = worker.future
+        try:
+            ok, value = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join(1)
+            exitcode = worker.process.exitcode
+            hint = "，可能因内存不足被系统终止" if exitcode == -9 else ""
+            self._replace(worker, WorkerTerminated(f"工作进程意外退出（退出码 {exitcode}）{hint}"))
+            return
+        worker.future = worker.deadline = None
+        worker.tasks_done += 1
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+        if self.limits.max_tasks and worker.tasks_done >= self.limits.max_tasks:
+            # 旧进程在后面的循环中回收，不在这里等待它退出
+            worker.retire()
+            self._retiring.append(worker)
+            self._workers[self._workers.index(worker)] = _SupervisedWorker(self._initializer)
+
+    def _start_failed(self, worker):
+        """工作进程在准备好之前就退出了（例如导入或初始化失败）
+        
+        等待一段时间（连续失败时加倍）后再启动新进程；连续失败
+        WORKER_START_ATTEMPTS 次后不再启动，所有排队的任务以 WorkerTerminated 结束。
+        """
+        worker.process.join()
+        worker.conn.close()
+        self._workers.remove(worker)
+        self._start_failures += 1
+        if self._start_failures < WORKER_START_ATTEMPTS:
+            delay = WORKER_RESTART_DELAY * 2 ** (self._start_failures - 1)
+            self._restarts.append(time.monotonic() + delay)
+            self._restarts.sort()
+            return
+        
+        with self._lock:
+            self._broken = (f"工作进程连续 {self._start_failures} 次启动失败"
+                            f"（退出码 {worker.process.exitcode}），不再启动")
+            tasks, self._tasks = self._tasks, deque()
+        print(self._broken)
+        # 其他工作进程也会因同样的原因失败，不再等待它们
+        for other in self._workers:
+            if not other.ready:
+                other.kill()
+        self._workers = [other for other in self._workers if other.ready]
+        self._restarts.clear()
+        for future, _fn, _args in tasks:
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(WorkerTerminated(self._broken))
+
+    def _terminate(self, worker, error):
+        worker.kill()
+        self._replace(worker, error)
+
+    def _replace(self, worker, error):
+        """任务以error结束，换一个新的工作进程"""
+        future = worker.future
+        worker.future = None
+        if worker.process.is_alive():
+            worker.kill()
+        else:
+            worker.conn.close()
+        # 工作进程列表只由监督线程修改
+        self._workers[self._workers.index(worker)] = _SupervisedWorker(self._initializer)
+        if future is not None:
+            future.set_exception(error)
+
+
+# 流水线各阶段的线程数，以及阶段之间队列的容量
+PipelineStages = namedtuple('PipelineStages', [
+    'readers',
+    'builders',
+    'writers',
+    'queue_size',
+], defaults=(2, 1, 2, 4))
+
+
+class ConversionPipeline:
+    """分阶段转换流水线：读取 → 构建 → 写出
+    
+    三个阶段各有自己的线程，阶段之间是有界队列：读取快于构建时读取线程
+    在队列满时阻塞，内存中已解析但未处理的消息不超过队列容量加上线程数。
+    磁盘读取、邮件构建和文件写出因此可以在不同文件之间重叠进行。
+    """
+
+    def __init__(self, engine, stages=None, sink=None):
+        self.engine = engine
+        self.stages = stages if stages is not None else PipelineStages()
+        self.sink = sink
+        # 输入队列不设上限，由调用方按 capacity 控制在途任务数
+        self.read_queue = queue.Queue()
+        self.build_queue = queue.Queue(maxsize=self.stages.queue_size)
+        self.write_queue = queue.Queue(maxsize=self.stages.queue_size)
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.closed = False
+        self._lock = threading.Lock()
+        
+        stage_specs = (
+            (self.read_queue, self.build_queue, self._read, self.stages.readers, self.stages.builders),
+            (self.build_queue, self.write_queue, self._build, self.stages.builders, self.stages.writers),
+            (self.write_queue, self.results, self._write, self.stages.writers, 0),
+        )
+        for source, target, func, count, next_count in stage_specs:
+            remaining = [count]
+            for _ in range(count):
+                thread = threading.Thread(target=self._run_stage,
+                                          args=(source, target, func, remaining, next_count))
+                thread.daemon = True
+                thread.start()
+
+    @property
+    def capacity(self):
+        """让各阶段都不空闲所需的在途任务数"""
+        stages = self.stages
+        return stages.readers + stages.builders + stages.writers + 2 * stages.queue_size
+
+    def submit(self, key, msg_path, output_dir, output_path=None):
+        """提交一个文件，完成后通过 get_result() 返回 (key, result)"""
+        self.read_queue.put({
+            'key': key,
+            'msg_path': msg_path,
+            'output_dir': output_dir,
+            'output_path': output_path,
+            'msg': None,
+            'email_msg': None,
+            'metrics': new_file_metrics(),
+        })
+
+    def get_result(self):
+        """等待下一个完成的文件，返回 (key, result)"""
+        return self.results.get()
+
+    def get_results(self, timeout=None):
+        """等待至少一个完成的文件（最多timeout秒），连同其他已完成的一起返回"""
+        try:
+            results = [self.results.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self, cancel=False):
+        """结束各阶段线程；cancel为True时丢弃尚未处理的文件"""
+        if self.closed:
+            return
+        self.closed = True
+        if cancel:
+            self.cancelled.set()
+        for _ in range(self.stages.readers):
+            self.read_queue.put(None)
+
+    def _run_stage(self, source, target, func, remaining, next_count):
+        """阶段线程：从上游队列取任务，处理后放入下游队列，读到None时退出"""
+        while True:
+            job = source.get()
+            if job is None:
+                break
+            if self.cancelled.is_set():
+                self._close_message(job)
+                continue
+            try:
+                job = func(job)
+            except Exception as e:
+                self._close_message(job)
+                self.results.put((job['key'], {
+                    'status': 'failed',
+                    'error': str(e),
+                    'error_type': type(e).__name__,
+                    'metrics': job['metrics']
+                }))
+                continue
+            # 下游队列已满时在此阻塞，形成背压
+            target.put(job)
+        
+        # 本阶段最后一个线程退出时通知下一阶段的所有线程
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(next_count):
+                target.put(None)
+
+    def _read(self, job):
+        with self.engine.stage_metrics(job['metrics']):
+            job['msg'] = self.engine.read_message(job['msg_path'])
+        return job
+
+    def _build(self, job):
+        with self.engine.stage_metrics(job['metrics']):
+            job['email_msg'] = self.engine.build_eml_message(job['msg'])
+        return job
+
+    def _write(self, job):
+        try:
+            with self.engine.stage_metrics(job['metrics']):
+                if self.sink is None:
+                    output = {'output_file': self.engine.write_output(job['email_msg'], job['msg_path'],
+                                                                      job['output_dir'], job['output_path'])}
+                else:
+                    output = self.engine.write_to_sink(job['email_msg'], job['msg_path'], self.sink)
+            if self.engine.options.collect_headers:
+                output['headers'] = classify_headers(job['email_msg'].items())
+        finally:
+            self._close_message(job)
+        return job['key'], dict(output, status='success', options=self.engine.options._asdict(),
+                                metrics=job['metrics'])
+
+    @staticmethod
+    def _close_message(job):
+        msg = job.get('msg')
+        if msg is not None:
+            job['msg'] = None
+            job['email_msg'] = None
+            try:
+                msg.close()
+            except Exception:
+                pass
+
+
+# 转换失败时列表中显示的状态
+RESULT_STATUS_LABELS = {
+    'failed': '转换失败',
+    'timeout': '转换超时',
+    'over_limit': '内存超限',
+}
+
+# 界面中单个文件转换时长上限的默认值（秒，0表示不限制）
+# 界面默认限制超时：线程中的转换无法被终止，一个损坏的文件会让转换线程一直
+# 卡住、按钮保持禁用，因此默认在可以终止的工作进程中转换。设为0且进程数为1时
+# 在后台线程中通过分阶段流水线（见 ConversionPipeline）转换，省去进程间传输。
+GUI_FILE_TIMEOUT = 300
+
+# 界面批量刷新的间隔（毫秒）
+UI_UPDATE_INTERVAL_MS = 100
+
+# 界面上的输出格式及对应的归档扩展名（None为逐个EML文件）
+GUI_OUTPUT_FORMATS = {
+    'EML文件': None,
+    'mbox': '.mbox',
+    'ZIP': '.zip',
+    'tar': '.tar',
+}
+
+# 界面输出到归档时的文件名（不含扩展名）
+ARCHIVE_BASENAME = 'converted'
+
+# 默认的增量转换清单文件名
+MANIFEST_FILENAME = '.msg_to_eml_manifest.json'
+
+# 去重时抽样哈希每个位置读取的字节数
+DEDUP_SAMPLE_SIZE = 64 * 1024
+
+
+def file_sha256(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sample_sha256(path, size):
+    """对文件开头、中间和末尾的数据块做哈希"""
+    digest = hashlib.sha256()
+    offsets = sorted({0, max(0, size // 2 - DEDUP_SAMPLE_SIZE // 2), max(0, size - DEDUP_SAMPLE_SIZE)})
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(DEDUP_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class DuplicateDetector:
+    """逐个判断输入文件是否与之前的某个文件内容完全相同
+    
+    按文件大小、抽样哈希、完整哈希逐层索引：{大小: {抽样哈希: {完整哈希: 首个文件}}}，
+    每个文件只需几次字典查找，不与之前的文件逐个比较。某一层只有一个文件时
+    不展开下一层，哈希留到出现第二个相同的文件时才计算（小文件抽样已覆盖全部
+    内容，没有完整哈希这一层）。每个文件到达时即可判断，输入可以是仍在发现中
+    的路径流，无需等待全部输入。
+    """
+
+    def __init__(self):
+        self.by_size = {}
+
+    def original_of(self, path):
+        """返回与path内容相同的首个文件；没有时记录path并返回None
+        
+        无法读取的文件按不重复处理；之前记录的文件变得无法读取时由path取代。
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        
+        hash_funcs = [lambda p: _sample_sha256(p, size)]
+        if size > DEDUP_SAMPLE_SIZE:
+            hash_funcs.append(file_sha256)
+        
+        node, key = self.by_size, size
+        for hash_func in hash_funcs:
+            entry = node.get(key)
+            if entry is None:
+                node[key] = path
+                return None
+            if not isinstance(entry, dict):
+                # 这一层目前只有一个文件，计算它的哈希，展开下一层
+                try:
+                    entry = node[key] = {hash_func(entry): entry}
+                except OSError:
+                    node[key] = path
+                    return None
+            try:
+                node, key = entry, hash_func(path)
+            except OSError:
+                return None
+        
+        original = node.get(key)
+        if original is None:
+            node[key] = path
+        return original
+
+
+def _reflink(src, dst):
+    """在支持的文件系统（btrfs、XFS等）上创建写时复制副本"""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """依次尝试硬链接、reflink和复制，目标文件已存在时抛出FileExistsError"""
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    
+    if platform.system() == 'Linux':
+        try:
+            _reflink(src, dst)
+            return
+        except FileExistsError:
+            raise
+        except OSError:
+            pass
+    
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+def options_fingerprint(options):
+    """转换选项的指纹，选项变化后需要重新转换"""
+    data = json.dumps({name: value for name, value in options._asdict().items()
+                       if name not in OUTPUT_NEUTRAL_OPTIONS}, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+class ConversionManifest:
+    """增量转换清单
+    
+    记录每个输入文件的路径、大小、修改时间（可选内容哈希）、转换选项指纹和
+    输出路径，保存为JSON文件。再次转换时，输入未变化、选项相同且输出文件
+    仍在目标目录中的文件直接跳过。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash
+        self.entries = {}
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        self.load()
+
+    def load(self):
+        """读取清单文件，文件不存在或损坏时从空清单开始"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.entries = data.get('entries', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"读取转换清单时出错: {e}")
+
+    def save(self):
+        """原子地写回清单文件"""
+        if not self.dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def checkpoint(self, interval):
+        """距离上次保存超过interval秒时保存，供长时间运行的监视模式定期调用"""
+        if self.dirty and time.monotonic() - self.saved_at >= interval:
+            self.save()
+
+    def fingerprint(self, msg_path):
+        """输入文件的指纹（大小和修改时间）"""
+        st = os.stat(msg_path)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def lookup(self, msg_path, output_dir, options_hash, archive=None):
+        """返回 (可跳过时的输出路径或None, 输入文件指纹)
+        
+        指定archive（归档输出的路径）时，只有之前已写入同一归档的文件可以跳过。
+        """
+        key = os.path.abspath(msg_path)
+        try:
+            fingerprint = self.fingerprint(msg_path)
+        except OSError:
+            return None, None
+        
+        entry = self.entries.get(key)
+        if entry is None or entry['options'] != options_hash:
+            return None, fingerprint
+        
+        output_file = entry['output']
+        if archive is not None:
+            if output_file != os.path.abspath(archive):
+                return None, fingerprint
+        elif os.path.dirname(output_file) != os.path.abspath(output_dir or os.path.dirname(key)):
+            return None, fingerprint
+        if not os.path.exists(output_file):
+            return None, fingerprint
+        
+        if entry['size'] != fingerprint['size']:
+            return None, fingerprint
+        if entry['mtime_ns'] != fingerprint['mtime_ns']:
+            # 修改时间变了但内容可能没变（例如重新复制），启用哈希时再比较内容
+            if not self.use_hash or not entry.get('sha256'):
+                return None, fingerprint
+            try:
+                if file_sha256(msg_path) != entry['sha256']:
+                    return None, fingerprint
+            except OSError:
+                return None, fingerprint
+            entry['mtime_ns'] = fingerprint['mtime_ns']
+            self.dirty = True
+        elif self.use_hash and not entry.get('sha256'):
+            # 之前未启用哈希时记录的条目，补记内容哈希
+            try:
+                entry['sha256'] = file_sha256(msg_path)
+                self.dirty = True
+            except OSError:
+                pass
+        
+        return output_file, fingerprint
+
+    def record(self, msg_path, fingerprint, options_hash, output_file):
+        """记录一次成功的转换"""
+        if fingerprint is None:
+            return
+        entry = dict(fingerprint)
+        entry['options'] = options_hash
+        entry['output'] = os.path.abspath(output_file)
+        if self.use_hash:
+            try:
+                entry['sha256'] = file_sha256(msg_path)
+            except OSError:
+                pass
+        self.entries[os.path.abspath(msg_path)] = entry
+        self.dirty = True
+
+
+# 断点续转日志的默认文件名
+JOURNAL_FILENAME = '.msg_to_eml_journal.jsonl'
+
+# 断点续转日志累计多少条记录、或距上次写入磁盘多少秒后统一fsync一次
+JOURNAL_SYNC_RECORDS = 256
+JOURNAL_SYNC_SECONDS = 1.0
+
+
+def _fsync_path(path):
+    """把文件内容刷到磁盘"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ConversionJournal:
+    """断点续转日志（JSON Lines，只追加）
+    
+    第一行记录转换选项指纹和输出位置，之后每成功转换一个文件追加一行。
+    记录先缓冲，每 JOURNAL_SYNC_RECORDS 条或 JOURNAL_SYNC_SECONDS 秒连同输出
+    文件一起fsync一次。续转时跳过日志中已完成的文件；最后一行可能只写了一半，
+    读取时忽略。
+    
+    输出到目录时，EML先写入输出目录中按源文件路径命名的临时文件（见
+    staging_path），写完后硬链接到正式文件名，正式文件不会只有一半内容。
+    临时文件保留到对应记录写入磁盘之后才删除，所以续转时遇到的临时文件中，
+    只有一个链接的是写了一半的，直接删除；有两个链接的说明正式文件已就位、
+    只是记录丢失，找回正式文件补记即可，不会重复输出。
+    输出到归档时，续转前把归档截断到最后一条已记录的邮件之后（见 truncate_archive）。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, options_hash, output_dir=None, archive=None, resume=False):
+        self.path = path
+        self.header = {
+            'journal': self.VERSION,
+            'options': options_hash,
+            'output_dir': os.path.abspath(output_dir) if output_dir else None,
+            'archive': os.path.abspath(archive) if archive else None,
+        }
+        self.entries = {}
+        self.resumed = False
+        if resume:
+            self._load()
+        if not self.resumed:
+            # 记录归档中原有内容的结束位置，续转时不会截断之前运行写入的内容
+            self.header['archive_size'] = archive_append_offset(archive) if archive else 0
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a' if self.resumed else 'w', encoding='utf-8')
+        if not self.resumed:
+            self._file.write(json.dumps(self.header, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.sink = None
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        # 已就位、等待记录写入磁盘的 (临时文件, 正式文件)
+        self._staged = []
+        # 正在使用（转换中或等待删除）的临时文件
+        self._claimed = set()
+
+    def _load(self):
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            line = f.readline()
+            if not line.strip():
+                # 上次刚开始就中断了
+                return
+            try:
+                header = json.loads(line)
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or header.get('journal') != self.VERSION:
+                raise ValueError(f"无法识别的续转日志: {self.path}")
+            for key in ('options', 'output_dir', 'archive'):
+                if header.get(key) != self.header[key]:
+                    raise ValueError(f"续转日志与本次的转换选项或输出位置不一致: {self.path}")
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 中断时只写了一半的最后一行
+                    continue
+                self.entries[entry['source']] = entry
+        self.header['archive_size'] = header.get('archive_size', 0)
+        self.resumed = True
+
+    @property
+    def archive_end(self):
+        """已记录的邮件在归档中的结束位置，续转前把归档截断到这里"""
+        from tarfile import BLOCKSIZE
+        end = self.header.get('archive_size', 0)
+        for entry in self.entries.values():
+            if 'offset' in entry and 'length' in entry:
+                length = entry['length']
+                if 'member' in entry:
+                    # tar成员的数据补齐到整块
+                    length = _ceil_div(length, BLOCKSIZE) * BLOCKSIZE
+                end = max(end, entry['offset'] + length)
+        return end
+
+    def lookup(self, msg_path):
+        """返回已完成文件的记录，未完成（或输出文件已不存在）时返回None"""
+        entry = self.entries.get(os.path.abspath(msg_path))
+        if entry is None:
+            return None
+        if self.header['archive'] is None and not os.path.exists(entry['output']):
+            return None
+        return entry
+
+    def staging_path(self, msg_path, output_dir=None):
+        """源文件在输出目录中的临时文件路径（由源文件路径唯一确定）"""
+        digest = hashlib.sha1(os.path.abspath(msg_path).encode('utf-8', 'surrogatepass')).hexdigest()[:20]
+        return os.path.join(output_dir or os.path.dirname(msg_path), f".{digest}.eml.part")
+
+    def claim_staging(self, msg_path, output_dir=None):
+        """为一次转换分配临时文件
+        
+        同一个源文件在本次转换中出现多次、上一个临时文件仍在使用时返回None，
+        这次直接写到正式文件名。
+        """
+        staging = self.staging_path(msg_path, output_dir)
+        if staging in self._claimed:
+            return None
+        self._claimed.add(staging)
+        return staging
+
+    def release_staging(self, staging):
+        """临时文件已删除或改名，不再使用"""
+        self._claimed.discard(staging)
+
+    def recover(self, msg_path, output_dir=None):
+        """清理源文件上次中断时留下的临时文件
+        
+        续转时如果正式文件已经就位（临时文件有两个链接），补记并返回正式文件路径。
+        """
+        staging = self.staging_path(msg_path, output_dir)
+        if staging in self._claimed:
+            return None
+        try:
+            st = os.stat(staging)
+        except OSError:
+            return None
+        output_file = None
+        if self.resumed and st.st_nlink > 1:
+            try:
+                with os.scandir(os.path.dirname(staging)) as entries:
+                    for entry in entries:
+                        if (entry.name != os.path.basename(staging) and entry.is_file(follow_symlinks=False)
+                                and entry.inode() == st.st_ino):
+                            output_file = entry.path
+                            break
+            except OSError:
+                pass
+        if output_file is not None:
+            self._claimed.add(staging)
+            self.record(msg_path, {'output_file': output_file}, staging)
+        else:
+            with contextlib.suppress(OSError):
+                os.remove(staging)
+        return output_file
+
+    def place(self, staging, output_path):
+        """把写完的临时文件放到正式文件名，正式文件已存在时抛出FileExistsError
+        
+        返回临时文件是否仍然保留（作为正式文件的第二个链接）。
+        """
+        try:
+            os.link(staging, output_path)
+            return True
+        except FileExistsError:
+            raise
+        except OSError:
+            # 不支持硬链接的文件系统：直接改名，中断后无法找回这个文件
+            if os.path.exists(output_path):
+                raise FileExistsError(output_path)
+            os.rename(staging, output_path)
+            return False
+
+    def record(self, msg_path, result, staging=None):
+        """记录一个成功转换的文件，staging为place()之后仍保留的临时文件"""
+        entry = {'source': os.path.abspath(msg_path), 'output': os.path.abspath(result['output_file'])}
+        for key in ARCHIVE_LOCATION_KEYS:
+            if key in result:
+                entry[key] = result[key]
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.entries[entry['source']] = entry
+        self._staged.append((staging, result['output_file']))
+        self._unsynced += 1
+        if (self._unsynced >= JOURNAL_SYNC_RECORDS
+                or time.monotonic() - self._synced_at >= JOURNAL_SYNC_SECONDS):
+            self.sync()
+
+    def sync(self):
+        """先把输出写入磁盘，再写入日志记录，最后删除对应的临时文件"""
+        if self.sink is not None:
+            self.sink.flush()
+        for staging, output_file in self._staged:
+            if self.sink is None:
+                with contextlib.suppress(OSError):
+                    _fsync_path(output_file)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        for staging, output_file in self._staged:
+            if staging is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(staging)
+                self._claimed.discard(staging)
+        self._staged = []
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+
+def archive_append_offset(path):
+    """归档中原有内容的结束位置，即本次追加的起点
+    
+    tar归档末尾的结束块会被新成员覆盖，所以起点是最后一个成员的数据之后。
+    """
+    if not os.path.exists(path):
+        return 0
+    if path.lower().endswith('.tar'):
+        import tarfile
+        with tarfile.open(path, 'r') as tar:
+            tar.getmembers()
+            return tar.offset
+    return os.path.getsize(path)
+
+
+def truncate_archive(path, end):
+    """续转前截断归档中最后一条已记录的邮件之后（中断时写了一半）的内容"""
+    if not os.path.exists(path) or os.path.getsize(path) <= end:
+        return
+    lower = path.lower()
+    if not lower.endswith(('.mbox', '.tar')):
+        raise ValueError(f"{os.path.basename(path)} 格式的归档中断后无法续转，请改用 .mbox 或 .tar")
+    with open(path, 'r+b') as f:
+        f.truncate(end)
+        if lower.endswith('.tar'):
+            # 补上结束块，tarfile才能以追加方式打开
+            f.seek(end)
+            f.write(b'\0' * 1024)
+
+
+# 阶段耗时直方图的上界（秒）
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 各阶段的说明（阶段名即转换结果中 metrics['timings'] 的键）
+METRIC_STAGES = {
+    'open': "打开MSG文件（OLE解析）",
+    'read': "读取消息属性和附件数据",
+    'build': "构建邮件对象（含编码检测和附件）",
+    'detect': "统计编码检测",
+    'attachments': "生成附件MIME部分",
+    'write': "序列化并写出EML文件",
+}
+
+# Prometheus指标名前缀
+METRIC_PREFIX = 'msg_to_eml'
+
+
+class ConversionMetrics:
+    """汇总一次批量转换的指标
+    
+    每个文件的阶段耗时随转换结果返回（进程池中的转换同样适用），在这里累加为
+    各阶段的耗时直方图，以及输入输出字节数、附件数和按异常类型统计的失败数。
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        # 阶段 -> [各桶计数..., 超出最大桶的计数]
+        self.buckets = {}
+        self.sums = Counter()
+        self.counts = Counter()
+        self.statuses = Counter()
+        self.failures = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.attachments = 0
+
+    def observe(self, result):
+        """记录一个文件的转换结果"""
+        self.statuses[result['status']] += 1
+        if result['status'] not in ('success', 'skipped'):
+            # 包括超时和内存超限（见 SupervisedWorkerPool）
+            self.failures[result.get('error_type', 'Exception')] += 1
+        
+        metrics = result.get('metrics')
+        if not metrics or 'duplicate_of' in result:
+            # 重复文件的结果沿用实际转换文件的指标，不重复计入
+            return
+        self.bytes_in += metrics['bytes_in']
+        self.bytes_out += metrics['bytes_out']
+        self.attachments += metrics['attachments']
+        for stage, seconds in metrics['timings'].items():
+            buckets = self.buckets.get(stage)
+            if buckets is None:
+                buckets = self.buckets[stage] = [0] * (len(METRIC_BUCKETS) + 1)
+            for index, bound in enumerate(METRIC_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self.sums[stage] += seconds
+            self.counts[stage] += 1
+
+    def finish(self):
+        self.finished = time.time()
+
+    def report(self):
+        """生成JSON运行报告"""
+        finished = self.finished or time.time()
+        elapsed = max(finished - self.started, 1e-9)
+        files = sum(self.statuses.values())
+        stages = {}
+        for stage, buckets in self.buckets.items():
+            count = self.counts[stage]
+            stages[stage] = {
+                'description': METRIC_STAGES.get(stage, stage),
+                'count': count,
+                'total_seconds': round(self.sums[stage], 6),
+                'mean_ms': round(self.sums[stage] / count * 1000, 3) if count else 0,
+                'buckets': {str(bound): value for bound, value in
+                            zip(METRIC_BUCKETS + ('+Inf',), itertools.accumulate(buckets))},
+            }
+        return {
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'elapsed_seconds': round(elapsed, 3),
+            'files': files,
+            'statuses': dict(self.statuses),
+            'failures_by_type': dict(self.failures),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'attachments': self.attachments,
+            'files_per_second': round(files / elapsed, 3),
+            'input_mb_per_second': round(self.bytes_in / 1024 / 1024 / elapsed, 3),
+            'stages': stages,
+        }
+
+    def write_json(self, path):
+        """保存JSON运行报告"""
+        _write_atomic(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+
+    def write_textfile(self, path):
+        """保存为node_exporter文本文件收集器格式（.prom）"""
+        _write_atomic(path, self.format_textfile())
+
+    def format_textfile(self):
+        """Prometheus文本格式的指标"""
+        name = METRIC_PREFIX
+        lines = [
+            f"# HELP {name}_stage_seconds Time spent per file in each conversion stage.",
+            f"# TYPE {name}_stage_seconds histogram",
+        ]
+        for stage, buckets in sorted(self.buckets.items()):
+            for bound, value in zip(METRIC_BUCKETS + ('+Inf',), itertools.accumulate(buckets)):
+                lines.append(f'{name}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {value}')
+            lines.append(f'{name}_stage_seconds_sum{{stage="{stage}"}} {self.sums[stage]:.6f}')
+            lines.append(f'{name}_stage_seconds_count{{stage="{stage}"}} {self.counts[stage]}')
+        
+        lines += [
+            f"# HELP {name}_files_total Files processed in the last run by status.",
+            f"# TYPE {name}_files_total counter",
+        ]
+        lines += [f'{name}_files_total{{status="{status}"}} {count}'
+                  for status, count in sorted(self.statuses.items())]
+        lines += [
+            f"# HELP {name}_failures_total Failed files in the last run by exception type.",
+            f"# TYPE {name}_failures_total counter",
+        ]
+        lines += [f'{name}_failures_total{{error_type="{error_type}"}} {count}'
+                  for error_type, count in sorted(self.failures.items())]
+        
+        report = self.report()
+        for metric, value, help_text, kind in (
+                ('input_bytes_total', self.bytes_in, "Bytes of MSG input read.", 'counter'),
+                ('output_bytes_total', self.bytes_out, "Bytes of EML output written.", 'counter'),
+                ('attachments_total', self.attachments, "Attachments converted.", 'counter'),
+                ('run_duration_seconds', report['elapsed_seconds'], "Duration of the last run.", 'gauge'),
+                ('files_per_second', report['files_per_second'], "Throughput of the last run.", 'gauge'),
+                ('last_run_timestamp_seconds', int(self.finished or time.time()),
+                 "Unix time the last run finished.", 'gauge')):
+            lines += [
+                f"# HELP {name}_{metric} {help_text}",
+                f"# TYPE {name}_{metric} {kind}",
+                f"{name}_{metric} {value}",
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def format_summary(self):
+        """各阶段平均耗时的一行摘要"""
+        parts = [f"{stage} {self.sums[stage] / self.counts[stage] * 1000:.1f}ms"
+                 for stage in METRIC_STAGES if self.counts[stage]]
+        return "阶段平均耗时: " + ", ".join(parts) if parts else ""
+
+
+def _write_atomic(path, text):
+    """先写临时文件再替换，读取方（如node_exporter）不会看到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def iter_conversions(msg_paths, output_dir, options, executor=None, on_start=None, max_pending=64,
+                     manifest=None, deduplicate=False, stages=None, sink=None, index=None, journal=None):
+    """批量转换文件，按完成顺序逐个返回 (msg_path, result)
+    
+    executor为None时在当前进程中通过读取 → 构建 → 写出的分阶段流水线转换，
+    stages指定各阶段的线程数和队列容量（见 PipelineStages）；否则提交到进程池
+    并行转换，同时在途的任务数不超过max_pending，避免一次性提交数十万个任务。
+    指定manifest时跳过清单中未变化的文件（结果状态为'skipped'），
+    并把成功转换的文件记入清单。
+    deduplicate为True时内容相同的输入只转换一次，其余文件的输出通过硬链接、
+    reflink或复制得到，结果中的'duplicate_of'为实际转换的文件；每个文件到达时
+    即与之前的文件比较（见 DuplicateDetector），不需要先读取全部输入。
+    指定sink（见 ArchiveSink）时所有邮件追加到该归档中，不再逐个创建文件，
+    重复文件直接指向同一封邮件；指定index（见 OutputIndex）时记录每个成功
+    转换的文件的输出位置。
+    指定journal（见 ConversionJournal）时记录每个成功转换的文件，续转时跳过
+    日志中已完成的文件（结果状态为'skipped'，'resumed'为True）。
+    msg_paths可以是不结束的生成器（如 FolderWatcher.paths()），其中的None表示
+    暂时没有新文件：此时不阻塞等待在途任务，先返回已完成的结果再继续读取。
+    """
+    if journal is not None:
+        # 写入日志记录之前先把归档中的内容写入磁盘
+        journal.sink = sink
+    for msg_path, result in _iter_conversions(msg_paths, output_dir, options, executor, on_start,
+                                              max_pending, manifest, deduplicate, stages, sink, journal):
+        if index is not None and result['status'] == 'success':
+            index.add(msg_path, result)
+        yield msg_path, result
+
+
+def _iter_conversions(msg_paths, output_dir, options, executor, on_start, max_pending, manifest,
+                      deduplicate, stages, sink, journal):
+    """iter_conversions 的去重部分"""
+    allocator = OutputNameAllocator()
+    if not deduplicate:
+        for item in _iter_unique_conversions(msg_paths, output_dir, options, executor, on_start,
+                                             max_pending, manifest, allocator, stages, sink, journal):
+            if item is not _IDLE:
+                yield item
+        return
+    
+    detector = DuplicateDetector()
+    options_hash = options_fingerprint(options) if manifest is not None else None
+    archive = sink.path if sink is not None else None
+    # 首个文件 -> 等待其转换结果的相同文件
+    waiting = {}
+    # 已有转换结果的首个文件 -> 结果（不含指标等与输出位置无关的内容）
+    finished = {}
+    # 首个文件已有结果、可以立即处理的 (相同文件, 首个文件)
+    ready = deque()
+    
+    def unique_paths():
+        # 边读取边判断：首次出现的内容立即提交转换，相同的文件留待首个文件的结果
+        for msg_path in msg_paths:
+            if msg_path is not None:
+                original = detector.original_of(msg_path)
+                if original is not None:
+                    if original in finished:
+                        ready.append((msg_path, original))
+                    else:
+                        waiting.setdefault(original, []).append(msg_path)
+                    continue
+            yield msg_path
+    
+    def duplicate_result(duplicate_path, msg_path, result):
+        if journal is not None:
+            entry = journal.lookup(duplicate_path)
+            if entry is not None:
+                return journal_skip_result(entry)
+        
+        fingerprint = None
+        if manifest is not None:
+            output_file, fingerprint = manifest.lookup(duplicate_path, output_dir, options_hash, archive)
+            if output_file:
+                return {
+                    'status': 'skipped',
+                    'output_file': output_file
+                }
+        
+        if result['status'] not in ('success', 'skipped'):
+            # 内容相同，转换结果也相同
+            return dict(result, duplicate_of=msg_path)
+        
+        location = {}
+        if sink is not None:
+            # 归档中不重复保存，指向同一封邮件
+            eml_path = result['output_file']
+            location = {key: result[key] for key in ARCHIVE_LOCATION_KEYS if key in result}
+        else:
+            try:
+                os.makedirs(output_dir or os.path.dirname(duplicate_path), exist_ok=True)
+                while True:
+                    eml_path = allocator.allocate(duplicate_path, output_dir)
+                    try:
+                        link_or_copy(result['output_file'], eml_path)
+                        break
+                    except FileExistsError:
+                        # 被其他程序占用，换下一个文件名
+                        continue
+            except OSError as e:
+                return {
+                    'status': 'failed',
+                    'error': str(e),
+                    'duplicate_of': msg_path
+                }
+        
+        if manifest is not None:
+            manifest.record(duplicate_path, fingerprint, options_hash, eml_path)
+        if journal is not None:
+            journal.record(duplicate_path, dict(location, output_file=eml_path))
+        if 'headers' in result:
+            location['headers'] = result['headers']
+        return dict(location, status='success', output_file=eml_path, options=options._asdict(),
+                    duplicate_of=msg_path)
+    
+    for item in _iter_unique_conversions(unique_paths(), output_dir, options, executor, on_start,
+                                         max_pending, manifest, allocator, stages, sink, journal):
+        if item is not _IDLE:
+            msg_path, result = item
+            finished[msg_path] = {key: value for key, value in result.items()
+                                  if key not in ('metrics', 'options')}
+            yield msg_path, result
+            ready.extend((duplicate_path, msg_path) for duplicate_path in waiting.pop(msg_path, ()))
+        
+        # 首个文件早已完成的相同文件在下一个结果返回或输入空闲时处理
+        while ready:
+            duplicate_path, original = ready.popleft()
+            yield duplicate_path, duplicate_result(duplicate_path, original, finished[original])
+    
+    while ready:
+        duplicate_path, original = ready.popleft()
+        yield duplicate_path, duplicate_result(duplicate_path, original, finished[original])
+
+
+# 输入路径迭代结束的标记（None表示暂时没有新文件，见 iter_conversions）
+_END_OF_INPUT = object()
+
+# 输入暂时没有新文件、已完成的结果也已返回时 _iter_unique_conversions 给出的标记
+_IDLE = (None, None)
+
+# 进程池损坏（有工作进程意外退出）时在途的文件重新提交的次数，超过后记为失败
+WORKER_CRASH_RETRIES = 2
+
+
+def journal_skip_result(entry):
+    """续转时跳过的文件的结果（输出位置取自断点续转日志）"""
+    result = {key: entry[key] for key in ARCHIVE_LOCATION_KEYS if key in entry}
+    result.update(status='skipped', output_file=entry['output'], resumed=True)
+    return result
+
+
+def _iter_unique_conversions(msg_paths, output_dir, options, executor, on_start, max_pending, manifest,
+                             allocator, stages=None, sink=None, journal=None):
+    """iter_conversions 的实际转换部分（不做去重）"""
+    from concurrent.futures.process import BrokenProcessPool
+    options_hash = options_fingerprint(options) if manifest is not None else None
+    archive = sink.path if sink is not None else None
+    pipeline = None
+    if executor is None:
+        pipeline = ConversionPipeline(MSGConversionEngine(options), stages, sink)
+        max_pending = pipeline.capacity
+    pending = {}
+    # 因进程池损坏而重新提交过的任务及其次数
+    crashes = {}
+    paths = iter(msg_paths)
+    exhausted = False
+    
+    def submit(msg_path, reserved):
+        return executor.submit(_convert_in_worker, msg_path, output_dir, options, reserved,
+                               sink is not None, reserved is not None)
+    
+    def reserve(msg_path, output_path, staging):
+        """创建工作进程要写的文件，返回 (正式文件名, 创建的文件)
+        
+        工作进程被杀掉时来不及清理，主进程只删除自己创建的这个文件，不会误删
+        同名的其他文件；正式文件名已被其他程序占用时换下一个。
+        """
+        directory = os.path.dirname(staging or output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if staging is not None:
+            # 上次中断留下的临时文件已由 journal.recover 处理，这里只会是本次的残留
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(staging)
+            open(staging, 'xb').close()
+            return output_path, staging
+        while True:
+            try:
+                open(output_path, 'xb').close()
+                return output_path, output_path
+            except FileExistsError:
+                output_path = allocator.allocate(msg_path, output_dir)
+    
+    def finish(msg_path, fingerprint, output_path, staging, reserved, result):
+        """记录转换结果，释放未使用的预分配文件名"""
+        if reserved is not None and result.get('output_file') != reserved:
+            # 转换失败或工作进程被杀掉，删除主进程预先创建的文件（可能写了一半）
+            with contextlib.suppress(OSError):
+                os.remove(reserved)
+        if staging is not None and result['status'] == 'success' and result['output_file'] == staging:
+            # 临时文件已写完，放到正式文件名
+            try:
+                while True:
+                    try:
+                        linked = journal.place(staging, output_path)
+                        break
+                    except FileExistsError:
+                        output_path = allocator.allocate(msg_path, output_dir)
+                result['output_file'] = output_path
+            except OSError as e:
+                linked = False
+                with contextlib.suppress(OSError):
+                    os.remove(staging)
+                result = {
+                    'status': 'failed',
+                    'error': str(e),
+                    'error_type': type(e).__name__,
+                    'metrics': result.get('metrics')
+                }
+            if not linked:
+                journal.release_staging(staging)
+                staging = None
+        elif staging is not None:
+            # 转换失败（引擎已删除临时文件），或临时文件被占用时引擎直接写到了正式文件名
+            journal.release_staging(staging)
+            staging = None
+        if output_path is not None and result.get('output_file') != output_path:
+            allocator.release(output_path)
+        if 'data' in result:
+            # 工作进程返回的EML内容由主进程追加到归档
+            data = result.pop('data')
+            try:
+                result.update(sink.add(msg_path, data))
+            except Exception as e:
+                result = {
+                    'status': 'failed',
+                    'error': str(e),
+                    'error_type': type(e).__name__,
+                    'metrics': result.get('metrics')
+                }
+        if manifest is not None and result['status'] == 'success':
+            manifest.record(msg_path, fingerprint, options_hash, result['output_file'])
+        if journal is not None and result['status'] == 'success':
+            journal.record(msg_path, result, staging)
+        return msg_path, result
+    
+    try:
+        while True:
+            # 补充任务直到达到在途上限
+            idle = False
+            while not exhausted and len(pending) < max_pending:
+                msg_path = next(paths, _END_OF_INPUT)
+                if msg_path is _END_OF_INPUT:
+                    exhausted = True
+                    break
+                if msg_path is None:
+                    # 输入暂时没有新文件，输入源已经等待过，只收取已完成的结果
+                    idle = True
+                    break
+                
+                if journal is not None:
+                    entry = journal.lookup(msg_path)
+                    if entry is None and sink is None and journal.recover(msg_path, output_dir):
+                        entry = journal.lookup(msg_path)
+                    if entry is not None:
+                        if manifest is not None:
+                            # 清单可能在中断时没有保存，补记续转跳过的文件
+                            output_file, fingerprint = manifest.lookup(msg_path, output_dir, options_hash,
+                                                                       archive)
+                            if not output_file:
+                                manifest.record(msg_path, fingerprint, options_hash, entry['output'])
+                        yield msg_path, journal_skip_result(entry)
+                        continue
+                
+                fingerprint = None
+                if manifest is not None:
+                    output_file, fingerprint = manifest.lookup(msg_path, output_dir, options_hash, archive)
+                    if output_file:
+                        yield msg_path, {
+                            'status': 'skipped',
+                            'output_file': output_file
+                        }
+                        continue
+                
+                if on_start:
+                    on_start(msg_path)
+                output_path = allocator.allocate(msg_path, output_dir) if sink is None else None
+                staging = None
+                if journal is not None and sink is None:
+                    # 使用断点续转日志时先写到临时文件，写完后再放到正式文件名
+                    staging = journal.claim_staging(msg_path, output_dir)
+                reserved = None
+                if pipeline is not None:
+                    key = object()
+                    pipeline.submit(key, msg_path, output_dir, staging or output_path)
+                else:
+                    if sink is None:
+                        try:
+                            output_path, reserved = reserve(msg_path, output_path, staging)
+                        except OSError as e:
+                            yield finish(msg_path, fingerprint, output_path, staging, None, {
+                                'status': 'failed',
+                                'error': str(e),
+                                'error_type': type(e).__name__
+                            })
+                            continue
+                    try:
+                        key = submit(msg_path, reserved)
+                    except BrokenProcessPool as e:
+                        # 进程池无法换新（ProcessWorkerPool 提交时会自动换新）时只有这个文件失败
+                        yield finish(msg_path, fingerprint, output_path, staging, reserved, {
+                            'status': 'failed',
+                            'error': str(e),
+                            'error_type': type(e).__name__
+                        })
+                        continue
+                pending[key] = (msg_path, fingerprint, output_path, staging, reserved)
+            
+            if not pending:
+                if exhausted:
+                    return
+                if idle:
+                    yield _IDLE
+                continue
+            
+            timeout = 0 if idle else None
+            if pipeline is not None:
+                for key, result in pipeline.get_results(timeout):
+                    yield finish(*pending.pop(key), result)
+                if idle:
+                    yield _IDLE
+                continue
+            
+            from concurrent.futures import wait, FIRST_COMPLETED
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                retries = crashes.pop(future, 0)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # 一个工作进程意外退出时所有在途任务都以 BrokenProcessPool 结束，
+                    # 其中多数并没有出错：重新提交（ProcessWorkerPool 会换新的进程池），
+                    # 反复导致崩溃的文件在超过重试次数后记为失败
+                    if retries < WORKER_CRASH_RETRIES:
+                        msg_path, _fingerprint, _output_path, _staging, reserved = job
+                        try:
+                            retry = submit(msg_path, reserved)
+                        except BrokenProcessPool:
+                            pass
+                        else:
+                            pending[retry] = job
+                            crashes[retry] = retries + 1
+                            continue
+                    result = {
+                        'status': 'failed',
+                        'error': str(e),
+                        'error_type': type(e).__name__
+                    }
+                except Exception as e:
+                    # 工作进程异常退出、转换超时或内存超限（见 SupervisedWorkerPool）
+                    result = {
+                        'status': getattr(e, 'status', 'failed'),
+                        'error': str(e),
+                        'error_type': type(e).__name__
+                    }
+                yield finish(*job, result)
+            if idle:
+                yield _IDLE
+    finally:
+        if pipeline is not None:
+            # 调用方提前停止迭代时丢弃尚未完成的文件
+            pipeline.close(cancel=bool(pending))
+
+
+# 转换服务：单个上传文件的大小上限（MB）
+SERVICE_MAX_UPLOAD_MB = 256
+
+# 转换服务：空闲的持久连接保持多久（秒）
+SERVICE_KEEPALIVE_SECONDS = 15
+
+# 转换服务：接收上传和发送EML时每次读写的字节数
+SERVICE_CHUNK_SIZE = 256 * 1024
+
+
+class ServiceError(Exception):
+    """转换服务返回给客户端的HTTP错误"""
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class ConversionService:
+    """本地HTTP转换服务（只使用标准库asyncio）
+    
+    POST /convert 的请求体为MSG文件内容，响应体为转换后的EML
+    （message/rfc822）；可用查询参数 name 指定原文件名，用于响应中的文件名。
+    上传内容先写入临时文件，由常驻进程池转换为临时EML文件，再分块发回，
+    服务进程中不保存整封邮件。
+    
+    同时转换的文件数等于工作进程数，另外最多max_queue个请求排队等待，
+    超过时立即返回429。GET /health 返回当前负载（JSON），GET /metrics 返回
+    Prometheus格式的累计指标。连接默认保持（HTTP/1.1 keep-alive）。
+    """
+
+    def __init__(self, options, workers, max_queue=None, max_upload_mb=SERVICE_MAX_UPLOAD_MB, limits=None):
+        self.options = options
+        self.limits = limits
+        self.workers = max(1, workers)
+        self.max_queue = max_queue if max_queue is not None else self.workers * 2
+        self.max_upload = max_upload_mb * 1024 * 1024
+        self.metrics = ConversionMetrics()
+        self.executor = None
+        # 已接受、尚未完成的转换请求（正在转换的加上排队的）
+        self.active = 0
+        self._temp_dir = None
+        self._counter = itertools.count()
+
+    async def serve(self, host, port, on_ready=None):
+        """启动进程池并在 host:port 上提供服务，直到任务被取消"""
+        import asyncio
+        import tempfile
+        self._temp_dir = tempfile.mkdtemp(prefix='msg-to-eml-service-')
+        self.executor = create_worker_pool(self.workers, ignore_interrupts=True, limits=self.limits)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, warm_worker_pool, self.executor, self.workers, self.options)
+        
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        # 作为服务运行时被停止（SIGTERM）与Ctrl+C一样结束（只能在主线程中设置）
+        import signal
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        async with server:
+            if on_ready is not None:
+                on_ready(server.sockets[0].getsockname())
+            await server.serve_forever()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+    async def _handle_connection(self, reader, writer):
+        """处理一个连接上的请求，直到客户端关闭、空闲超时或不能继续复用"""
+        import asyncio
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request_head(reader),
+                                                     SERVICE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                except ServiceError as e:
+                    await self._send_error(writer, e, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                
+                method, target, version, headers = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                try:
+                    keep_alive = await self._dispatch(method, target, headers, reader, writer, keep_alive)
+                except ServiceError as e:
+                    # 请求体可能没有读完，不能继续复用连接
+                    await self._send_error(writer, e, keep_alive=False)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    # 其他错误（如临时文件写入失败）也要给客户端一个响应
+                    await self._send_error(writer, ServiceError(500, f"服务内部错误: {e}"), keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # 服务停止时取消空闲连接；正常结束，避免asyncio把取消当作未处理的异常报告
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def _read_request_head(self, reader):
+        """读取请求行和请求头，连接已关闭时返回None"""
+        import asyncio
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise ServiceError(431, "请求头过长")
+        
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise ServiceError(400, "无效的请求行")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def _dispatch(self, method, target, headers, reader, writer, keep_alive):
+        """按路径处理请求，返回是否可以继续复用连接"""
+        from urllib.parse import urlsplit, parse_qs
+        url = urlsplit(target)
+        has_body = 'transfer-encoding' in headers or (self._content_length(headers) or 0) > 0
+        
+        if url.path == '/convert':
+            if method != 'POST':
+                raise ServiceError(405, "请使用POST上传MSG文件", [('Allow', 'POST')])
+            name = parse_qs(url.query).get('name', ['message.msg'])[0]
+            return await self._convert(name, headers, reader, writer, keep_alive)
+        
+        if has_body:
+            # 其他接口不接收请求体，不读取，直接关闭连接
+            keep_alive = False
+        if url.path == '/health' and method == 'GET':
+            body = json.dumps({
+                'workers': self.workers,
+                'active': self.active,
+                'queued': max(0, self.active - self.workers),
+                'max_queue': self.max_queue,
+            }).encode('utf-8')
+            await self._send(writer, 200, [('Content-Type', 'application/json')], body, keep_alive)
+        elif url.path == '/metrics' and method == 'GET':
+            body = self.metrics.format_textfile().encode('utf-8')
+            await self._send(writer, 200, [('Content-Type', 'text/plain; version=0.0.4')], body, keep_alive)
+        else:
+            raise ServiceError(404, f"未知的路径: {url.path}")
+        return keep_alive
+
+    async def _convert(self, name, headers, reader, writer, keep_alive):
+        """接收上传的MSG文件，在进程池中转换，把EML分块发回"""
+        import asyncio
+        from concurrent.futures.process import BrokenProcessPool
+        
+        if self.active >= self.workers + self.max_queue:
+            raise ServiceError(429, "转换队列已满，请稍后重试", [('Retry-After', '1')])
+        
+        self.active += 1
+        number = next(self._counter)
+        msg_path = os.path.join(self._temp_dir, f"{number}.msg")
+        eml_path = os.path.join(self._temp_dir, f"{number}.eml")
+        try:
+            await self._receive_body(headers, reader, msg_path)
+            try:
+                future = self.executor.submit(_convert_in_worker, msg_path, self._temp_dir, self.options, eml_path)
+                result = await asyncio.wrap_future(future)
+            except WorkerTerminated as e:
+                # 超时或内存超限，工作进程已换新
+                result = {'status': e.status, 'error': str(e), 'error_type': type(e).__name__}
+            except BrokenProcessPool as e:
+                # 工作进程异常退出，下一次提交时进程池自动换新（见 ProcessWorkerPool）
+                result = {'status': 'failed', 'error': str(e), 'error_type': type(e).__name__}
+            except Exception as e:
+                # 引擎自身会捕获转换中的异常，这里是任务无法提交或结果无法传回等服务端错误
+                self.metrics.observe({'status': 'failed', 'error': str(e), 'error_type': type(e).__name__})
+                raise ServiceError(500, f"转换服务出错: {e}")
+            self.metrics.observe(result)
+            
+            if result['status'] != 'success':
+                error = {'status': result['status'], 'error': result['error'],
+                         'error_type': result.get('error_type')}
+                await self._send(writer, 422, [('Content-Type', 'application/json')],
+                                 json.dumps(error, ensure_ascii=False).encode('utf-8'), keep_alive)
+                return keep_alive
+            
+            await self._send_file(writer, result['output_file'], output_stem(name) + '.eml', keep_alive)
+            return keep_alive
+        finally:
+            self.active -= 1
+            for path in (msg_path, eml_path):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    @staticmethod
+    def _content_length(headers):
+        """请求头中的Content-Length，没有时返回None，格式不对时返回400"""
+        value = headers.get('content-length')
+        if value is None:
+            return None
+        value = value.strip()
+        if not (value.isascii() and value.isdigit()):
+            raise ServiceError(400, "无效的Content-Length")
+        return int(value)
+
+    async def _receive_body(self, headers, reader, path):
+        """把请求体写入临时文件，支持Content-Length和分块传输编码
+        
+        磁盘写入在线程池中进行，磁盘慢时不阻塞其他连接。
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, path, 'wb')
+        try:
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                received = 0
+                while True:
+                    size_line = await reader.readuntil(b'\r\n')
+                    try:
+                        size = int(size_line.split(b';', 1)[0], 16)
+                    except ValueError:
+                        raise ServiceError(400, "无效的分块长度")
+                    if size == 0:
+                        # 忽略分块结尾的附加头
+                        while await reader.readuntil(b'\r\n') != b'\r\n':
+                            pass
+                        return
+                    received += size
+                    if received > self.max_upload:
+                        raise ServiceError(413, "上传的文件过大")
+                    await self._copy_body(reader, f, size)
+                    await reader.readexactly(2)
+            
+            length = self._content_length(headers)
+            if length is None:
+                raise ServiceError(411, "需要Content-Length")
+            if length > self.max_upload:
+                raise ServiceError(413, "上传的文件过大")
+            await self._copy_body(reader, f, length)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    @staticmethod
+    async def _copy_body(reader, f, size):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while size > 0:
+            chunk = await reader.readexactly(min(size, SERVICE_CHUNK_SIZE))
+            await loop.run_in_executor(None, f.write, chunk)
+            size -= len(chunk)
+
+    @staticmethod
+    def _write_head(writer, status, headers, keep_alive):
+        from http import HTTPStatus
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    async def _send(self, writer, status, headers, body, keep_alive):
+        self._write_head(writer, status, headers + [('Content-Length', len(body))], keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_error(self, writer, error, keep_alive):
+        body = json.dumps({'error': str(error)}, ensure_ascii=False).encode('utf-8')
+        with contextlib.suppress(ConnectionError):
+            await self._send(writer, error.status, [('Content-Type', 'application/json')] + error.headers,
+                             body, keep_alive)
+
+    async def _send_file(self, writer, path, filename, keep_alive):
+        """分块发送EML文件，磁盘读取在线程池中进行"""
+        import asyncio
+        from urllib.parse import quote
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, path, 'rb')
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self._write_head(writer, 200, [
+                ('Content-Type', 'message/rfc822'),
+                ('Content-Length', size),
+                ('Content-Disposition', f"attachment; filename*=UTF-8''{quote(filename)}"),
+            ], keep_alive)
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, SERVICE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                # 客户端接收慢时在此等待，不在内存中堆积
+                await writer.drain()
+
+
+class VirtualFileList:
+    """只创建可见行的文件列表
+    
+    全部文件的数据保存在内存中，Treeview里只放当前可见的几十行，滚动时
+    重新填充这些行。提供界面用到的 Treeview 接口子集（insert、set、delete、
+    get_children、selection、identify等），行的iid与文件的键相同。
+    """
+
+    def __init__(self, parent, columns, **tree_options):
+        self.tree = ttk.Treeview(parent, columns=columns, **tree_options)
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.yview)
+        self.columns = columns
+        self.keys = []        # 所有行的键，按显示顺序
+        self.rows = {}        # 键 -> {'text': ..., 列名: 值}
+        self.first = 0        # 第一条可见行的位置
+        self.visible_rows = int(tree_options.get('height', 15))
+        self._next_id = 0
+        self._render_pending = False
+        
+        self.tree.bind('<Configure>', self._on_configure)
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(3))
+
+    # 透传给Treeview的接口
+    def grid(self, **kwargs):
+        self.tree.grid(**kwargs)
+
+    def heading(self, *args, **kwargs):
+        return self.tree.heading(*args, **kwargs)
+
+    def column(self, *args, **kwargs):
+        return self.tree.column(*args, **kwargs)
+
+    def bind(self, *args, **kwargs):
+        return self.tree.bind(*args, **kwargs)
+
+    def identify(self, *args):
+        return self.tree.identify(*args)
+
+    def selection(self):
+        return self.tree.selection()
+
+    def selection_set(self, *items):
+        self.tree.selection_set(*items)
+
+    # 数据操作
+    def insert(self, parent, index, text='', values=()):
+        """在末尾追加一行，返回行的键"""
+        self._next_id += 1
+        key = f"row{self._next_id}"
+        row = {'text': text}
+        row.update(zip(self.columns, values))
+        self.rows[key] = row
+        self.keys.append(key)
+        # 新行在可见范围内时才需要重新填充
+        if len(self.keys) - 1 < self.first + self.visible_rows + 1:
+            self._schedule_render()
+        else:
+            self._update_scrollbar()
+        return key
+
+    def set(self, key, column, value):
+        row = self.rows.get(key)
+        if row is None:
+            return
+        row[column] = value
+        if self.tree.exists(key):
+            self.tree.set(key, column, value)
+
+    def delete(self, *keys):
+        removed = set(keys)
+        for key in removed:
+            self.rows.pop(key, None)
+        if len(removed) == len(self.keys):
+            self.keys = []
+        else:
+            self.keys = [key for key in self.keys if key not in removed]
+        self._schedule_render()
+
+    def get_children(self, item=''):
+        return tuple(self.keys)
+
+    # 滚动和显示
+    def yview(self, *args):
+        """滚动条回调"""
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.keys))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages':
+                step *= max(1, self.visible_rows - 1)
+            self.first += step
+        self._render()
+
+    def scroll(self, units):
+        self.yview('scroll', units, 'units')
+
+    def _on_mousewheel(self, event):
+        if event.delta:
+            self.scroll(-3 if event.delta > 0 else 3)
+        return 'break'
+
+    def _on_configure(self, event):
+        row_height = 20
+        try:
+            row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or row_height)
+        except (tk.TclError, ValueError):
+            pass
+        rows = max(1, (event.height - row_height) // row_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self._schedule_render()
+
+    def _schedule_render(self):
+        if not self._render_pending:
+            self._render_pending = True
+            self.tree.after_idle(self._render)
+
+    def _render(self):
+        """用当前窗口内的数据重新填充可见行"""
+        self._render_pending = False
+        total = len(self.keys)
+        self.first = max(0, min(self.first, total - self.visible_rows))
+        window = self.keys[self.first:self.first + self.visible_rows + 1]
+        
+        selected = set(self.tree.selection())
+        self.tree.delete(*self.tree.get_children())
+        for key in window:
+            row = self.rows[key]
+            self.tree.insert('', 'end', iid=key, text=row['text'],
+                             values=[row.get(column, '') for column in self.columns])
+        keep = [key for key in window if key in selected]
+        if keep:
+            self.tree.selection_set(*keep)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = len(self.keys)
+        if total <= self.visible_rows:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.first / total, min(1, (self.first + self.visible_rows) / total))
+
+
+class EnhancedMSGToEMLConverter:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("MSG转EML转换器")
+        # 设置窗口大小并居中
+        window_width = 1100
+        window_height = 800
+        screen_width = self.root.winfo_screenwidth()
+        screen_height = self.root.winfo_screenheight()
+        x = (screen_width // 2) - (window_width // 2)
+        y = (screen_height // 2) - (window_height // 2)
+        self.root.geometry(f"{window_width}x{window_height}+{x}+{y}")
+        self.root.update_idletasks()
+        self.root.resizable(True, True)
+        
+        # 设置应用图标（如果有）
+        try:
+            self.root.iconbitmap('converter.ico')
+        except:
+            pass
+        
+        # 存储选择的文件和转换结果
+        self.file_items = {}  # 存储文件信息和tree item id的映射
+        self.path_index = {}  # 源文件路径到tree item id的映射，用于O(1)查重
+        self.conversion_results = {}
+        self.output_dir = None
+        
+        # 转换选项
+        self.include_attachments = tk.BooleanVar(value=True)
+        self.preserve_headers = tk.BooleanVar(value=True)
+        self.auto_decode = tk.BooleanVar(value=True)
+        self.detect_encoding = tk.BooleanVar(value=True)
+        self.preserve_transport_headers = tk.BooleanVar(value=True)
+        self.show_ip_info = tk.BooleanVar(value=True)
+        
+        # 并行转换进程数（1表示在后台线程中逐个转换）
+        self.worker_count = tk.IntVar(value=os.cpu_count() or 1)
+        self.worker_pool = None
+        self.worker_pool_key = None
+        
+        # 单个文件的转换时长上限（秒），超过时终止该文件，不阻塞后面的文件
+        self.file_timeout = tk.IntVar(value=GUI_FILE_TIMEOUT)
+        
+        # 增量转换：跳过清单中未变化的文件
+        self.incremental = tk.BooleanVar(value=False)
+        
+        # 内容相同的文件只转换一次
+        self.deduplicate = tk.BooleanVar(value=False)
+        
+        # 输出格式（见 GUI_OUTPUT_FORMATS）
+        self.output_format = tk.StringVar(value=next(iter(GUI_OUTPUT_FORMATS)))
+        
+        # 目录扫描状态：扫描在后台线程进行，转换可以在扫描结束前开始
+        self.discovery_running = False
+        self.discovery_cancel = threading.Event()
+        self.conversion_feed = None
+        
+        # 工作线程发来的界面更新事件，由界面线程定时批量处理
+        self.ui_events = queue.SimpleQueue()
+        
+        self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(UI_UPDATE_INTERVAL_MS, self.drain_ui_events)
+        
+        # 检查依赖
+        if not EXTRACT_MSG_AVAILABLE:
+            messagebox.showwarning(
+                "需要安装依赖库",
+                "请先安装 extract-msg 和 chardet 库：\n\n"
+                "打开命令行运行：\n"
+                "pip install extract-msg chardet\n\n"
+                "安装完成后重新运行程序。"
+            )
+    
+    def create_tooltip(self, widget, text):
+        """为控件创建工具提示"""
+        def on_enter(event):
+            tooltip = tk.Toplevel()
+            tooltip.wm_overrideredirect(True)
+            tooltip.wm_geometry(f"+{event.x_root+10}+{event.y_root+10}")
+            
+            label = ttk.Label(tooltip, text=text, 
+                            background="#FFFFDD", 
+                            relief=tk.SOLID, 
+                            borderwidth=1,
+                            font=("Arial", 9))
+            label.pack()
+            
+            widget.tooltip = tooltip
+        
+        def on_leave(event):
+            if hasattr(widget, 'tooltip'):
+                widget.tooltip.destroy()
+                del widget.tooltip
+        
+        widget.bind('<Enter>', on_enter)
+        widget.bind('<Leave>', on_leave)
+    
+    def setup_ui(self):
+        # 主框架
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # 配置网格权重
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.rowconfigure(2, weight=1)
+        
+        # 标题
+        title_label = ttk.Label(main_frame, text="MSG转EML转换器", 
+                               font=("Arial", 16, "bold"))
+        title_label.grid(row=0, column=0, pady=(0, 20))
+        
+        # 顶部控制区域
         control_frame = ttk.Frame(main_frame)
         control_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
         control_frame.columnconfigure(1, weight=1)
@@ -134,6 +4521,11 @@ class EnhancedMSGToEMLConverter:
                                     command=self.select_files)
         self.select_btn.pack(side=tk.LEFT, padx=(0, 5))
         
+        # 添加文件夹按钮（递归查找MSG文件）
+        self.select_folder_btn = ttk.Button(button_frame, text="添加文件夹", 
+                                           command=self.select_folder)
+        self.select_folder_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
         # 清空列表按钮
         self.clear_btn = ttk.Button(button_frame, text="清空列表", 
                                    command=self.clear_files, state=tk.DISABLED)
@@ -165,6 +4557,17 @@ class EnhancedMSGToEMLConverter:
                                            command=self.select_output_dir)
         self.select_output_btn.pack(side=tk.LEFT)
         
+        # 输出格式：逐个EML文件，或追加到单个归档
+        ttk.Label(output_frame, text="格式:").pack(side=tk.LEFT, padx=(10, 5))
+        self.output_format_cb = ttk.Combobox(output_frame, textvariable=self.output_format,
+                                             values=list(GUI_OUTPUT_FORMATS), state='readonly', width=8)
+        self.output_format_cb.pack(side=tk.LEFT)
+        self.create_tooltip(self.output_format_cb,
+                          "转换结果的保存方式：\n"
+                          "• EML文件：每封邮件一个文件\n"
+                          f"• mbox/ZIP/tar：追加到输出目录（未指定时为用户目录）的 {ARCHIVE_BASENAME}.*\n"
+                          "  同时生成 .index.jsonl 索引，记录每个MSG文件在归档中的位置")
+        
         # 转换选项区域（重新排列）
         options_frame = ttk.LabelFrame(control_frame, text="转换选项", padding="10")
         options_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -251,890 +4654,642 @@ class EnhancedMSGToEMLConverter:
             text="自动解码编码内容",
             variable=self.auto_decode
         )
-        self.auto_decode_cb.pack(side=tk.LEFT)
-        self.create_tooltip(self.auto_decode_cb,
-                          "自动解码邮件中的编码内容：\n"
-                          "• Base64编码（如：5Lit6K+t → 中文）\n"
-                          "• Quoted-Printable编码\n"
-                          "• RFC 2047编码的邮件头")
-        
-        # 文件列表区域（使用Treeview）
-        list_frame = ttk.LabelFrame(main_frame, text="文件列表", padding="10")
-        list_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
-        list_frame.columnconfigure(0, weight=1)
-        list_frame.rowconfigure(0, weight=1)
-        
-        # 创建Treeview
-        columns = ('status', 'result')
-        self.file_tree = ttk.Treeview(list_frame, columns=columns, show='tree headings', height=15)
-        self.file_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        
-        # 设置列标题和宽度
-        self.file_tree.heading('#0', text='文件名称')
-        self.file_tree.heading('status', text='转换情况')
-        self.file_tree.heading('result', text='转换结果')
-        
-        self.file_tree.column('#0', width=400)
-        self.file_tree.column('status', width=100, anchor='center')
-        self.file_tree.column('result', width=400)
-        
-        # 添加滚动条
-        tree_scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.file_tree.yview)
-        tree_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        self.file_tree.configure(yscrollcommand=tree_scrollbar.set)
-        
-        # 绑定右键菜单
-        self.file_tree.bind('<Button-3>', self.show_context_menu)
-        
-        # 创建右键菜单
-        self.context_menu = tk.Menu(self.root, tearoff=0)
-        self.context_menu.add_command(label="打开文件", command=self.open_file)
-        self.context_menu.add_command(label="打开文件所在文件夹", command=self.open_file_location)
-        
-        # 进度条
-        self.progress = ttk.Progressbar(main_frame, mode='determinate')
-        self.progress.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
-        
-        # 底部操作按钮
-        bottom_frame = ttk.Frame(main_frame)
-        bottom_frame.grid(row=4, column=0, pady=(0, 10))
-        
-        # 查看邮件头按钮
-        self.view_headers_btn = ttk.Button(bottom_frame, text="查看邮件头详情", 
-                                          command=self.view_email_headers)
-        self.view_headers_btn.pack(side=tk.LEFT, padx=(0, 5))
-        
-        # 查看MSG属性按钮
-        self.view_msg_attrs_btn = ttk.Button(bottom_frame, text="调试：查看MSG属性", 
-                                           command=self.view_msg_attributes)
-        self.view_msg_attrs_btn.pack(side=tk.LEFT, padx=(0, 5))
-        
-        # 测试选项按钮
-        self.test_options_btn = ttk.Button(bottom_frame, text="测试：比较选项效果", 
-                                          command=self.test_option_effects)
-        self.test_options_btn.pack(side=tk.LEFT, padx=(0, 5))
-        
-        # 状态栏
-        status_frame = ttk.Frame(main_frame)
-        status_frame.grid(row=5, column=0, sticky=(tk.W, tk.E))
-        status_frame.columnconfigure(0, weight=1)
-        
-        self.status_label = ttk.Label(status_frame, text="准备就绪", relief=tk.SUNKEN)
-        self.status_label.grid(row=0, column=0, sticky=(tk.W, tk.E))
-        
-        # 文件计数标签
-        self.file_count_label = ttk.Label(status_frame, text="未选择文件", font=("Arial", 9))
-        self.file_count_label.grid(row=0, column=1, padx=(10, 0))
-        
-        # 绑定选项变化事件，用于调试
-        for var in [self.preserve_headers, self.preserve_transport_headers, self.show_ip_info]:
-            var.trace('w', self.on_option_changed)
-    
-    def on_option_changed(self, *args):
-        """选项变化时的回调（用于调试）"""
-        print(f"选项状态 - 保留MSG属性: {self.preserve_headers.get()}, "
-              f"保留传输头: {self.preserve_transport_headers.get()}, "
-              f"显示IP信息: {self.show_ip_info.get()}")
-    
-    def show_context_menu(self, event):
-        """显示右键菜单"""
-        # 获取点击的项目
-        item = self.file_tree.identify('item', event.x, event.y)
-        if item:
-            self.file_tree.selection_set(item)
-            # 检查是否有转换结果
-            if item in self.file_items:
-                file_info = self.file_items[item]
-                if file_info.get('output_file') and os.path.exists(file_info['output_file']):
-                    self.context_menu.post(event.x_root, event.y_root)
-    
-    def open_file(self):
-        """打开转换后的文件"""
-        selection = self.file_tree.selection()
-        if selection:
-            item = selection[0]
-            if item in self.file_items:
-                file_info = self.file_items[item]
-                output_file = file_info.get('output_file')
-                if output_file and os.path.exists(output_file):
-                    try:
-                        if platform.system() == 'Windows':
-                            os.startfile(output_file)
-                        elif platform.system() == 'Darwin':  # macOS
-                            subprocess.run(['open', output_file])
-                        else:  # Linux
-                            subprocess.run(['xdg-open', output_file])
-                    except Exception as e:
-                        messagebox.showerror("错误", f"无法打开文件: {str(e)}")
-    
-    def open_file_location(self):
-        """打开文件所在文件夹"""
-        selection = self.file_tree.selection()
-        if selection:
-            item = selection[0]
-            if item in self.file_items:
-                file_info = self.file_items[item]
-                output_file = file_info.get('output_file')
-                if output_file and os.path.exists(output_file):
-                    folder = os.path.dirname(output_file)
-                    try:
-                        if platform.system() == 'Windows':
-                            os.startfile(folder)
-                        elif platform.system() == 'Darwin':  # macOS
-                            subprocess.run(['open', folder])
-                        else:  # Linux
-                            subprocess.run(['xdg-open', folder])
-                    except Exception as e:
-                        messagebox.showerror("错误", f"无法打开文件夹: {str(e)}")
-    
-    def select_files(self):
-        """选择MSG文件"""
-        files = filedialog.askopenfilenames(
-            title="选择MSG文件",
-            filetypes=[("MSG files", "*.msg"), ("All files", "*.*")]
-        )
-        
-        if files:
-            new_files_count = 0
-            for file_path in files:
-                # 检查是否已经添加
-                already_exists = False
-                for item_id, file_info in self.file_items.items():
-                    if file_info['path'] == file_path:
-                        already_exists = True
-                        break
-                
-                if not already_exists:
-                    # 添加到树形视图
-                    filename = os.path.basename(file_path)
-                    item = self.file_tree.insert('', 'end', text=filename, values=('待转换', ''))
-                    
-                    # 保存文件信息
-                    self.file_items[item] = {
-                        'path': file_path,
-                        'filename': filename,
-                        'status': 'pending',
-                        'output_file': None
-                    }
-                    new_files_count += 1
-            
-            self.update_file_count()
-            
-            if new_files_count > 0:
-                self.status_label.config(text=f"添加了 {new_files_count} 个新文件")
-    
-    def clear_files(self):
-        """清空文件列表"""
-        if messagebox.askyesno("确认", "确定要清空所有已选择的文件吗？"):
-            self.file_tree.delete(*self.file_tree.get_children())
-            self.file_items.clear()
-            self.conversion_results.clear()
-            self.update_file_count()
-            self.status_label.config(text="已清空文件列表")
-    
-    def remove_selected(self):
-        """删除选中的文件"""
-        selection = self.file_tree.selection()
-        if not selection:
-            messagebox.showwarning("警告", "请先选择要删除的文件")
-            return
+        self.auto_decode_cb.pack(side=tk.LEFT)
         
-        for item in selection:
-            if item in self.file_items:
-                del self.file_items[item]
-            self.file_tree.delete(item)
+        # 第三行：性能选项
+        perf_options_frame = ttk.Frame(options_frame)
+        perf_options_frame.pack(fill=tk.X, pady=(5, 0))
         
-        self.update_file_count()
-        self.status_label.config(text=f"已删除 {len(selection)} 个文件")
-    
-    def update_file_count(self):
-        """更新文件计数和按钮状态"""
-        count = len(self.file_items)
-        if count == 0:
-            self.file_count_label.config(text="未选择文件")
-            self.convert_btn.config(state=tk.DISABLED)
-            self.clear_btn.config(state=tk.DISABLED)
-            self.remove_btn.config(state=tk.DISABLED)
-        else:
-            self.file_count_label.config(text=f"已选择 {count} 个文件")
-            if EXTRACT_MSG_AVAILABLE:
-                self.convert_btn.config(state=tk.NORMAL)
-            self.clear_btn.config(state=tk.NORMAL)
-            self.remove_btn.config(state=tk.NORMAL)
-    
-    def select_output_dir(self):
-        """选择输出目录"""
-        directory = filedialog.askdirectory(title="选择EML文件输出目录")
-        if directory:
-            self.output_dir = directory
-            self.output_dir_var.set(directory)
-    
-    def start_conversion(self):
-        """开始转换文件"""
-        if not self.file_items:
-            messagebox.showwarning("警告", "请先选择MSG文件")
-            return
-            
-        if not EXTRACT_MSG_AVAILABLE:
-            messagebox.showerror("错误", "请先安装 extract-msg 库")
-            return
+        ttk.Label(perf_options_frame, text="性能选项：", font=("Arial", 9, "bold")).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Label(perf_options_frame, text="并行进程数").pack(side=tk.LEFT, padx=(0, 5))
         
-        # 重置所有文件状态
-        for item_id, file_info in self.file_items.items():
-            self.file_tree.set(item_id, 'status', '待转换')
-            self.file_tree.set(item_id, 'result', '')
-            file_info['status'] = 'pending'
+        self.worker_count_sb = ttk.Spinbox(
+            perf_options_frame,
+            from_=1,
+            to=max(64, os.cpu_count() or 1),
+            width=5,
+            textvariable=self.worker_count
+        )
+        self.worker_count_sb.pack(side=tk.LEFT)
+        self.create_tooltip(self.worker_count_sb,
+                          "同时进行转换的进程数：\n"
+                          "• 默认等于CPU核心数\n"
+                          "• 设为1且不限制超时时在单个后台线程中逐个转换")
         
-        self.conversion_results.clear()
+        ttk.Label(perf_options_frame, text="单文件超时(秒)").pack(side=tk.LEFT, padx=(15, 5))
+        self.file_timeout_sb = ttk.Spinbox(
+            perf_options_frame,
+            from_=0,
+            to=3600,
+            width=5,
+            textvariable=self.file_timeout
+        )
+        self.file_timeout_sb.pack(side=tk.LEFT)
+        self.create_tooltip(self.file_timeout_sb,
+                          "单个文件的转换时长上限：\n"
+                          "• 损坏或超大的文件超时后被终止并标记为超时\n"
+                          "• 其他文件继续转换，不会被卡住\n"
+                          "• 设为0表示不限制；进程数同时为1时在界面进程内\n"
+                          "  转换（不启动工作进程，但卡住的文件无法终止）")
         
-        self.convert_btn.config(state=tk.DISABLED)
-        self.select_btn.config(state=tk.DISABLED)
-        self.clear_btn.config(state=tk.DISABLED)
-        self.remove_btn.config(state=tk.DISABLED)
+        self.incremental_cb = ttk.Checkbutton(
+            perf_options_frame,
+            text="增量转换（跳过未变化的文件）",
+            variable=self.incremental
+        )
+        self.incremental_cb.pack(side=tk.LEFT, padx=(15, 0))
+        self.create_tooltip(self.incremental_cb,
+                          "记录已转换文件的大小、修改时间和转换选项：\n"
+                          "• 再次转换时跳过未变化的文件\n"
+                          f"• 清单保存在输出目录（未指定时为用户目录）的 {MANIFEST_FILENAME}")
         
-        thread = threading.Thread(target=self.convert_files)
-        thread.daemon = True
-        thread.start()
-    
-    def convert_files(self):
-        """转换MSG文件到EML格式"""
-        total_files = len(self.file_items)
-        success_count = 0
-        failed_count = 0
+        self.deduplicate_cb = ttk.Checkbutton(
+            perf_options_frame,
+            text="合并重复文件",
+            variable=self.deduplicate
+        )
+        self.deduplicate_cb.pack(side=tk.LEFT, padx=(15, 0))
+        self.create_tooltip(self.deduplicate_cb,
+                          "内容完全相同的MSG文件只转换一次：\n"
+                          "• 依次比较文件大小、抽样哈希和完整哈希\n"
+                          "• 其余文件的EML通过硬链接或复制生成")
+        self.create_tooltip(self.auto_decode_cb,
+                          "自动解码邮件中的编码内容：\n"
+                          "• Base64编码（如：5Lit6K+t → 中文）\n"
+                          "• Quoted-Printable编码\n"
+                          "• RFC 2047编码的邮件头")
         
-        self.progress.config(maximum=total_files)
+        # 文件列表区域（使用Treeview）
+        list_frame = ttk.LabelFrame(main_frame, text="文件列表", padding="10")
+        list_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        list_frame.columnconfigure(0, weight=1)
+        list_frame.rowconfigure(0, weight=1)
         
-        for index, (item_id, file_info) in enumerate(self.file_items.items()):
-            msg_file = file_info['path']
-            filename = file_info['filename']
-            
-            try:
-                # 更新状态为转换中
-                self.root.after(0, lambda i=item_id: self.file_tree.set(i, 'status', '转换中...'))
-                self.root.after(0, lambda f=filename: self.status_label.config(
-                    text=f"正在转换: {f}"))
-                
-                # 打开MSG文件
-                msg = extract_msg.openMsg(msg_file)
-                
-                # 创建EML内容
-                eml_content = self.create_eml_content(msg)
-                
-                # 确定输出目录
-                if self.output_dir:
-                    output_dir = self.output_dir
-                else:
-                    output_dir = os.path.dirname(msg_file)
-                
-                os.makedirs(output_dir, exist_ok=True)
-                
-                # 生成输出文件名
-                name_without_ext = os.path.splitext(filename)[0]
-                name_without_ext = re.sub(r'[<>:"|?*]', '_', name_without_ext)
-                eml_filename = f"{name_without_ext}.eml"
-                eml_path = os.path.join(output_dir, eml_filename)
-                
-                # 处理同名文件
-                counter = 1
-                while os.path.exists(eml_path):
-                    eml_filename = f"{name_without_ext}_{counter}.eml"
-                    eml_path = os.path.join(output_dir, eml_filename)
-                    counter += 1
-                
-                # 保存EML文件
-                with open(eml_path, 'wb') as f:
-                    f.write(eml_content.encode('utf-8'))
-                
-                # 更新文件信息
-                file_info['status'] = 'success'
-                file_info['output_file'] = eml_path
-                
-                self.conversion_results[msg_file] = {
-                    'status': 'success',
-                    'output_file': eml_path,
-                    'options': {
-                        'include_attachments': self.include_attachments.get(),
-                        'preserve_headers': self.preserve_headers.get(),
-                        'auto_decode': self.auto_decode.get(),
-                        'detect_encoding': self.detect_encoding.get(),
-                        'preserve_transport_headers': self.preserve_transport_headers.get(),
-                        'show_ip_info': self.show_ip_info.get()
-                    }
-                }
-                
-                # 更新UI
-                self.root.after(0, lambda i=item_id, f=eml_filename: (
-                    self.file_tree.set(i, 'status', '已完成'),
-                    self.file_tree.set(i, 'result', f)
-                ))
-                
-                success_count += 1
-                msg.close()
-                
-            except Exception as e:
-                error_msg = str(e)
-                file_info['status'] = 'failed'
-                
-                self.conversion_results[msg_file] = {
-                    'status': 'failed',
-                    'error': error_msg
-                }
-                
-                # 更新UI显示错误
-                self.root.after(0, lambda i=item_id, e=error_msg: (
-                    self.file_tree.set(i, 'status', '转换失败'),
-                    self.file_tree.set(i, 'result', f'错误: {e[:50]}...')
-                ))
-                
-                failed_count += 1
-            
-            # 更新进度条
-            self.root.after(0, lambda v=index+1: self.progress.config(value=v))
+        # 创建文件列表（只创建可见行，支持大量文件）
+        columns = ('status', 'result')
+        self.file_tree = VirtualFileList(list_frame, columns, show='tree headings', height=15)
+        self.file_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
-        # 转换完成
-        summary = f"\n转换完成！成功: {success_count} 个，失败: {failed_count} 个\n"
-        self.root.after(0, lambda: self.status_label.config(text=summary.strip()))
+        # 设置列标题和宽度
+        self.file_tree.heading('#0', text='文件名称')
+        self.file_tree.heading('status', text='转换情况')
+        self.file_tree.heading('result', text='转换结果')
         
-        if success_count > 0:
-            self.root.after(0, lambda: messagebox.showinfo("转换完成", summary.strip()))
+        self.file_tree.column('#0', width=400)
+        self.file_tree.column('status', width=100, anchor='center')
+        self.file_tree.column('result', width=400)
         
-        # 恢复按钮状态
-        self.root.after(0, lambda: (
-            self.convert_btn.config(state=tk.NORMAL),
-            self.select_btn.config(state=tk.NORMAL),
-            self.clear_btn.config(state=tk.NORMAL),
-            self.remove_btn.config(state=tk.NORMAL),
-            self.progress.config(value=0)
-        ))
-    
-    # 以下是所有的辅助方法
-    
-    def create_eml_content(self, msg):
-        """创建EML格式内容（增强版，包含完整传输信息）"""
-        try:
-            # 获取邮件正文内容
-            body_text = self.safe_get_str(msg, 'body')
-            html_text = self.safe_get_str(msg, 'htmlBody')
-            
-            # 如果HTML内容为空但有RTF内容，尝试获取RTF
-            if not html_text and hasattr(msg, 'rtfBody'):
-                rtf_text = self.safe_get_str(msg, 'rtfBody')
-                if rtf_text and not body_text:
-                    body_text = rtf_text
-            
-            # 检查是否有附件
-            has_attachments = hasattr(msg, 'attachments') and len(msg.attachments) > 0
-            
-            # 创建根邮件对象
-            if has_attachments and self.include_attachments.get():
-                email_msg = MIMEMultipart('mixed')
-                
-                if body_text and html_text:
-                    msg_body = MIMEMultipart('alternative')
-                    msg_body.attach(MIMEText(body_text, 'plain', 'utf-8'))
-                    msg_body.attach(MIMEText(html_text, 'html', 'utf-8'))
-                    email_msg.attach(msg_body)
-                elif html_text:
-                    email_msg.attach(MIMEText(html_text, 'html', 'utf-8'))
-                elif body_text:
-                    email_msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
-                else:
-                    email_msg.attach(MIMEText("", 'plain', 'utf-8'))
-                    
-            elif body_text and html_text:
-                email_msg = MIMEMultipart('alternative')
-                email_msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
-                email_msg.attach(MIMEText(html_text, 'html', 'utf-8'))
-            elif html_text:
-                email_msg = MIMEText(html_text, 'html', 'utf-8')
-            else:
-                email_msg = MIMEText(body_text or "", 'plain', 'utf-8')
-            
-            # 添加原始邮件头（如果启用了保留传输头选项）
-            if self.preserve_transport_headers.get():
-                original_headers = self.extract_original_headers(msg)
-                for header_name, header_value in original_headers:
-                    if header_value and header_name.lower() not in ['content-type', 'content-transfer-encoding', 'mime-version']:
-                        email_msg[header_name] = header_value
-            
-            # 设置基本邮件头（检查是否已存在）
-            existing_headers = {key.lower() for key in email_msg.keys()}
-            
-            if 'subject' not in existing_headers:
-                subject = self.safe_get_str(msg, 'subject')
-                if subject:
-                    email_msg['Subject'] = self.encode_header(subject)
-            
-            if 'from' not in existing_headers:
-                sender = self.safe_get_str(msg, 'sender')
-                if sender:
-                    email_msg['From'] = self.encode_header(sender)
-            
-            if 'to' not in existing_headers:
-                to_recipients = self.safe_get_str(msg, 'to')
-                if to_recipients:
-                    email_msg['To'] = self.encode_header(to_recipients)
-            
-            if 'cc' not in existing_headers:
-                cc_recipients = self.safe_get_str(msg, 'cc')
-                if cc_recipients:
-                    email_msg['Cc'] = self.encode_header(cc_recipients)
-            
-            if 'bcc' not in existing_headers:
-                bcc_recipients = self.safe_get_str(msg, 'bcc')
-                if bcc_recipients:
-                    email_msg['Bcc'] = self.encode_header(bcc_recipients)
-            
-            if 'date' not in existing_headers:
-                date_obj = None
-                if hasattr(msg, 'date'):
-                    date_obj = msg.date
-                elif hasattr(msg, 'sentOn'):
-                    date_obj = msg.sentOn
-                email_msg['Date'] = self.format_email_date(date_obj)
-            
-            if 'message-id' not in existing_headers:
-                message_id = self.safe_get_str(msg, 'messageId')
-                if message_id:
-                    email_msg['Message-ID'] = message_id
-                else:
-                    email_msg['Message-ID'] = f"<{uuid.uuid4()}@msg-to-eml-converter>"
-            
-            if 'reply-to' not in existing_headers:
-                reply_to = self.safe_get_str(msg, 'replyTo')
-                if reply_to:
-                    email_msg['Reply-To'] = self.encode_header(reply_to)
-            
-            # 设置MIME版本
-            if 'mime-version' not in existing_headers:
-                email_msg['MIME-Version'] = '1.0'
-            
-            # 添加MSG扩展属性（如果启用了保留MSG属性选项）
-            if self.preserve_headers.get():
-                self.add_extended_headers(email_msg, msg)
-            
-            # 添加额外的传输信息（如果启用了显示IP信息选项）
-            if self.show_ip_info.get():
-                self.add_ip_related_headers(email_msg, msg)
-            
-            # 添加转换器信息
-            email_msg['X-Converted-From'] = 'MSG'
-            email_msg['X-Converter'] = 'Enhanced-MSG-to-EML-Converter-v2'
-            email_msg['X-Conversion-Date'] = formatdate(localtime=True)
-            
-            # 处理附件
-            if has_attachments and self.include_attachments.get():
-                for i, attachment in enumerate(msg.attachments):
+        # 添加滚动条
+        self.file_tree.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        
+        # 绑定右键菜单
+        self.file_tree.bind('<Button-3>', self.show_context_menu)
+        
+        # 创建右键菜单
+        self.context_menu = tk.Menu(self.root, tearoff=0)
+        self.context_menu.add_command(label="打开文件", command=self.open_file)
+        self.context_menu.add_command(label="打开文件所在文件夹", command=self.open_file_location)
+        
+        # 进度条
+        self.progress = ttk.Progressbar(main_frame, mode='determinate')
+        self.progress.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        # 底部操作按钮
+        bottom_frame = ttk.Frame(main_frame)
+        bottom_frame.grid(row=4, column=0, pady=(0, 10))
+        
+        # 查看邮件头按钮
+        self.view_headers_btn = ttk.Button(bottom_frame, text="查看邮件头详情", 
+                                          command=self.view_email_headers)
+        self.view_headers_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # 查看MSG属性按钮
+        self.view_msg_attrs_btn = ttk.Button(bottom_frame, text="调试：查看MSG属性", 
+                                           command=self.view_msg_attributes)
+        self.view_msg_attrs_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # 测试选项按钮
+        self.test_options_btn = ttk.Button(bottom_frame, text="测试：比较选项效果", 
+                                          command=self.test_option_effects)
+        self.test_options_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # 状态栏
+        status_frame = ttk.Frame(main_frame)
+        status_frame.grid(row=5, column=0, sticky=(tk.W, tk.E))
+        status_frame.columnconfigure(0, weight=1)
+        
+        self.status_label = ttk.Label(status_frame, text="准备就绪", relief=tk.SUNKEN)
+        self.status_label.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        
+        # 文件计数标签
+        self.file_count_label = ttk.Label(status_frame, text="未选择文件", font=("Arial", 9))
+        self.file_count_label.grid(row=0, column=1, padx=(10, 0))
+        
+        # 绑定选项变化事件，用于调试
+        for var in [self.preserve_headers, self.preserve_transport_headers, self.show_ip_info]:
+            var.trace('w', self.on_option_changed)
+    
+    def post_ui_event(self, kind, *args):
+        """工作线程发送界面更新事件
+        
+        kind为 'row'（列表项, {列: 值}）、'label'（状态栏文字）、
+        'progress'（进度值）或 'call'（在界面线程中调用的函数, 参数...）。
+        """
+        self.ui_events.put((kind, args))
+    
+    def drain_ui_events(self):
+        """界面线程：定时取出全部事件，合并后一次性更新界面"""
+        rows = {}
+        label = None
+        progress = None
+        calls = []
+        try:
+            while True:
+                kind, args = self.ui_events.get_nowait()
+                if kind == 'row':
+                    rows.setdefault(args[0], {}).update(args[1])
+                elif kind == 'label':
+                    label = args[0]
+                elif kind == 'progress':
+                    progress = args[0]
+                elif kind == 'call':
+                    calls.append(args)
+        except queue.Empty:
+            pass
+        
+        # 同一行的多次更新只应用最后的值
+        for item_id, column_values in rows.items():
+            for column, value in column_values.items():
+                self.file_tree.set(item_id, column, value)
+        if label is not None:
+            self.status_label.config(text=label)
+        if progress is not None:
+            self.progress.config(value=progress)
+        for func, *func_args in calls:
+            func(*func_args)
+        
+        self.root.after(UI_UPDATE_INTERVAL_MS, self.drain_ui_events)
+    
+    def on_option_changed(self, *args):
+        """选项变化时的回调（用于调试）"""
+        print(f"选项状态 - 保留MSG属性: {self.preserve_headers.get()}, "
+              f"保留传输头: {self.preserve_transport_headers.get()}, "
+              f"显示IP信息: {self.show_ip_info.get()}")
+    
+    def show_context_menu(self, event):
+        """显示右键菜单"""
+        # 获取点击的项目
+        item = self.file_tree.identify('item', event.x, event.y)
+        if item:
+            self.file_tree.selection_set(item)
+            # 检查是否有转换结果
+            if item in self.file_items:
+                file_info = self.file_items[item]
+                if file_info.get('output_file') and os.path.exists(file_info['output_file']):
+                    self.context_menu.post(event.x_root, event.y_root)
+    
+    def open_file(self):
+        """打开转换后的文件"""
+        selection = self.file_tree.selection()
+        if selection:
+            item = selection[0]
+            if item in self.file_items:
+                file_info = self.file_items[item]
+                output_file = file_info.get('output_file')
+                if output_file and os.path.exists(output_file):
                     try:
-                        filename = self.get_attachment_filename(attachment, i)
-                        mime_part = self.create_attachment_mime(attachment, filename)
-                        email_msg.attach(mime_part)
+                        import subprocess
+                        if platform.system() == 'Windows':
+                            os.startfile(output_file)
+                        elif platform.system() == 'Darwin':  # macOS
+                            subprocess.run(['open', output_file])
+                        else:  # Linux
+                            subprocess.run(['xdg-open', output_file])
                     except Exception as e:
-                        print(f"处理附件 {i+1} 时出错: {e}")
-            
-            return email_msg.as_string()
-            
-        except Exception as e:
-            print(f"创建EML内容时出错: {e}")
-            error_msg = MIMEText(f"MSG文件转换错误:\n{str(e)}", 'plain', 'utf-8')
-            error_msg['Subject'] = "MSG转换错误"
-            error_msg['From'] = "enhanced-msg-to-eml-converter@localhost"
-            error_msg['Date'] = formatdate(localtime=True)
-            return error_msg.as_string()
+                        messagebox.showerror("错误", f"无法打开文件: {str(e)}")
     
-    def extract_original_headers(self, msg):
-        """提取MSG文件中的原始邮件头"""
-        original_headers = []
+    def open_file_location(self):
+        """打开文件所在文件夹"""
+        selection = self.file_tree.selection()
+        if selection:
+            item = selection[0]
+            if item in self.file_items:
+                file_info = self.file_items[item]
+                output_file = file_info.get('output_file')
+                if output_file and os.path.exists(output_file):
+                    folder = os.path.dirname(output_file)
+                    try:
+                        import subprocess
+                        if platform.system() == 'Windows':
+                            os.startfile(folder)
+                        elif platform.system() == 'Darwin':  # macOS
+                            subprocess.run(['open', folder])
+                        else:  # Linux
+                            subprocess.run(['xdg-open', folder])
+                    except Exception as e:
+                        messagebox.showerror("错误", f"无法打开文件夹: {str(e)}")
+    
+    def select_files(self):
+        """选择MSG文件"""
+        files = filedialog.askopenfilenames(
+            title="选择MSG文件",
+            filetypes=[("MSG files", "*.msg"), ("All files", "*.*")]
+        )
         
-        try:
-            # 尝试多种方式获取原始邮件头
-            # 方法1：transportMessageHeaders（通常包含最完整的头信息）
-            if hasattr(msg, 'transportMessageHeaders'):
-                transport_headers = None
-                try:
-                    transport_headers = msg.transportMessageHeaders
-                    if isinstance(transport_headers, bytes):
-                        transport_headers = transport_headers.decode('utf-8', errors='replace')
-                    elif transport_headers is not None:
-                        transport_headers = str(transport_headers)
-                except:
-                    transport_headers = self.safe_get_str(msg, 'transportMessageHeaders')
-                
-                if transport_headers:
-                    headers = self.parse_header_string(transport_headers)
-                    if headers:
-                        original_headers.extend(headers)
-            
-            # 方法2：header属性
-            if hasattr(msg, 'header'):
-                header_data = self.safe_get_str(msg, 'header')
-                if header_data:
-                    headers = self.parse_header_string(header_data)
-                    original_headers.extend(headers)
-            
-            # 方法3：internetHeaders属性
-            if hasattr(msg, 'internetHeaders'):
-                internet_headers = self.safe_get_str(msg, 'internetHeaders')
-                if internet_headers:
-                    headers = self.parse_header_string(internet_headers)
-                    original_headers.extend(headers)
-            
-            # 去重
-            seen = set()
-            unique_headers = []
-            for header_name, header_value in original_headers:
-                key = header_name.lower()
-                if key not in seen or key == 'received':  # Received头可以有多个
-                    seen.add(key)
-                    unique_headers.append((header_name, header_value))
-            
-            return unique_headers
+        if files:
+            new_files_count = self.add_paths(files)
             
-        except Exception as e:
-            print(f"提取原始邮件头时出错: {e}")
-            return []
+            if new_files_count > 0:
+                self.status_label.config(text=f"添加了 {new_files_count} 个新文件")
     
-    def parse_header_string(self, header_string):
-        """解析邮件头字符串"""
-        headers = []
-        
-        if not header_string:
-            return headers
-        
-        try:
-            # 标准化行结束符
-            header_string = header_string.replace('\r\n', '\n').replace('\r', '\n')
-            
-            # 分割成行
-            lines = header_string.split('\n')
-            current_header = None
-            current_value = []
-            
-            for line in lines:
-                # 空行表示邮件头结束
-                if not line.strip():
-                    if current_header:
-                        headers.append((current_header, ' '.join(current_value)))
-                        current_header = None
-                        current_value = []
-                    continue
-                
-                # 以空格或制表符开头的行是上一个头的延续
-                if line and line[0] in ' \t':
-                    if current_header:
-                        current_value.append(line.strip())
-                # 包含冒号的行是新的头
-                elif ':' in line:
-                    # 保存之前的头
-                    if current_header:
-                        headers.append((current_header, ' '.join(current_value)))
-                    
-                    # 解析新的头
-                    colon_pos = line.find(':')
-                    header_name = line[:colon_pos].strip()
-                    header_value = line[colon_pos + 1:].strip()
-                    
-                    if header_name:
-                        current_header = header_name
-                        current_value = [header_value] if header_value else []
+    def add_paths(self, paths):
+        """把文件加入列表（已存在的路径忽略），返回新增数量"""
+        new_paths = []
+        for file_path in paths:
+            # 检查是否已经添加
+            if file_path in self.path_index:
+                continue
             
-            # 保存最后一个头
-            if current_header:
-                headers.append((current_header, ' '.join(current_value)))
+            # 添加到树形视图
+            filename = os.path.basename(file_path)
+            item = self.file_tree.insert('', 'end', text=filename, values=('待转换', ''))
             
-        except Exception as e:
-            print(f"解析邮件头字符串时出错: {e}")
+            # 保存文件信息
+            self.file_items[item] = {
+                'path': file_path,
+                'filename': filename,
+                'status': 'pending',
+                'output_file': None
+            }
+            self.path_index[file_path] = item
+            new_paths.append(file_path)
         
-        return headers
+        # 转换进行中时，新文件直接交给正在运行的转换
+        if self.conversion_feed is not None:
+            for file_path in new_paths:
+                self.conversion_feed.put(file_path)
+            self.progress.config(maximum=len(self.file_items))
+        
+        self.update_file_count()
+        return len(new_paths)
     
-    def add_extended_headers(self, email_msg, msg):
-        """添加MSG扩展属性"""
-        try:
-            # 会话相关
-            conv_topic = self.safe_get_str(msg, 'conversationTopic')
-            if conv_topic:
-                email_msg['Thread-Topic'] = self.encode_header(conv_topic)
-            
-            conv_index = self.safe_get_str(msg, 'conversationIndex')
-            if conv_index:
-                email_msg['Thread-Index'] = conv_index
-            
-            # MSG特有属性
-            if hasattr(msg, 'messageClass'):
-                msg_class = self.safe_get_str(msg, 'messageClass')
-                if msg_class:
-                    email_msg['X-Message-Class'] = msg_class
-            
-            # 其他扩展属性
-            extended_attrs = [
-                ('sensitivity', 'X-Sensitivity'),
-                ('flag', 'X-Flag-Status'),
-                ('categories', 'X-Categories'),
-                ('companies', 'X-Companies'),
-                ('readReceiptRequested', 'X-Read-Receipt-Requested'),
-                ('deliveryReceiptRequested', 'X-Delivery-Receipt-Requested'),
-            ]
-            
-            for attr, header_name in extended_attrs:
-                value = self.safe_get_str(msg, attr)
-                if value:
-                    email_msg[header_name] = self.encode_header(value)
-                    
-        except Exception as e:
-            print(f"添加扩展头时出错: {e}")
+    def select_folder(self):
+        """选择文件夹，递归添加其中的MSG文件"""
+        directory = filedialog.askdirectory(title="选择包含MSG文件的文件夹")
+        if not directory:
+            return
+        
+        if self.discovery_running:
+            messagebox.showinfo("提示", "正在扫描文件夹，请稍后再添加")
+            return
+        
+        self.discovery_running = True
+        self.discovery_cancel.clear()
+        self.select_folder_btn.config(state=tk.DISABLED)
+        self.status_label.config(text=f"正在扫描: {directory}")
+        
+        thread = threading.Thread(target=self.discover_files, args=(directory,))
+        thread.daemon = True
+        thread.start()
     
-    def add_ip_related_headers(self, email_msg, msg):
-        """添加IP相关的额外信息"""
-        try:
-            # 添加发送和接收的SMTP地址
-            sender_smtp = self.safe_get_str(msg, 'senderSmtpAddress')
-            if sender_smtp:
-                email_msg['X-Sender-SMTP-Address'] = sender_smtp
-                
-            received_smtp = self.safe_get_str(msg, 'receivedBySmtpAddress')
-            if received_smtp:
-                email_msg['X-Received-By-SMTP-Address'] = received_smtp
-            
-            # 添加时间戳信息（有助于追踪传输路径）
-            if hasattr(msg, 'clientSubmitTime'):
-                submit_time = msg.clientSubmitTime
-                if submit_time:
-                    email_msg['X-Client-Submit-Time'] = self.format_email_date(submit_time)
-            
-            if hasattr(msg, 'messageDeliveryTime'):
-                delivery_time = msg.messageDeliveryTime
-                if delivery_time:
-                    email_msg['X-Message-Delivery-Time'] = self.format_email_date(delivery_time)
-            
-            # 添加提示信息
-            email_msg['X-IP-Info-Note'] = 'IP addresses preserved from original MSG headers'
-            
-        except Exception as e:
-            print(f"添加IP相关头时出错: {e}")
+    def discover_files(self, directory, batch_size=500):
+        """后台线程：扫描目录，分批把找到的文件交给界面线程"""
+        batch = []
+        found = 0
+        for file_path in iter_msg_files(directory):
+            if self.discovery_cancel.is_set():
+                break
+            batch.append(file_path)
+            if len(batch) >= batch_size:
+                found += len(batch)
+                self.post_ui_event('call', self.add_discovered, batch, found)
+                batch = []
+        
+        found += len(batch)
+        self.post_ui_event('call', self.finish_discovery, batch, found)
     
-    def safe_get_str(self, obj, attr, default=""):
-        """安全获取字符串属性"""
-        try:
-            if hasattr(obj, attr):
-                value = getattr(obj, attr)
-                if value is None:
-                    return default
-                
-                # 处理字节串
-                if isinstance(value, bytes):
-                    if self.detect_encoding.get():
-                        value, _ = self.detect_text_encoding(value)
-                    else:
-                        value = value.decode('utf-8', errors='replace')
-                # 处理字符串
-                elif isinstance(value, str):
-                    if self.auto_decode.get():
-                        value = self.auto_decode_content(value)
-                else:
-                    value = str(value)
-                
-                return value.strip() if value else default
-            return default
-        except Exception as e:
-            print(f"获取属性 {attr} 时出错: {e}")
-            return default
+    def add_discovered(self, batch, found):
+        """界面线程：添加扫描到的一批文件"""
+        if self.discovery_cancel.is_set():
+            return
+        self.add_paths(batch)
+        self.status_label.config(text=f"正在扫描: 已找到 {found} 个MSG文件")
+    
+    def finish_discovery(self, batch, found):
+        """界面线程：处理最后一批文件并结束扫描"""
+        if not self.discovery_cancel.is_set():
+            self.add_paths(batch)
+            self.status_label.config(text=f"扫描完成，共找到 {found} 个MSG文件")
+        self.discovery_running = False
+        if self.conversion_feed is not None:
+            # 通知转换线程不会再有新文件
+            self.conversion_feed.put(None)
+        else:
+            self.select_folder_btn.config(state=tk.NORMAL)
+    
+    def clear_files(self):
+        """清空文件列表"""
+        if messagebox.askyesno("确认", "确定要清空所有已选择的文件吗？"):
+            self.discovery_cancel.set()
+            self.file_tree.delete(*self.file_tree.get_children())
+            self.file_items.clear()
+            self.path_index.clear()
+            self.conversion_results.clear()
+            self.update_file_count()
+            self.status_label.config(text="已清空文件列表")
+    
+    def remove_selected(self):
+        """删除选中的文件"""
+        selection = self.file_tree.selection()
+        if not selection:
+            messagebox.showwarning("警告", "请先选择要删除的文件")
+            return
+        
+        for item in selection:
+            if item in self.file_items:
+                del self.path_index[self.file_items[item]['path']]
+                del self.file_items[item]
+            self.file_tree.delete(item)
+        
+        self.update_file_count()
+        self.status_label.config(text=f"已删除 {len(selection)} 个文件")
+    
+    def update_file_count(self):
+        """更新文件计数和按钮状态"""
+        count = len(self.file_items)
+        if self.conversion_feed is not None:
+            # 转换进行中，按钮保持禁用
+            self.file_count_label.config(text=f"已选择 {count} 个文件")
+            return
+        if count == 0:
+            self.file_count_label.config(text="未选择文件")
+            self.convert_btn.config(state=tk.DISABLED)
+            self.clear_btn.config(state=tk.DISABLED)
+            self.remove_btn.config(state=tk.DISABLED)
+        else:
+            self.file_count_label.config(text=f"已选择 {count} 个文件")
+            if EXTRACT_MSG_AVAILABLE:
+                self.convert_btn.config(state=tk.NORMAL)
+            self.clear_btn.config(state=tk.NORMAL)
+            self.remove_btn.config(state=tk.NORMAL)
+    
+    def select_output_dir(self):
+        """选择输出目录"""
+        directory = filedialog.askdirectory(title="选择EML文件输出目录")
+        if directory:
+            self.output_dir = directory
+            self.output_dir_var.set(directory)
     
-    def detect_text_encoding(self, text_data):
-        """智能检测文本编码"""
-        if not text_data:
-            return text_data, 'utf-8'
+    def start_conversion(self):
+        """开始转换文件"""
+        if not self.file_items:
+            messagebox.showwarning("警告", "请先选择MSG文件")
+            return
+            
+        if not EXTRACT_MSG_AVAILABLE:
+            messagebox.showerror("错误", "请先安装 extract-msg 库")
+            return
         
-        if isinstance(text_data, str):
-            return text_data, 'utf-8'
+        # 重置所有文件状态
+        for item_id, file_info in self.file_items.items():
+            self.file_tree.set(item_id, 'status', '待转换')
+            self.file_tree.set(item_id, 'result', '')
+            file_info['status'] = 'pending'
         
-        if isinstance(text_data, bytes):
-            try:
-                detected = chardet.detect(text_data)
-                encoding = detected.get('encoding', 'utf-8')
-                confidence = detected.get('confidence', 0)
-                
-                if confidence < 0.7:
-                    for enc in ['utf-8', 'gbk', 'gb2312', 'big5', 'utf-16']:
-                        try:
-                            decoded_text = text_data.decode(enc)
-                            return decoded_text, enc
-                        except UnicodeDecodeError:
-                            continue
-                
-                try:
-                    decoded_text = text_data.decode(encoding)
-                    return decoded_text, encoding
-                except UnicodeDecodeError:
-                    decoded_text = text_data.decode('utf-8', errors='replace')
-                    return decoded_text, 'utf-8'
-                    
-            except Exception:
-                decoded_text = text_data.decode('utf-8', errors='replace')
-                return decoded_text, 'utf-8'
+        self.conversion_results.clear()
         
-        return str(text_data), 'utf-8'
-    
-    def auto_decode_content(self, content):
-        """自动解码Base64或Quoted-Printable编码的内容"""
-        if not content or not isinstance(content, str):
-            return content
+        self.convert_btn.config(state=tk.DISABLED)
+        self.select_btn.config(state=tk.DISABLED)
+        self.select_folder_btn.config(state=tk.DISABLED)
+        self.clear_btn.config(state=tk.DISABLED)
+        self.remove_btn.config(state=tk.DISABLED)
         
-        # Base64解码
-        if self.is_base64_encoded(content):
-            try:
-                decoded_bytes = base64.b64decode(content)
-                decoded_text, _ = self.detect_text_encoding(decoded_bytes)
-                return decoded_text
-            except:
-                pass
+        # 转换的文件来源：当前列表，加上扫描仍在进行时后续找到的文件
+        self.conversion_feed = queue.Queue()
+        for file_info in self.file_items.values():
+            self.conversion_feed.put(file_info['path'])
+        if not self.discovery_running:
+            self.conversion_feed.put(None)
+        self.progress.config(maximum=len(self.file_items))
         
-        # Quoted-Printable解码
-        if self.is_quoted_printable_encoded(content):
-            try:
-                decoded_bytes = quopri.decodestring(content.encode('ascii'))
-                decoded_text, _ = self.detect_text_encoding(decoded_bytes)
-                return decoded_text
-            except:
-                pass
+        thread = threading.Thread(target=self.convert_files, args=(self.conversion_feed,))
+        thread.daemon = True
+        thread.start()
+    
+    def get_options(self):
+        """读取界面上的转换选项，生成不可变的选项对象"""
+        return ConversionOptions(
+            include_attachments=self.include_attachments.get(),
+            preserve_headers=self.preserve_headers.get(),
+            auto_decode=self.auto_decode.get(),
+            detect_encoding=self.detect_encoding.get(),
+            preserve_transport_headers=self.preserve_transport_headers.get(),
+            show_ip_info=self.show_ip_info.get(),
+            # 转换结果中带上邮件头，供“查看邮件头”直接使用
+            collect_headers=True
+        )
+    
+    def get_worker_pool(self, workers, limits=None):
+        """获取进程池（进程数和限制不变时跨批次复用）"""
+        key = (workers, limits)
+        if self.worker_pool is not None and self.worker_pool_key != key:
+            self.worker_pool.shutdown(wait=False)
+            self.worker_pool = None
         
-        # RFC 2047解码
-        if '=?' in content and '?=' in content:
-            try:
-                decoded_parts = decode_header(content)
-                decoded_text = ""
-                for part, encoding in decoded_parts:
-                    if isinstance(part, bytes):
-                        if encoding:
-                            decoded_text += part.decode(encoding)
-                        else:
-                            decoded_text += part.decode('utf-8', errors='replace')
-                    else:
-                        decoded_text += str(part)
-                return decoded_text
-            except:
-                pass
+        if self.worker_pool is None:
+            self.worker_pool = create_worker_pool(workers, limits=limits)
+            self.worker_pool_key = key
         
-        return content
+        return self.worker_pool
     
-    def is_base64_encoded(self, text):
-        """检查文本是否是Base64编码"""
-        if not text or len(text) < 4:
-            return False
-        
-        import string
-        base64_chars = string.ascii_letters + string.digits + '+/='
+    def on_close(self):
+        """关闭窗口时结束工作进程"""
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown(wait=False, cancel_futures=True)
+            self.worker_pool = None
+        self.root.destroy()
+    
+    def convert_files(self, feed):
+        """转换MSG文件到EML格式（从feed队列读取文件路径，直到读到None）"""
+        processed_count = 0
+        success_count = 0
+        failed_count = 0
+        skipped_count = 0
         
-        cleaned = text.replace('\n', '').replace('\r', '').replace(' ', '')
+        # 转换开始时读取一次选项，转换过程中不再访问Tk变量
+        options = self.get_options()
+        try:
+            workers = max(1, int(self.worker_count.get()))
+        except (tk.TclError, ValueError):
+            workers = 1
+        try:
+            timeout = max(0, int(self.file_timeout.get()))
+        except (tk.TclError, ValueError):
+            timeout = GUI_FILE_TIMEOUT
+        # 超时需要能终止转换，限制超时时即使只有一个进程也在工作进程中转换；
+        # 不限制超时且只有一个进程时在本进程的流水线中转换（见 GUI_FILE_TIMEOUT）
+        limits = WorkerLimits(timeout=timeout or None)
+        executor = self.get_worker_pool(workers, limits) if workers > 1 or timeout else None
         
-        if not all(c in base64_chars for c in cleaned):
-            return False
+        manifest = None
+        if self.incremental.get():
+            manifest_dir = self.output_dir or os.path.expanduser('~')
+            manifest = ConversionManifest(os.path.join(manifest_dir, MANIFEST_FILENAME))
         
-        if len(cleaned) % 4 != 0:
-            return False
+        path_items = self.path_index
         
-        try:
-            base64.b64decode(cleaned, validate=True)
-            return len(cleaned) > 20
-        except:
-            return False
-    
-    def is_quoted_printable_encoded(self, text):
-        """检查文本是否是Quoted-Printable编码"""
-        if not text:
-            return False
+        def feed_paths():
+            while True:
+                try:
+                    msg_file = feed.get(timeout=WATCH_WAIT_SECONDS)
+                except queue.Empty:
+                    # 仍在查找文件：先返回已完成的结果（见 iter_conversions）
+                    yield None
+                    continue
+                if msg_file is None:
+                    return
+                yield msg_file
         
-        qp_pattern = re.compile(r'=([0-9A-Fa-f]{2})')
-        return bool(qp_pattern.search(text))
-    
-    def encode_header(self, text):
-        """编码邮件头"""
-        if not text:
-            return ""
-        try:
-            text.encode('ascii')
-            return text
-        except UnicodeEncodeError:
-            return str(Header(text, 'utf-8'))
-    
-    def format_email_date(self, date_obj):
-        """格式化日期"""
-        if not date_obj:
-            return formatdate(localtime=True)
+        def on_start(msg_file):
+            item_id = path_items[msg_file]
+            filename = self.file_items[item_id]['filename']
+            # 更新状态为转换中
+            self.post_ui_event('row', item_id, {'status': '转换中...'})
+            self.post_ui_event('label', f"正在转换: {filename}")
         
-        try:
-            if isinstance(date_obj, str):
-                return date_obj
-            elif hasattr(date_obj, 'strftime'):
-                return formatdate(date_obj.timestamp(), localtime=True)
-            else:
-                return formatdate(localtime=True)
-        except:
-            return formatdate(localtime=True)
-    
-    def get_attachment_filename(self, attachment, index):
-        """获取附件文件名"""
-        filename = None
+        deduplicate = self.deduplicate.get()
+        duplicate_count = 0
+        metrics = ConversionMetrics()
         
-        filename_attrs = ['longFilename', 'shortFilename', 'FileName', 'displayName']
+        sink = output_index = journal = None
+        suffix = GUI_OUTPUT_FORMATS.get(self.output_format.get())
+        archive_path = None
+        if suffix:
+            archive_path = os.path.join(self.output_dir or os.path.expanduser('~'), ARCHIVE_BASENAME + suffix)
         
-        for attr in filename_attrs:
-            if hasattr(attachment, attr):
-                filename = self.safe_get_str(attachment, attr)
-                if filename:
-                    break
+        if manifest is not None and suffix != '.zip':
+            # 增量转换时同时记录断点续转日志：转换中途关闭窗口或程序崩溃后，
+            # 下次转换跳过已完成的文件（清单只在转换结束时保存）
+            journal_path = os.path.join(manifest_dir, JOURNAL_FILENAME)
+            journal_hash = options_fingerprint(options)
+            try:
+                try:
+                    journal = ConversionJournal(journal_path, journal_hash, self.output_dir, archive_path,
+                                                resume=True)
+                except ValueError:
+                    # 选项或输出位置变了，重新开始记录
+                    journal = ConversionJournal(journal_path, journal_hash, self.output_dir, archive_path)
+                if journal.resumed and archive_path:
+                    truncate_archive(archive_path, journal.archive_end)
+            except (OSError, ValueError) as e:
+                print(f"无法使用断点续转日志: {e}")
+                if journal is not None:
+                    journal.close()
+                journal = None
         
-        if not filename:
-            filename = f"attachment_{index + 1}"
+        if archive_path:
+            try:
+                sink = open_archive_sink(archive_path)
+                output_index = OutputIndex(f"{sink.path}.index.jsonl")
+            except (OSError, ValueError) as e:
+                if sink is not None:
+                    sink.close()
+                if journal is not None:
+                    journal.close()
+                self.post_ui_event('call', self.finish_conversion, f"无法打开输出归档: {e}", False)
+                return
         
-        filename = re.sub(r'[<>:"|?*]', '_', filename)
+        conversions = iter_conversions(feed_paths(), self.output_dir, options,
+                                       executor=executor, on_start=on_start, manifest=manifest,
+                                       deduplicate=deduplicate, sink=sink, index=output_index, journal=journal)
         
-        return filename
-    
-    def create_attachment_mime(self, attachment, filename):
-        """创建附件MIME部分"""
         try:
-            attachment_data = None
-            if hasattr(attachment, 'data'):
-                attachment_data = attachment.data
-            
-            if attachment_data:
-                mime_type, _ = mimetypes.guess_type(filename)
-                
-                if mime_type:
-                    maintype, subtype = mime_type.split('/', 1)
-                    part = MIMEBase(maintype, subtype)
-                else:
-                    part = MIMEBase('application', 'octet-stream')
+            for msg_file, result in conversions:
+                self.apply_conversion_result(path_items[msg_file], msg_file, result)
+                metrics.observe(result)
+                processed_count += 1
                 
-                if isinstance(attachment_data, bytes):
-                    part.set_payload(attachment_data)
+                if 'duplicate_of' in result:
+                    duplicate_count += 1
+                if result['status'] == 'success':
+                    success_count += 1
+                elif result['status'] == 'skipped':
+                    skipped_count += 1
                 else:
-                    part.set_payload(str(attachment_data).encode('utf-8'))
-                
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                
-                return part
-            else:
-                return self.create_attachment_placeholder(filename)
+                    failed_count += 1
                 
-        except Exception as e:
-            print(f"创建附件MIME时出错: {e}")
-            return self.create_attachment_placeholder(filename, f"错误: {str(e)}")
+                # 更新进度条
+                self.post_ui_event('progress', processed_count)
+        finally:
+            if journal is not None:
+                try:
+                    journal.close()
+                except OSError as e:
+                    print(f"写入断点续转日志时出错: {e}")
+            if sink is not None:
+                try:
+                    sink.close()
+                    output_index.close()
+                except OSError as e:
+                    print(f"关闭输出归档时出错: {e}")
+            if manifest is not None:
+                try:
+                    manifest.save()
+                    if journal is not None:
+                        # 清单已包含本次的结果，日志不再需要
+                        os.remove(journal.path)
+                except OSError as e:
+                    print(f"保存转换清单时出错: {e}")
+            metrics.finish()
+            if metrics.counts:
+                print(metrics.format_summary())
+        
+        # 转换完成
+        summary = f"\n转换完成！成功: {success_count} 个，失败: {failed_count} 个"
+        if skipped_count:
+            summary += f"，跳过未变化: {skipped_count} 个"
+        if deduplicate:
+            summary += format_dedup_summary(duplicate_count, processed_count)
+        summary += "\n"
+        self.post_ui_event('call', self.finish_conversion, summary.strip(), success_count > 0)
     
-    def create_attachment_placeholder(self, filename, error_msg=None):
-        """创建附件占位符"""
-        if error_msg:
-            placeholder_text = f"[附件内容不可用: {error_msg}]"
-        else:
-            placeholder_text = "[附件内容未包含]"
+    def finish_conversion(self, summary, show_dialog):
+        """界面线程：转换结束后更新状态并恢复按钮"""
+        self.conversion_feed = None
+        self.status_label.config(text=summary)
         
-        part = MIMEBase('text', 'plain')
-        part.set_payload(placeholder_text.encode('utf-8'))
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+        # 恢复按钮状态
+        self.convert_btn.config(state=tk.NORMAL)
+        self.select_btn.config(state=tk.NORMAL)
+        self.select_folder_btn.config(state=tk.NORMAL)
+        self.clear_btn.config(state=tk.NORMAL)
+        self.remove_btn.config(state=tk.NORMAL)
+        self.progress.config(value=0)
         
-        return part
+        if show_dialog:
+            messagebox.showinfo("转换完成", summary)
+    
+    def apply_conversion_result(self, item_id, msg_file, result):
+        """记录单个文件的转换结果并更新列表显示"""
+        file_info = self.file_items[item_id]
+        self.conversion_results[msg_file] = result
+        
+        if result['status'] in ('success', 'skipped'):
+            eml_path = result['output_file']
+            file_info['status'] = 'success'
+            file_info['output_file'] = eml_path
+            status_text = '已完成' if result['status'] == 'success' else '已跳过'
+            
+            # 更新UI
+            self.post_ui_event('row', item_id, {'status': status_text,
+                                                'result': os.path.basename(format_output_location(result))})
+        else:
+            error_msg = result['error']
+            file_info['status'] = 'failed'
+            status_text = RESULT_STATUS_LABELS.get(result['status'], '转换失败')
+            
+            # 更新UI显示错误
+            self.post_ui_event('row', item_id, {'status': status_text, 'result': f'错误: {error_msg[:50]}...'})
     
     def view_email_headers(self):
         """查看邮件头详情（修复版，可点击颜色过滤）"""
@@ -1206,42 +5361,29 @@ class EnhancedMSGToEMLConverter:
             'basic': []
         }
         
-        try:
-            # 读取EML文件
-            with open(eml_file, 'r', encoding='utf-8', errors='replace') as f:
-                eml_content = f.read()
-            
-            # 解析邮件
-            msg = email.message_from_string(eml_content)
-            
-            # IP地址匹配模式
-            ip_pattern = re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}\b')
-            
-            # 分类邮件头
-            for key, value in msg.items():
-                header_line = f"{key}: {value}\n"
-                
-                # 根据头类型分类
-                if key.lower() in ['x-converted-from', 'x-converter', 'x-conversion-date']:
-                    headers_data['converter'].append((key, value, header_line))
-                elif ip_pattern.search(value):
-                    headers_data['ip'].append((key, value, header_line))
-                elif key.lower() in ['received', 'x-mailer', 'x-originating-ip', 'x-sender-ip', 
-                                   'authentication-results', 'received-spf', 'dkim-signature',
-                                   'x-sender-smtp-address', 'x-received-by-smtp-address']:
-                    headers_data['transport'].append((key, value, header_line))
-                elif key.lower().startswith('thread-') or key.lower() in ['x-message-class', 
-                                                                         'x-sensitivity', 
-                                                                         'x-flag-status',
-                                                                         'x-categories',
-                                                                         'x-companies']:
-                    headers_data['extended'].append((key, value, header_line))
-                else:
-                    headers_data['basic'].append((key, value, header_line))
-            
-        except Exception as e:
-            headers_text.insert(tk.END, f"读取邮件头时出错: {str(e)}")
-            return
+        # 本次会话中转换的文件直接使用转换时记录的邮件头和分类，
+        # 其他文件（如增量转换跳过的）只读取并解析邮件头部分
+        location = self.conversion_results.get(file_info['path']) or {'output_file': eml_file}
+        headers = location.get('headers')
+        if headers is None:
+            try:
+                if not any(key in location for key in ARCHIVE_LOCATION_KEYS):
+                    # 跳过的文件在归档中的位置由输出索引记录
+                    index_path = f"{eml_file}.index.jsonl"
+                    if os.path.exists(index_path):
+                        location = OutputIndex.lookup(index_path, file_info['path']) or location
+                headers = read_output_headers(location)
+            except Exception as e:
+                headers_text.insert(tk.END, f"读取邮件头时出错: {str(e)}")
+                return
+            if headers is None:
+                headers_text.insert(tk.END, "邮件头不可用：找不到这封邮件在归档中的位置")
+                return
+            headers = classify_headers(headers)
+        
+        # 分类邮件头
+        for key, value, category in headers:
+            headers_data[category].append((key, value, f"{key}: {value}\n"))
         
         def update_display():
             """更新显示内容"""
@@ -1446,8 +5588,9 @@ class EnhancedMSGToEMLConverter:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         attrs_text.configure(yscrollcommand=scrollbar.set)
         
+        msg = None
         try:
-            msg = extract_msg.openMsg(msg_file)
+            msg = open_msg(msg_file)
             
             attrs_text.insert(tk.END, "=== MSG文件属性列表 ===\n\n", "section_header")
             
@@ -1467,7 +5610,8 @@ class EnhancedMSGToEMLConverter:
             
             # 显示原始邮件头
             attrs_text.insert(tk.END, "\n\n=== 原始邮件头 ===\n", "section_header")
-            original_headers = self.extract_original_headers(msg)
+            engine = MSGConversionEngine(self.get_options())
+            original_headers = engine.extract_original_headers(MessageSnapshot(msg))
             if original_headers:
                 for name, value in original_headers:
                     attrs_text.insert(tk.END, f"{name}: {value}\n")
@@ -1476,10 +5620,12 @@ class EnhancedMSGToEMLConverter:
             
             attrs_text.tag_configure("section_header", font=("Arial", 12, "bold"), foreground="blue")
             
-            msg.close()
-            
         except Exception as e:
             attrs_text.insert(tk.END, f"读取MSG文件时出错: {str(e)}")
+        finally:
+            # 出错时也关闭，不泄漏文件句柄
+            if msg is not None:
+                msg.close()
         
         attrs_text.configure(state=tk.DISABLED)
         
@@ -1513,15 +5659,14 @@ class EnhancedMSGToEMLConverter:
         notebook = ttk.Notebook(main_frame)
         notebook.pack(fill=tk.BOTH, expand=True)
         
+        msg = None
         try:
-            msg = extract_msg.openMsg(msg_file)
+            msg = open_msg(msg_file)
             
-            # 保存当前选项
-            original_options = {
-                'preserve_transport_headers': self.preserve_transport_headers.get(),
-                'preserve_headers': self.preserve_headers.get(),
-                'show_ip_info': self.show_ip_info.get()
-            }
+            base_options = self.get_options()
+            
+            # 各测试用例共用同一个快照，属性只读取和解码一次
+            snapshot = MessageSnapshot(msg)
             
             # 测试用例
             test_cases = [
@@ -1552,14 +5697,15 @@ class EnhancedMSGToEMLConverter:
             ]
             
             for test_case in test_cases:
-                # 设置选项
-                self.preserve_transport_headers.set(test_case['preserve_transport_headers'])
-                self.preserve_headers.set(test_case['preserve_headers'])
-                self.show_ip_info.set(test_case['show_ip_info'])
+                # 按测试用例生成选项，不修改界面上的选项
+                engine = MSGConversionEngine(base_options._replace(
+                    preserve_transport_headers=test_case['preserve_transport_headers'],
+                    preserve_headers=test_case['preserve_headers'],
+                    show_ip_info=test_case['show_ip_info']
+                ))
                 
-                # 创建EML内容
-                eml_content = self.create_eml_content(msg)
-                eml_msg = email.message_from_string(eml_content)
+                # 创建EML邮件对象（直接读取邮件头，无需序列化再解析）
+                eml_msg = engine.build_eml_message(snapshot)
                 
                 # 创建选项卡页面
                 tab_frame = ttk.Frame(notebook)
@@ -1590,31 +5736,368 @@ class EnhancedMSGToEMLConverter:
                 
                 text_widget.configure(state=tk.DISABLED)
             
-            # 恢复原始选项
-            for option, value in original_options.items():
-                getattr(self, option).set(value)
-            
-            msg.close()
-            
         except Exception as e:
             messagebox.showerror("错误", f"测试时出错: {str(e)}")
+        finally:
+            if msg is not None:
+                msg.close()
         
         # 关闭按钮
         close_btn = ttk.Button(main_frame, text="关闭", command=test_window.destroy)
         close_btn.pack(pady=(10, 0))
 
-def main():
-    """主函数"""
+def format_output_location(result):
+    """转换结果的输出位置：EML文件路径，或 归档路径:成员名 / 归档路径@偏移"""
+    if 'member' in result:
+        return f"{result['output_file']}:{result['member']}"
+    if 'offset' in result:
+        return f"{result['output_file']}@{result['offset']}"
+    return result['output_file']
+
+
+def format_dedup_summary(duplicate_count, total_count):
+    """生成去重统计文字"""
+    ratio = duplicate_count / total_count * 100 if total_count else 0
+    return f"，重复文件: {duplicate_count} 个（去重率 {ratio:.1f}%）"
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="MSG转EML转换器。不带参数运行时打开图形界面，指定文件时以命令行批量模式转换。"
+    )
+    parser.add_argument('files', nargs='*', help="要转换的MSG文件或文件夹（文件夹会递归查找*.msg）")
+    parser.add_argument('-o', '--output-dir', help="EML文件输出目录（默认与源文件相同目录）")
+    parser.add_argument('--archive', metavar='PATH',
+                        help="把所有邮件追加到单个归档文件，格式按扩展名："
+                             ".mbox、.zip、.tar、.tar.gz（不再逐个创建EML文件）")
+    parser.add_argument('--index', metavar='PATH',
+                        help="输出索引文件（JSON Lines，记录每个MSG文件的输出路径、归档成员名或偏移）；"
+                             "使用--archive时默认为 归档路径.index.jsonl")
+    parser.add_argument('--no-attachments', action='store_true', help="不包含附件内容")
+    parser.add_argument('--no-msg-headers', action='store_true', help="不保留MSG扩展属性")
+    parser.add_argument('--no-auto-decode', action='store_true', help="不自动解码编码内容")
+    parser.add_argument('--no-detect-encoding', action='store_true', help="不进行智能编码检测")
+    parser.add_argument('--no-transport-headers', action='store_true', help="不保留完整传输路径")
+    parser.add_argument('--no-ip-info', action='store_true', help="不增强IP信息显示")
+    parser.add_argument('--encoding-detector', default='auto',
+                        choices=('auto',) + ENCODING_DETECTORS,
+                        help="统计编码检测后端（默认auto：优先使用已安装的cchardet）")
+    parser.add_argument('--msg-reader', default='extract_msg', choices=MSG_READERS,
+                        help="MSG读取方式：extract_msg（默认）或mmap（内存映射，只读取用到的流，"
+                             "不支持的文件自动改用extract_msg）")
+    parser.add_argument('--embedded-depth', type=int, default=ConversionOptions().embedded_depth,
+                        help="嵌入的MSG邮件递归转换为message/rfc822的最大层数（0表示只保留占位附件）")
+    parser.add_argument('--embedded-max-mb', type=int, default=ConversionOptions().embedded_max_mb,
+                        help="单个嵌入邮件（含其附件）的大小上限，超过时只保留占位附件")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="并行转换进程数（默认等于CPU核心数，1表示不使用进程池）")
+    parser.add_argument('--timeout', type=float,
+                        help="单个文件的转换时长上限（秒），超过时终止该文件的工作进程并换新进程，"
+                             "文件标记为超时（指定任一限制时，-j 1 也在工作进程中转换）")
+    parser.add_argument('--max-rss-mb', type=int,
+                        help="工作进程的常驻内存上限（MB），超过时终止并标记为内存超限")
+    parser.add_argument('--max-tasks-per-worker', type=int,
+                        help="每个工作进程转换多少个文件后换新进程")
+    parser.add_argument('--read-threads', type=int, default=PipelineStages().readers,
+                        help="单进程转换（-j 1）时读取MSG文件的线程数")
+    parser.add_argument('--build-threads', type=int, default=PipelineStages().builders,
+                        help="单进程转换时构建邮件的线程数")
+    parser.add_argument('--write-threads', type=int, default=PipelineStages().writers,
+                        help="单进程转换时写出EML文件的线程数")
+    parser.add_argument('--stage-queue', type=int, default=PipelineStages().queue_size,
+                        help="流水线阶段之间最多缓存的消息数（限制内存占用）")
+    parser.add_argument('--manifest', metavar='PATH',
+                        help="增量转换清单文件，跳过其中记录的未变化文件")
+    parser.add_argument('--manifest-hash', action='store_true',
+                        help="清单中同时记录内容哈希，修改时间变化但内容相同的文件也跳过")
+    parser.add_argument('--journal', metavar='PATH',
+                        help="断点续转日志：记录每个已完成的文件，输出先写临时文件再放到正式文件名")
+    parser.add_argument('--resume', action='store_true',
+                        help="从断点续转日志继续上次中断的转换，跳过已完成的文件并清理写了一半的输出"
+                             "（未指定--journal时使用输出目录中的 " + JOURNAL_FILENAME + "）")
+    parser.add_argument('--dedup', action='store_true',
+                        help="内容完全相同的MSG文件只转换一次，其余通过硬链接或复制生成输出")
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help="保存运行报告（各阶段耗时直方图、字节数、按异常类型统计的失败数）")
+    parser.add_argument('--metrics-textfile', metavar='PATH',
+                        help="以node_exporter文本文件格式（.prom）保存指标")
+    parser.add_argument('--watch', action='store_true',
+                        help="持续监视指定的文件夹，新的MSG文件写完后自动转换（按Ctrl+C停止）；"
+                             "未指定--manifest时清单保存在输出目录（或第一个监视目录）中")
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE_SECONDS,
+                        help="监视模式下文件大小和修改时间保持不变多少秒后才开始转换")
+    parser.add_argument('--watch-poll', action='store_true',
+                        help="监视模式下不使用inotify，定期扫描目录（适用于挂载的网络共享）")
+    parser.add_argument('--poll-interval', type=float, default=WATCH_POLL_SECONDS,
+                        help="轮询模式下扫描目录的间隔（秒）")
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help="以本地HTTP服务方式运行：POST /convert 上传MSG文件，返回EML"
+                             "（默认只监听127.0.0.1，-j指定工作进程数）")
+    parser.add_argument('--max-queue', type=int,
+                        help="服务模式下正在转换之外最多排队的请求数，超过时返回429（默认为工作进程数的2倍）")
+    parser.add_argument('--max-upload-mb', type=int, default=SERVICE_MAX_UPLOAD_MB,
+                        help="服务模式下单个上传文件的大小上限")
+    parser.add_argument('--gui', action='store_true', help="强制打开图形界面")
+    return parser.parse_args(argv)
+
+
+def options_from_args(args):
+    """由命令行参数生成转换选项"""
+    return ConversionOptions(
+        include_attachments=not args.no_attachments,
+        preserve_headers=not args.no_msg_headers,
+        auto_decode=not args.no_auto_decode,
+        detect_encoding=not args.no_detect_encoding,
+        preserve_transport_headers=not args.no_transport_headers,
+        show_ip_info=not args.no_ip_info,
+        encoding_detector=args.encoding_detector,
+        msg_reader=args.msg_reader,
+        embedded_depth=max(0, args.embedded_depth),
+        embedded_max_mb=max(0, args.embedded_max_mb)
+    )
+
+
+def limits_from_args(args):
+    """由命令行参数生成工作进程的资源限制（0或负数表示不限制）"""
+    def positive(value):
+        return value if value and value > 0 else None
+    return WorkerLimits(
+        timeout=positive(args.timeout),
+        max_rss_mb=positive(args.max_rss_mb),
+        max_tasks=positive(args.max_tasks_per_worker)
+    )
+
+
+def run_cli(args):
+    """命令行批量转换，返回进程退出码"""
+    if not EXTRACT_MSG_AVAILABLE:
+        print("请先安装 extract-msg 和 chardet 库：pip install extract-msg chardet", file=sys.stderr)
+        return 2
+    
+    options = options_from_args(args)
+    stages = PipelineStages(
+        readers=max(1, args.read_threads),
+        builders=max(1, args.build_threads),
+        writers=max(1, args.write_threads),
+        queue_size=max(1, args.stage_queue)
+    )
+    if args.watch:
+        not_dirs = [path for path in args.files if not os.path.isdir(path)]
+        if not_dirs:
+            print(f"监视模式只能指定文件夹: {', '.join(not_dirs)}", file=sys.stderr)
+            return 2
+        if not args.manifest:
+            # 重启后不再重复转换已处理过的文件
+            args.manifest = os.path.join(args.output_dir or args.files[0], MANIFEST_FILENAME)
+    
+    single_file = len(args.files) == 1 and not os.path.isdir(args.files[0])
+    limits = limits_from_args(args)
+    executor = None
+    if any(limits):
+        # 超时和内存限制需要能终止转换，即使只转换一个文件也使用工作进程
+        workers = 1 if single_file else max(1, args.jobs)
+        executor = create_worker_pool(workers, ignore_interrupts=args.watch, limits=limits)
+    elif args.jobs > 1 and not single_file:
+        executor = create_worker_pool(args.jobs, ignore_interrupts=args.watch)
+    
+    manifest = ConversionManifest(args.manifest, use_hash=args.manifest_hash) if args.manifest else None
+    
+    journal_path = args.journal
+    if args.resume and not journal_path:
+        journal_dir = args.output_dir or (os.path.dirname(os.path.abspath(args.archive)) if args.archive else '.')
+        journal_path = os.path.join(journal_dir, JOURNAL_FILENAME)
+    
+    sink = index = journal = None
+    try:
+        if journal_path:
+            journal = ConversionJournal(journal_path, options_fingerprint(options), args.output_dir,
+                                        args.archive, resume=args.resume)
+            if journal.resumed:
+                print(f"从断点续转日志继续: {journal_path}（已完成 {len(journal.entries)} 个）")
+                if args.archive:
+                    truncate_archive(args.archive, journal.archive_end)
+        if args.archive:
+            sink = open_archive_sink(args.archive)
+        index_path = args.index or (f"{args.archive}.index.jsonl" if args.archive else None)
+        if index_path:
+            index = OutputIndex(index_path)
+    except (OSError, ValueError) as e:
+        print(f"无法打开输出: {e}", file=sys.stderr)
+        if journal is not None:
+            journal.close()
+        if sink is not None:
+            sink.close()
+        if executor is not None:
+            executor.shutdown()
+        return 2
+    
+    success_count = 0
+    failed_count = 0
+    skipped_count = 0
+    resumed_count = 0
+    duplicate_count = 0
+    limit_counts = Counter()
+    metrics = ConversionMetrics()
+    
+    def checkpoint():
+        """监视模式下定期保存清单、索引和指标，不必等到退出"""
+        if manifest is not None:
+            manifest.checkpoint(WATCH_CHECKPOINT_SECONDS)
+        if index is not None:
+            index.flush()
+        if time.monotonic() - checkpoint.metrics_at >= WATCH_CHECKPOINT_SECONDS:
+            checkpoint.metrics_at = time.monotonic()
+            if args.metrics_json:
+                metrics.write_json(args.metrics_json)
+            if args.metrics_textfile:
+                metrics.write_textfile(args.metrics_textfile)
+    checkpoint.metrics_at = time.monotonic()
+    
+    watcher = None
+    if args.watch:
+        watcher = FolderWatcher(args.files, settle=max(0.0, args.settle),
+                                poll_interval=max(0.1, args.poll_interval), use_inotify=not args.watch_poll)
+        msg_paths = watcher.paths(on_idle=checkpoint)
+        # 作为服务运行时被停止（SIGTERM）也按Ctrl+C处理，保存清单后退出
+        import signal
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    else:
+        msg_paths = expand_input_paths(args.files)
+    conversions = iter_conversions(msg_paths, args.output_dir, options,
+                                   executor=executor, manifest=manifest,
+                                   deduplicate=args.dedup, stages=stages,
+                                   sink=sink, index=index, journal=journal)
+    
+    try:
+        if watcher is not None:
+            if executor is not None:
+                warm_worker_pool(executor, args.jobs, options)
+            print(f"正在监视: {', '.join(watcher.roots)}（{watcher.mode}），按 Ctrl+C 停止")
+        for msg_file, result in conversions:
+            if watcher is not None:
+                checkpoint()
+            metrics.observe(result)
+            if 'duplicate_of' in result:
+                duplicate_count += 1
+            if result['status'] == 'success':
+                print(f"已完成: {msg_file} -> {format_output_location(result)}")
+                success_count += 1
+            elif result.get('resumed'):
+                resumed_count += 1
+            elif result['status'] == 'skipped':
+                skipped_count += 1
+            else:
+                label = RESULT_STATUS_LABELS.get(result['status'], '转换失败')
+                print(f"{label}: {msg_file}: {result['error']}", file=sys.stderr)
+                failed_count += 1
+                if result['status'] != 'failed':
+                    limit_counts[result['status']] += 1
+    except KeyboardInterrupt:
+        if watcher is None:
+            raise
+        print("已停止监视")
+    finally:
+        conversions.close()
+        if watcher is not None:
+            watcher.close()
+        if executor is not None:
+            # 监视模式下尚未开始的文件不再等待，下次启动时重新转换
+            executor.shutdown(cancel_futures=watcher is not None)
+        # 日志最后一次写入磁盘时还要刷新归档，在关闭归档之前关闭
+        if journal is not None:
+            journal.close()
+        # 先关闭归档（写入ZIP的中央目录等），再保存引用它的清单
+        if sink is not None:
+            sink.close()
+        if index is not None:
+            index.close()
+        if manifest is not None:
+            manifest.save()
+        metrics.finish()
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_textfile:
+            metrics.write_textfile(args.metrics_textfile)
+    
+    summary = f"转换完成！成功: {success_count} 个，失败: {failed_count} 个"
+    if skipped_count:
+        summary += f"，跳过未变化: {skipped_count} 个"
+    if limit_counts:
+        summary += "（其中" + "，".join(f"{RESULT_STATUS_LABELS[status]} {count} 个"
+                                      for status, count in sorted(limit_counts.items())) + "）"
+    if resumed_count:
+        summary += f"，续转跳过已完成: {resumed_count} 个"
+    if args.dedup:
+        summary += format_dedup_summary(duplicate_count, success_count + failed_count + skipped_count
+                                                                   + resumed_count)
+    print(summary)
+    return 0 if failed_count == 0 else 1
+
+
+def run_service(args):
+    """以HTTP服务方式运行（见 ConversionService），返回进程退出码"""
+    if not EXTRACT_MSG_AVAILABLE:
+        print("请先安装 extract-msg 和 chardet 库：pip install extract-msg chardet", file=sys.stderr)
+        return 2
+    
+    host, _, port = args.serve.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        print(f"无效的监听地址: {args.serve}", file=sys.stderr)
+        return 2
+    
+    import asyncio
+    service = ConversionService(options_from_args(args), args.jobs, max_queue=args.max_queue,
+                                max_upload_mb=args.max_upload_mb, limits=limits_from_args(args))
+    
+    def on_ready(address):
+        print(f"转换服务已启动: http://{address[0]}:{address[1]}/convert"
+              f"（{service.workers} 个工作进程，最多排队 {service.max_queue} 个），按 Ctrl+C 停止")
+    
+    try:
+        asyncio.run(service.serve(host.strip('[]') or '127.0.0.1', port, on_ready))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("转换服务已停止")
+    except OSError as e:
+        print(f"无法启动转换服务: {e}", file=sys.stderr)
+        return 2
+    finally:
+        service.close()
+    return 0
+
+
+def run_gui():
+    """启动图形界面"""
     root = tk.Tk()
     app = EnhancedMSGToEMLConverter(root)
     
     # 设置最小窗口大小
     root.minsize(800, 600)
     
-    # 居中显示窗口
+    root.mainloop()
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    
+    if args.serve:
+        return run_service(args)
+    if args.watch and not args.files:
+        # 没有指定文件夹时不要打开图形界面
+        print("监视模式需要指定文件夹", file=sys.stderr)
+        return 2
+    if args.files and not args.gui:
+        return run_cli(args)
     
+    if not import_gui():
+        print("当前环境没有tkinter，无法打开图形界面，请指定要转换的MSG文件", file=sys.stderr)
+        return 2
     
-    root.mainloop()
+    run_gui()
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""测试公用的夹具：加载转换器脚本，用 benchmarks/msg_corpus.py 生成MSG文件"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import msg_corpus  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def converter():
+    """转换器脚本模块（文件名包含连字符，不能直接import）
+
+    以可导入的名称注册到 sys.modules，工作进程才能找到其中的函数。
+    """
+    spec = importlib.util.spec_from_file_location('msg_to_eml_converter',
+                                                  os.path.join(ROOT, 'msg-to-eml-converter.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def msg_files(tmp_path):
+    """三个不带附件的小MSG文件"""
+    files = msg_corpus.generate_corpus(str(tmp_path / 'msg'), 3, seed=7, body_kb=(1, 4),
+                                       attachments=(0, 0), embedded_ratio=0)
+    return [path for path, _ in files]
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""命令行参数检查"""
+
+
+def test_watch_requires_folders(converter, capsys):
+    assert converter.main(['--watch']) == 2
+    assert "监视模式需要指定文件夹" in capsys.readouterr().err
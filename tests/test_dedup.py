@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""DuplicateDetector：按大小、抽样哈希、完整哈希逐层索引"""
+
+import os
+
+
+def write(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_same_size_files_are_told_apart(converter, tmp_path):
+    big = os.urandom(converter.DEDUP_SAMPLE_SIZE * 4)
+    middle = len(big) // 2 - 1
+    paths = [
+        write(tmp_path, 'a', b'a' * 1024),
+        write(tmp_path, 'b', b'b' * 1024),
+        write(tmp_path, 'a2', b'a' * 1024),
+        # 抽样相同、中间内容不同的大文件
+        write(tmp_path, 'big', big),
+        write(tmp_path, 'big_changed', big[:middle] + bytes([big[middle] ^ 0xff]) + big[middle + 1:]),
+        write(tmp_path, 'big2', big),
+    ]
+    detector = converter.DuplicateDetector()
+    originals = [detector.original_of(path) for path in paths]
+    assert originals == [None, None, paths[0], None, None, paths[3]]
+
+
+def test_unreadable_original_is_replaced(converter, tmp_path):
+    detector = converter.DuplicateDetector()
+    first = write(tmp_path, 'first', b'x' * 512)
+    assert detector.original_of(first) is None
+    os.remove(first)
+
+    second = write(tmp_path, 'second', b'x' * 512)
+    third = write(tmp_path, 'third', b'x' * 512)
+    assert detector.original_of(second) is None
+    assert detector.original_of(third) == second
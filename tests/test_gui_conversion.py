@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""不创建窗口，直接运行界面的转换线程 convert_files"""
+
+import os
+import queue
+
+import pytest
+
+
+class Var:
+    """代替Tk变量，只提供 get()"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def headless_app(converter, msg_files, output_dir, output_format):
+    app = object.__new__(converter.EnhancedMSGToEMLConverter)
+    for name in ('include_attachments', 'preserve_headers', 'auto_decode', 'detect_encoding',
+                 'preserve_transport_headers', 'show_ip_info'):
+        setattr(app, name, Var(True))
+    app.worker_count = Var(1)
+    app.file_timeout = Var(0)
+    app.incremental = Var(False)
+    app.deduplicate = Var(False)
+    app.output_format = Var(output_format)
+    app.output_dir = str(output_dir)
+    app.worker_pool = None
+    app.conversion_results = {}
+    app.ui_events = queue.Queue()
+    app.file_items = {}
+    app.path_index = {}
+    for number, path in enumerate(msg_files):
+        item = f'I{number}'
+        app.file_items[item] = {'path': path, 'filename': os.path.basename(path),
+                                'status': 'pending', 'output_file': None}
+        app.path_index[path] = item
+    return app
+
+
+def ui_events(app):
+    events = []
+    while not app.ui_events.empty():
+        events.append(app.ui_events.get())
+    return events
+
+
+@pytest.mark.parametrize('output_format', ['mbox', 'ZIP', 'tar'])
+def test_convert_files_to_archive(converter, msg_files, tmp_path, output_format):
+    app = headless_app(converter, msg_files, tmp_path / 'out', output_format)
+    feed = queue.Queue()
+    for path in msg_files:
+        feed.put(path)
+    feed.put(None)
+
+    app.convert_files(feed)
+
+    events = ui_events(app)
+    # 转换结束后恢复界面（在界面线程中调用 finish_conversion）
+    kind, (func, summary, _) = events[-1]
+    assert kind == 'call' and func == app.finish_conversion
+    assert f"成功: {len(msg_files)} 个" in summary
+    assert [args[0] for kind, args in events if kind == 'progress'] == [1, 2, 3]
+
+    suffix = converter.GUI_OUTPUT_FORMATS[output_format]
+    archive = tmp_path / 'out' / (converter.ARCHIVE_BASENAME + suffix)
+    assert archive.exists()
+    with open(f"{archive}.index.jsonl", encoding='utf-8') as f:
+        assert len(f.readlines()) == len(msg_files)
+    assert all(info['status'] == 'success' for info in app.file_items.values())
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""转换时记录的邮件头，以及从EML文件和归档中只读取邮件头"""
+
+import pytest
+
+
+def test_headers_are_opt_in(converter, msg_files, tmp_path):
+    options = converter.ConversionOptions()
+    results = [result for _, result in converter.iter_conversions(msg_files, str(tmp_path), options)]
+    assert all(result['status'] == 'success' and 'headers' not in result for result in results)
+
+
+@pytest.mark.parametrize('suffix', [None, '.mbox', '.zip', '.tar', '.tar.gz'])
+def test_read_output_headers_matches_conversion(converter, msg_files, tmp_path, suffix):
+    options = converter.ConversionOptions(collect_headers=True)
+    sink = index = None
+    if suffix:
+        sink = converter.open_archive_sink(str(tmp_path / ('out' + suffix)))
+        index = converter.OutputIndex(f"{sink.path}.index.jsonl")
+    try:
+        results = list(converter.iter_conversions(msg_files, str(tmp_path / 'out'), options,
+                                                  sink=sink, index=index))
+    finally:
+        if sink is not None:
+            sink.close()
+            index.close()
+
+    for msg_path, result in results:
+        expected = [(name, value) for name, value, _ in result['headers']]
+        assert [(name, value) for name, value in converter.read_output_headers(result)] == expected
+        if suffix:
+            # 增量转换跳过的文件只有归档路径，位置从输出索引中查找
+            location = converter.OutputIndex.lookup(index.path, msg_path)
+            assert [(name, value) for name, value in converter.read_output_headers(location)] == expected
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""转换服务：请求头检查、上传和下载"""
+
+import asyncio
+import contextlib
+import http.client
+import socket
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def service(converter):
+    """在后台线程中运行的转换服务，返回端口"""
+    svc = converter.ConversionService(converter.ConversionOptions(), 1)
+    ready = threading.Event()
+    running = {}
+
+    def on_ready(sockname):
+        running['port'] = sockname[1]
+        ready.set()
+
+    async def serve():
+        running['loop'] = asyncio.get_running_loop()
+        running['task'] = asyncio.current_task()
+        await svc.serve('127.0.0.1', 0, on_ready)
+
+    def run():
+        # 与 run_service 相同，由asyncio.run在结束时取消仍在等待的连接
+        with contextlib.suppress(asyncio.CancelledError):
+            asyncio.run(serve())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert ready.wait(60)
+    yield running['port']
+    running['loop'].call_soon_threadsafe(running['task'].cancel)
+    thread.join(30)
+    svc.close()
+
+
+def raw_request(port, request):
+    with socket.create_connection(('127.0.0.1', port), timeout=30) as sock:
+        sock.sendall(request)
+        response = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return response
+            response += data
+
+
+@pytest.mark.parametrize('path', ['/health', '/convert'])
+@pytest.mark.parametrize('length', ['abc', '-1', '1_0'])
+def test_invalid_content_length_is_rejected(service, path, length):
+    response = raw_request(service, f"POST {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {length}\r\n\r\n"
+                                    .encode('ascii'))
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert "无效的Content-Length".encode('utf-8') in response
+
+
+def test_convert_round_trip(service, msg_files):
+    with open(msg_files[0], 'rb') as f:
+        data = f.read()
+    connection = http.client.HTTPConnection('127.0.0.1', service, timeout=60)
+    try:
+        connection.request('POST', '/convert?name=a.msg', body=data)
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    assert response.status == 200
+    assert response.getheader('Content-Type') == 'message/rfc822'
+    assert len(body) == int(response.getheader('Content-Length')) > 0
+    assert b'\nSubject: ' in body
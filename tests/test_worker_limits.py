@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""转换进程池：崩溃后换新并重新提交在途文件、被终止的工作进程留下的文件、启动失败的工作进程"""
+
+import os
+import time
+
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+
+def stalled_write_eml(self, email_msg, fp):
+    """写出一部分后卡住，直到工作进程因超时被杀掉"""
+    fp.write(b'From: partial\r\n')
+    fp.flush()
+    time.sleep(60)
+
+
+def exit_at_startup():
+    os._exit(3)
+
+
+def test_process_pool_recovers_after_worker_crash(converter):
+    pool = converter.create_worker_pool(2)
+    try:
+        old_pids = {pool.submit(os.getpid).result(timeout=30) for _ in range(4)}
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result(timeout=30)
+        # 下一个任务在新的进程池中执行
+        assert pool.submit(os.getpid).result(timeout=30) not in old_pids
+    finally:
+        pool.shutdown()
+
+
+def test_conversions_survive_killed_worker(converter, msg_files, tmp_path, monkeypatch):
+    marker = str(tmp_path / 'crashed')
+    read_message = converter.MSGConversionEngine.read_message
+
+    def read_message_or_exit(self, msg_path):
+        # 第一个开始转换的工作进程直接退出，之后的转换正常进行
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return read_message(self, msg_path)
+        os._exit(1)
+
+    # 工作进程由fork创建，继承替换后的读取函数
+    monkeypatch.setattr(converter.MSGConversionEngine, 'read_message', read_message_or_exit)
+    output_dir = tmp_path / 'out'
+    pool = converter.create_worker_pool(2)
+    try:
+        results = list(converter.iter_conversions(msg_files, str(output_dir), converter.ConversionOptions(),
+                                                  executor=pool))
+    finally:
+        pool.shutdown()
+
+    assert os.path.exists(marker)
+    assert sorted(msg_path for msg_path, _ in results) == sorted(msg_files)
+    assert [result['status'] for _, result in results] == ['success'] * 3
+    assert sorted(os.listdir(output_dir)) == sorted(os.path.basename(result['output_file'])
+                                                    for _, result in results)
+
+
+@pytest.mark.parametrize('use_journal', [False, True])
+def test_killed_worker_leaves_no_partial_output(converter, msg_files, tmp_path, monkeypatch, use_journal):
+    # 工作进程由fork创建，继承替换后的写出函数
+    monkeypatch.setattr(converter.MSGConversionEngine, 'write_eml', stalled_write_eml)
+    output_dir = tmp_path / 'out'
+    options = converter.ConversionOptions()
+    journal = None
+    if use_journal:
+        journal = converter.ConversionJournal(str(tmp_path / 'journal.jsonl'),
+                                              converter.options_fingerprint(options), str(output_dir), None)
+    pool = converter.SupervisedWorkerPool(2, converter.WorkerLimits(timeout=1))
+    try:
+        results = list(converter.iter_conversions(msg_files[:2], str(output_dir), options,
+                                                  executor=pool, journal=journal))
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if journal is not None:
+            journal.close()
+
+    assert [result['status'] for _, result in results] == ['timeout', 'timeout']
+    assert os.listdir(output_dir) == []
+
+
+def test_startup_failures_fail_pending_tasks(converter, monkeypatch):
+    monkeypatch.setattr(converter, 'WORKER_RESTART_DELAY', 0.01)
+    pool = converter.SupervisedWorkerPool(2, converter.WorkerLimits(timeout=5), exit_at_startup)
+    try:
+        futures = [pool.submit(os.getpid) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(converter.WorkerTerminated):
+                future.result(timeout=30)
+        # 不再启动新的工作进程，之后提交的任务直接失败
+        with pytest.raises(converter.WorkerTerminated):
+            pool.submit(os.getpid).result(timeout=1)
+    finally:
+        pool.shutdown()
+
+
+def test_killed_worker_keeps_file_created_by_others(converter, msg_files, tmp_path, monkeypatch):
+    monkeypatch.setattr(converter.MSGConversionEngine, 'write_eml', stalled_write_eml)
+    allocate = converter.OutputNameAllocator.allocate
+    foreign = []
+
+    def allocate_then_taken(self, msg_path, output_dir=None):
+        # 分配文件名之后、转换之前，其他程序创建了同名文件
+        path = allocate(self, msg_path, output_dir)
+        if not foreign:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'not ours')
+            foreign.append(path)
+        return path
+
+    monkeypatch.setattr(converter.OutputNameAllocator, 'allocate', allocate_then_taken)
+    output_dir = tmp_path / 'out'
+    pool = converter.SupervisedWorkerPool(1, converter.WorkerLimits(timeout=1))
+    try:
+        results = list(converter.iter_conversions(msg_files[:1], str(output_dir), converter.ConversionOptions(),
+                                                  executor=pool))
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    assert [result['status'] for _, result in results] == ['timeout']
+    assert os.listdir(output_dir) == [os.path.basename(foreign[0])]
+    with open(foreign[0], 'rb') as f:
+        assert f.read() == b'not ours'